@@ -37,6 +37,12 @@ from . import operators
 from . import anno_objects
 from . import anno_object_ui
 from . import feedback_ui
+from . import scene_index
+from . import material_cache
+from . import texture_registry
+from . import blob_store
+from . import cfg_cache
+from . import path_index
 from .operator import cfg_operators
 from .operator import fc_operators
 
@@ -53,6 +59,12 @@ def register():
     prefs.register()
     anno_objects.register()
     anno_object_ui.register()
+    scene_index.register()
+    material_cache.register()
+    texture_registry.register()
+    blob_store.register()
+    cfg_cache.register()
+    path_index.register()
     
     feedback_ui.register()
     
@@ -65,6 +77,12 @@ def unregister():
     prefs.unregister()
     anno_objects.unregister()
     anno_object_ui.unregister()
+    scene_index.unregister()
+    material_cache.unregister()
+    texture_registry.unregister()
+    blob_store.unregister()
+    cfg_cache.unregister()
+    path_index.unregister()
     
     feedback_ui.unregister()
 
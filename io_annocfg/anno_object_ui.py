@@ -1,7 +1,9 @@
 ﻿from __future__ import annotations
 import bpy
+from bpy.app.handlers import persistent
 from bpy.types import Object as BlenderObject
 import xml.etree.ElementTree as ET
+import zlib
 from pathlib import Path
 from typing import Tuple, List, NewType, Any, Union, Dict, Optional, TypeVar, Type
 from bpy.props import EnumProperty, BoolProperty, PointerProperty, IntProperty, FloatProperty, CollectionProperty, StringProperty, FloatVectorProperty
@@ -9,11 +11,16 @@ from bpy.types import PropertyGroup, Panel, Operator, UIList
 import bmesh
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from .prefs import IO_AnnocfgPreferences
+from itertools import islice
+from .prefs import IO_AnnocfgPreferences, with_settings_snapshot
 from .utils import *
 from . import feedback_enums
 from . import helpstrings
 from .material import Material, ClothMaterial
+from .conversion_plan import ConversionPlan
+from .scene_index import SceneIndex
+from .tag_index import TagIndex, tag_changed, clear_tag_indices
+from .xml_writer import StreamingXMLWriter
 from .anno_objects import get_anno_object_class,anno_object_classes, set_anno_object_class, MainFile, Model, Cf7File, SubFile, Decal, Propcontainer, Prop, Particle, IfoPlane, Sequence, DummyGroup,\
     Cf7DummyGroup, Cf7Dummy, FeedbackConfig, SimpleAnnoFeedbackEncodingObject, ArbitraryXMLAnnoObject, Light, Cloth, IfoFile, Spline, IslandFile, PropGridInstance, \
     IslandGamedataFile, GameObject, AnimationsNode, Animation, AnimationSequence, AnimationSequences, Track, TrackElement, IfoMeshHeightmap, NoAnnoObject, Dummy, BezierCurve, AssetsXML
@@ -34,11 +41,11 @@ class XMLTooltip(Operator):
         return properties.arg
 
 class BoolPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeBool") # type: ignore
+    tag : StringProperty(name = "", default = "SomeBool", update = tag_changed) # type: ignore
     value : BoolProperty(name = "", default = False) # type: ignore
 
 class FeedbackSequencePropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeSequence") # type: ignore
+    tag : StringProperty(name = "", default = "SomeSequence", update = tag_changed) # type: ignore
     value : EnumProperty( # type: ignore
         name='',
         description='Animation Sequence',
@@ -47,25 +54,25 @@ class FeedbackSequencePropertyGroup(PropertyGroup):
     )
 
 class IntPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeInt") # type: ignore
+    tag : StringProperty(name = "", default = "SomeInt", update = tag_changed) # type: ignore
     value : IntProperty(name = "", default = 0) # type: ignore
 class StringPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeString") # type: ignore
+    tag : StringProperty(name = "", default = "SomeString", update = tag_changed) # type: ignore
     value : StringProperty(name = "", default = "") # type: ignore
 
 class FilenamePropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeString") # type: ignore
+    tag : StringProperty(name = "", default = "SomeString", update = tag_changed) # type: ignore
     value : StringProperty(name = "", default = "", subtype = "FILE_PATH") # type: ignore
 class FloatPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeFloat") # type: ignore
+    tag : StringProperty(name = "", default = "SomeFloat", update = tag_changed) # type: ignore
     value : FloatProperty(name = "", default = 0.0) # type: ignore
     
 class ColorPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeColor") # type: ignore
+    tag : StringProperty(name = "", default = "SomeColor", update = tag_changed) # type: ignore
     value : FloatVectorProperty(name = "", default = [0.0, 0.0, 0.0], subtype = "COLOR", min= 0.0, max = 1.0) # type: ignore
 
 class ObjectPointerPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "SomeObject") # type: ignore
+    tag : StringProperty(name = "", default = "SomeObject", update = tag_changed) # type: ignore
     value : PointerProperty(name = "", type= bpy.types.Object) # type: ignore
 
 
@@ -208,8 +215,163 @@ def get_converter_for(tag, value_string):
     #TODO: CDATA Converter, mIdleSequenceConverter, etc
     return StringConverter
 
+collection_name_by_converter = {
+    BoolConverter: "boolean_properties",
+    StringConverter: "string_properties",
+    IntConverter: "int_properties",
+    FloatConverter: "float_properties",
+    ColorConverter: "color_properties",
+    ObjectPointerConverter: "object_pointer_properties",
+    FeedbackSequenceConverter: "feedback_sequence_properties",
+}
+# Search order of XMLPropertyGroup.remove
+removable_collection_names = ["feedback_sequence_properties", "boolean_properties", "filename_properties", "string_properties",
+                              "int_properties", "float_properties", "color_properties", "dynamic_properties"]
+# Collections with scalar values, these are read and written with foreach_get/foreach_set.
+foreach_collection_names = {"boolean_properties", "int_properties", "float_properties"}
+
+
+class CompactXML():
+    """Compact storage of the dynamic_properties of an object: the residual node as one zlib compressed ID property,
+    instead of one property group item per tag (recursively). Used for imports if enabled in the preferences.
+
+    The XMLPropertyGroup functions (to_node, get_string, set, ...) work on the compressed node directly.
+    The editable property groups are only created when the Anno Object panel shows the object (expand, deferred to a timer
+    since draw functions cannot write to objects). They are compressed again when another compact object is shown and before saving.
+    Nodes referencing other objects (BlenderModelID, ...) are never compacted, the reference would not follow renames.
+    """
+    PROPERTY_NAME = "anno_compact_xml"
+    COMPRESSION_LEVEL = 6
+    
+    # session_uid -> object name
+    expanded: Dict[int, str] = {}
+    pending: Dict[int, str] = {}
+    
+    @classmethod
+    def owner(cls, group) -> Optional[BlenderObject]:
+        """The object if group is its dynamic_properties, None for nested groups and materials."""
+        owner = group.id_data
+        if not isinstance(owner, bpy.types.Object) or owner.dynamic_properties.as_pointer() != group.as_pointer():
+            return None
+        return owner
+    
+    @classmethod
+    def is_compact(cls, group) -> bool:
+        owner = cls.owner(group)
+        return owner is not None and cls.PROPERTY_NAME in owner
+    
+    @classmethod
+    def can_compact(cls, node: ET.Element) -> bool:
+        for subnode in node.iter():
+            if converter_by_tag.get(subnode.tag) == ObjectPointerConverter:
+                return False
+        return True
+    
+    @classmethod
+    def load(cls, obj) -> ET.Element:
+        return ET.fromstring(zlib.decompress(bytes(obj[cls.PROPERTY_NAME])))
+    
+    @classmethod
+    def store(cls, obj, node: ET.Element):
+        obj[cls.PROPERTY_NAME] = zlib.compress(ET.tostring(node), cls.COMPRESSION_LEVEL)
+    
+    @classmethod
+    def collection_name_of(cls, node: ET.Element) -> Optional[str]:
+        """The XMLPropertyGroup collection the node would be stored in."""
+        if len(node) > 0:
+            return "dynamic_properties"
+        if node.tag == "ConfigType":
+            return None
+        return XMLPropertyGroup.collection_name_for(node.tag, get_converter_for(node.tag, node.text or ""))
+    
+    @classmethod
+    def find(cls, node: ET.Element, collection_name: str, tag: str) -> Optional[ET.Element]:
+        for child in node:
+            if child.tag == tag and cls.collection_name_of(child) == collection_name:
+                return child
+        return None
+    
+    @classmethod
+    def expand(cls, obj):
+        """Converts the compressed node of the object into editable property groups."""
+        if cls.PROPERTY_NAME not in obj:
+            return
+        node = cls.load(obj)
+        del obj[cls.PROPERTY_NAME]
+        obj.dynamic_properties.reset()
+        obj.dynamic_properties.from_node(node, compact = False)
+    
+    @classmethod
+    def collapse(cls, obj):
+        """Compresses the property groups of the object into one node again."""
+        group = obj.dynamic_properties
+        if cls.PROPERTY_NAME in obj or not group.tag:
+            return
+        node = group.to_node(ET.Element(group.tag))
+        if not cls.can_compact(node):
+            return
+        group.reset()
+        group.config_type = ""
+        cls.store(obj, node)
+    
+    @classmethod
+    def find_object(cls, session_uid: int, name: str) -> Optional[BlenderObject]:
+        obj = bpy.data.objects.get(name)
+        if obj is not None and obj.session_uid == session_uid:
+            return obj
+        for obj in bpy.data.objects:
+            if obj.session_uid == session_uid:
+                return obj
+        return None
+    
+    @classmethod
+    def request_expansion(cls, obj):
+        cls.pending[obj.session_uid] = obj.name
+        if not bpy.app.timers.is_registered(cls.process_pending):
+            bpy.app.timers.register(cls.process_pending)
+    
+    @classmethod
+    def process_pending(cls):
+        for session_uid, name in list(cls.expanded.items()):
+            if session_uid in cls.pending:
+                continue
+            obj = cls.find_object(session_uid, name)
+            if obj is not None:
+                cls.collapse(obj)
+            del cls.expanded[session_uid]
+        for session_uid, name in cls.pending.items():
+            obj = cls.find_object(session_uid, name)
+            if obj is None:
+                continue
+            cls.expand(obj)
+            cls.expanded[session_uid] = obj.name
+        cls.pending = {}
+        for window in bpy.context.window_manager.windows:
+            for area in window.screen.areas:
+                area.tag_redraw()
+        return None
+    
+    @classmethod
+    def collapse_all(cls):
+        for session_uid, name in cls.expanded.items():
+            obj = cls.find_object(session_uid, name)
+            if obj is not None:
+                cls.collapse(obj)
+        cls.expanded = {}
+
+
+@persistent
+def collapse_compact_xml(*args):
+    CompactXML.collapse_all()
+
+@persistent
+def clear_compact_xml(*args):
+    CompactXML.expanded = {}
+    CompactXML.pending = {}
+
+
 class XMLPropertyGroup(PropertyGroup):
-    tag : StringProperty(name = "", default = "") # type: ignore    
+    tag : StringProperty(name = "", default = "", update = tag_changed) # type: ignore    
     config_type : StringProperty(name = "", default = "") # type: ignore
     
     feedback_sequence_properties : CollectionProperty(name = "FeedbackSequences", type = FeedbackSequencePropertyGroup) # type: ignore
@@ -238,96 +400,186 @@ class XMLPropertyGroup(PropertyGroup):
         self.dynamic_properties.clear()
         self.deleted = False
         self.hidden = False
+        TagIndex.invalidate(self)
+        owner = CompactXML.owner(self)
+        if owner is not None and CompactXML.PROPERTY_NAME in owner:
+            del owner[CompactXML.PROPERTY_NAME]
     
     def remove(self, tag):
-        for container in [self.feedback_sequence_properties, 
-                          self.boolean_properties,
-                          self.filename_properties,
-                          self.string_properties,
-                          self.int_properties,
-                          self.float_properties,
-                          self.color_properties,
-                          self.dynamic_properties]:
-            for i,prop in enumerate(container):
-                if prop.tag == tag:
-                    container.remove(i)
+        if CompactXML.is_compact(self):
+            owner = CompactXML.owner(self)
+            node = CompactXML.load(owner)
+            for collection_name in removable_collection_names:
+                child = CompactXML.find(node, collection_name, tag)
+                if child is not None:
+                    node.remove(child)
+                    CompactXML.store(owner, node)
                     return True
+            return False
+        for collection_name in removable_collection_names:
+            index = TagIndex.lookup(self, collection_name, tag)
+            if index >= 0:
+                getattr(self, collection_name).remove(index)
+                TagIndex.invalidate(self, collection_name)
+                return True
         return False
     
     def get_string(self, tag, default = None):
-        for item in self.string_properties:
-            if item.tag == tag:
-                return item.value
-        for item in self.filename_properties:
-            if item.tag == tag:
+        if CompactXML.is_compact(self):
+            node = CompactXML.load(CompactXML.owner(self))
+            for collection_name in ["string_properties", "filename_properties"]:
+                child = CompactXML.find(node, collection_name, tag)
+                if child is not None:
+                    return StringConverter.from_string(child.text or "")
+            return default
+        for collection_name in ["string_properties", "filename_properties"]:
+            index, item = TagIndex.find(self, collection_name, tag)
+            if index >= 0:
                 return item.value
         return default
     
     def get_int(self, tag, default = None):
-        for item in self.int_properties:
-            if item.tag == tag:
-                return item.value
+        if CompactXML.is_compact(self):
+            child = CompactXML.find(CompactXML.load(CompactXML.owner(self)), "int_properties", tag)
+            if child is not None:
+                return IntConverter.from_string(child.text)
+            return default
+        index, item = TagIndex.find(self, "int_properties", tag)
+        if index >= 0:
+            return item.value
         return default
     
+    @staticmethod
+    def collection_name_for(tag, converter) -> str:
+        if tag == "FileName":
+            return "filename_properties"
+        return collection_name_by_converter[converter]
+    
     def set(self, tag, value_string, replace = False):
         converter = get_converter_for(tag, value_string)
         value = converter.from_string(value_string)
         
+        if CompactXML.is_compact(self):
+            self.set_compact(tag, converter.to_string(value), converter, replace)
+            return
+        
         # Special fields
         if tag == "ConfigType":
             self.config_type = value
             return          
 
-        properties_by_converter = {
-            BoolConverter: self.boolean_properties,
-            StringConverter: self.string_properties,
-            IntConverter: self.int_properties,
-            FloatConverter: self.float_properties,
-            ColorConverter: self.color_properties,
-            ObjectPointerConverter: self.object_pointer_properties,
-            FeedbackSequenceConverter: self.feedback_sequence_properties,
-        }  
-        
-        properties = properties_by_converter[converter]
-        if tag == "FileName":
-            properties = self.filename_properties
+        collection_name = self.collection_name_for(tag, converter)
+        properties = getattr(self, collection_name)
         if replace:
-            for item in properties:
-                if item.tag == tag:
-                    item.value = value
-                    return
-        properties.add()
-        properties[-1].tag = tag
-        properties[-1].value = value
+            index, item = TagIndex.find(self, collection_name, tag)
+            if index >= 0:
+                item.value = value
+                return
+        item = properties.add()
+        item.tag = tag
+        item.value = value
+        TagIndex.appended(self, collection_name, tag)
+    
+    def set_compact(self, tag, value_string, converter, replace):
+        owner = CompactXML.owner(self)
+        node = CompactXML.load(owner)
+        if tag == "ConfigType":
+            find_or_create(node, "ConfigType").text = value_string
+        else:
+            child = CompactXML.find(node, self.collection_name_for(tag, converter), tag) if replace else None
+            if child is None:
+                child = ET.SubElement(node, tag)
+            child.text = value_string
+        CompactXML.store(owner, node)
+    
+    def is_empty(self) -> bool:
+        return all(len(getattr(self, collection_name)) == 0 for collection_name in removable_collection_names + ["object_pointer_properties"])
+    
+    def add_items(self, collection_name, items):
+        """Appends all (tag, value) items to the collection at once."""
+        properties = getattr(self, collection_name)
+        start = len(properties)
+        for _ in range(len(items)):
+            properties.add()
+        if start == 0 and collection_name in foreach_collection_names:
+            properties.foreach_set("value", [value for tag, value in items])
+            for item, (tag, value) in zip(properties, items):
+                item.tag = tag
+        else:
+            # Indexing a collection walks it up to the index, the new items are iterated instead.
+            for item, (tag, value) in zip(islice(properties, start, None), items):
+                item.tag = tag
+                item.value = value
+        TagIndex.invalidate(self, collection_name)
+    
+    def values(self, collection_name) -> list:
+        properties = getattr(self, collection_name)
+        if collection_name in foreach_collection_names:
+            values = [0] * len(properties)
+            properties.foreach_get("value", values)
+            return values
+        return [item.value for item in properties]
         
-    def from_node(self, node):
+    def from_node(self, node, compact = None):
+        if compact is None:
+            compact = IO_AnnocfgPreferences.compact_dynamic_properties()
+        if compact or CompactXML.is_compact(self):
+            owner = CompactXML.owner(self)
+            if owner is not None and self.is_empty() and CompactXML.can_compact(node):
+                if CompactXML.PROPERTY_NAME in owner:
+                    compact_node = CompactXML.load(owner)
+                    compact_node.extend(list(node))
+                    compact_node.tag = node.tag
+                    node = compact_node
+                self.tag = node.tag
+                CompactXML.store(owner, node)
+                return self
+            if owner is not None:
+                CompactXML.expand(owner)
         self.tag = node.tag
-        for child_node in list(node):
-            if len(list(child_node)) == 0:
+        # Converted first and then added per collection, instead of one set() (and collection lookup) per child.
+        items_by_collection = defaultdict(list)
+        for child_node in node:
+            if len(child_node) == 0:
                 value = child_node.text
                 if value is None:
                     value = ""
-                self.set(child_node.tag, value)
+                converter = get_converter_for(child_node.tag, value)
+                value = converter.from_string(value)
+                if child_node.tag == "ConfigType":
+                    self.config_type = value
+                    continue
+                items_by_collection[self.collection_name_for(child_node.tag, converter)].append((child_node.tag, value))
             else:
-                self.dynamic_properties.add()
-                self.dynamic_properties[-1].from_node(child_node)
+                self.dynamic_properties.add().from_node(child_node, compact = False)
+        for collection_name, items in items_by_collection.items():
+            self.add_items(collection_name, items)
+        TagIndex.invalidate(self, "dynamic_properties")
         return self
 
     def to_node(self, target_node):
+        if CompactXML.is_compact(self):
+            node = CompactXML.load(CompactXML.owner(self))
+            target_node.tag = node.tag
+            target_node.extend(list(node))
+            return target_node
         target_node.tag = self.tag
         if self.config_type:
             find_or_create(target_node, "ConfigType").text = self.config_type
-        for property_group, converter in [
-                            (self.feedback_sequence_properties, FeedbackSequenceConverter),
-                            (self.string_properties, StringConverter),
-                            (self.int_properties, IntConverter),
-                            (self.filename_properties, StringConverter),
-                            (self.float_properties, FloatConverter),
-                            (self.object_pointer_properties, ObjectPointerConverter),
-                            (self.boolean_properties, BoolConverter),
+        for collection_name, converter in [
+                            ("feedback_sequence_properties", FeedbackSequenceConverter),
+                            ("string_properties", StringConverter),
+                            ("int_properties", IntConverter),
+                            ("filename_properties", StringConverter),
+                            ("float_properties", FloatConverter),
+                            ("object_pointer_properties", ObjectPointerConverter),
+                            ("boolean_properties", BoolConverter),
                         ]:
-            for prop in property_group:
-                value_string = converter.to_string(prop.value)
+            property_group = getattr(self, collection_name)
+            if len(property_group) == 0:
+                continue
+            for prop, value in zip(property_group, self.values(collection_name)):
+                value_string = converter.to_string(value)
                 #It is better to always create a new subelement - otherwise there can only be one of each tag.
                 #Or does this create any problems?
                 #find_or_create(target_node, prop.tag).text = value_string
@@ -343,6 +595,10 @@ class XMLPropertyGroup(PropertyGroup):
         col = layout.column()
         header = col.row()
         split = header.split(factor=0.6)
+        if first_level_property and CompactXML.is_compact(self):
+            col.label(text = f"{self.tag}: Loading properties...")
+            CompactXML.request_expansion(CompactXML.owner(self))
+            return
         split.label(text = f"{self.tag}: {self.config_type}")
         split.prop(self, "hidden", icon = "HIDE_OFF")
         if not first_level_property:
@@ -404,6 +660,7 @@ class PasteFromClipboardOperator(Operator):
     bl_idname = "import.paste_from_clipboard" 
     bl_label = "Import From Clipboard (Anno)"
     anno_object_by_enum = {str(cls):cls for cls in anno_object_classes}
+    @with_settings_snapshot
     def execute(self, context):
         import itertools as IT
         # if not self.path.suffix == ".xml" or not self.path.exists():
@@ -421,7 +678,7 @@ class PasteFromClipboardOperator(Operator):
             self.report({'ERROR_INVALID_INPUT'}, f"Invalid XML: {err}\n{line}")
             return {"CANCELLED"}
         if anno_object == GameObject:
-            assetsXML = AssetsXML()
+            assetsXML = AssetsXML.get_instance()
             obj = anno_object.xml_to_blender(node, assetsXML)
         else:
             obj = anno_object.xml_to_blender(node)
@@ -498,6 +755,7 @@ class CreateGameObjectFromFile(Operator):
     bl_idname = "object.make_game_object"
     bl_label = "Make Game Object (Island Editor)"
 
+    @with_settings_snapshot
     def execute(self, context):
         obj = context.active_object
         game_obj = GameObject.parent_for_subfile(obj)
@@ -509,13 +767,14 @@ class ConvertToXML(Operator):
     bl_idname = "object.convert_to_xml"
     bl_label = "Convert To XML"
 
+    @with_settings_snapshot
     def execute(self, context):
         obj = context.active_object
         node = get_anno_object_class(obj).blender_to_xml(obj, None, None)
-        ET.indent(node, space="\t", level=0)
-        xmlstr = ET.tostring(node, encoding='utf8', method='xml')
-        xmlstr = xmlstr.replace("<?xml version='1.0' encoding='utf8'?>\n".encode(), "".encode())
-        bpy.context.window_manager.clipboard = xmlstr
+        if node is None:
+            self.report({'ERROR'}, f"Could not convert {obj.name} to xml.")
+            return {'CANCELLED'}
+        bpy.context.window_manager.clipboard = StreamingXMLWriter.tostring(node)
         return {'FINISHED'}    
 
 class ExportPosition(Operator):
@@ -664,7 +923,7 @@ def load_animations_for_model(obj):
         for anim_obj in animations_container.children:
             for armature in anim_obj.children:
                 for anim_mesh in armature.children:
-                    for m_idx, material in enumerate(obj.data.materials):
+                    for m_idx, material in enumerate([slot.material for slot in obj.material_slots]):
                         if m_idx >= len(anim_mesh.data.materials):
                             break
                         anim_mesh.data.materials[m_idx] = material 
@@ -734,6 +993,7 @@ class LoadAnimations(Operator):
     bl_idname = "object.load_animations"
     bl_label = "Load Animations"
 
+    @with_settings_snapshot
     def execute(self, context):
         obj = context.active_object
         load_animations_for_model(obj)
@@ -751,18 +1011,30 @@ class LoadAllAnimations(Operator):
             load_animations_for_model(obj)
         for child in obj.children:
             self.load_animations_recursively(child)
+            
+    def plan_animations_recursively(self, obj, plan):
+        if get_anno_object_class(obj) == Model:
+            node = obj.dynamic_properties.to_node(ET.Element("Config"))
+            for anim_node in node.findall("Animations/Config"):
+                plan.add_animation(get_text(node, "FileName"), get_text(anim_node, "FileName"))
+        for child in obj.children:
+            self.plan_animations_recursively(child, plan)
+            
+    @with_settings_snapshot
     def execute(self, context):
         main_obj = context.active_object
+        plan = ConversionPlan()
+        self.plan_animations_recursively(main_obj, plan)
+        plan.execute()
         self.load_animations_recursively(main_obj)
         return {'FINISHED'}
  
 def get_main_file_obj(obj):
     main_file_obj = obj
-    while get_anno_object_class(main_file_obj) != MainFile:
-        if main_file_obj.parent is not None:
-            main_file_obj = main_file_obj.parent
-    if get_anno_object_class(main_file_obj) == MainFile:
-        return main_file_obj
+    while main_file_obj is not None:
+        if SceneIndex.class_name(main_file_obj) == MainFile.__name__:
+            return main_file_obj
+        main_file_obj = main_file_obj.parent
     return None   
     
 class DuplicateAnnoObject(Operator):
@@ -809,6 +1081,7 @@ class DuplicateAnnoObject(Operator):
         for child in obj.children:
             self.fix_object_references(child)
     
+    @with_settings_snapshot
     def execute(self, context):
         main_obj = context.active_object
         self.original_to_duplicate = {}
@@ -820,6 +1093,61 @@ class DuplicateAnnoObject(Operator):
         return {'FINISHED'}
  
     
+def get_subfile_instance_obj(obj):
+    if obj.instance_collection is not None and "anno_subfile" in obj.instance_collection:
+        return obj
+    if get_anno_object_class(obj) == SubFile:
+        for child in obj.children:
+            if child.instance_collection is not None and "anno_subfile" in child.instance_collection:
+                return child
+    return None
+
+class MakeSubfileInstanceReal(DuplicateAnnoObject):
+    """Replaces the instance of a repeated subfile with a real copy of its objects (including object references in the sequences), so that this copy can be edited on its own."""
+    bl_idname = "object.make_subfile_instance_real"
+    bl_label = "Make Subfile Real"
+
+    def duplicate_recursively(self, obj):
+        # The objects of the subfile collection are not part of the view layer, so there is no hide state to copy.
+        dup = obj.copy()
+        if obj.data is not None:
+            dup.data = obj.data.copy()
+        bpy.context.scene.collection.objects.link(dup)
+        self.original_to_duplicate[obj.name] = dup.name
+        for child in obj.children:
+            child_dup = self.duplicate_recursively(child)
+            child_dup.parent = dup
+        return dup
+
+    @with_settings_snapshot
+    def execute(self, context):
+        instance_obj = get_subfile_instance_obj(context.active_object)
+        collection = instance_obj.instance_collection
+        self.original_to_duplicate = {}
+        # Keeps the objects where the instance displayed them.
+        offset = instance_obj.matrix_parent_inverse @ instance_obj.matrix_basis @ mathutils.Matrix.Translation(-collection.instance_offset)
+        duplicates = []
+        for obj in collection.objects:
+            if obj.parent is not None:
+                continue
+            dup = self.duplicate_recursively(obj)
+            dup.parent = instance_obj.parent
+            dup.matrix_parent_inverse = offset
+            duplicates.append(dup)
+        for dup in duplicates:
+            self.fix_object_references(dup)
+        bpy.data.objects.remove(instance_obj, do_unlink=True)
+        if duplicates:
+            bpy.context.view_layer.objects.active = duplicates[0]
+        return {'FINISHED'}
+
+    @classmethod
+    def poll(cls, context):
+        if not context.active_object:
+            return False
+        return get_subfile_instance_obj(context.active_object) is not None
+
+
 class ShowSequence(Operator):
     """Makes all animations belonging to this sequence visible and all others invisible. Also changes the display mode of the main models into Wireframe."""
     bl_idname = "object.show_sequence"
@@ -828,12 +1156,12 @@ class ShowSequence(Operator):
     
     def set_hide_viewport_recursive(self, obj, hide):
         obj.hide_set(state=hide)
-        for o in obj.children:
+        for o in SceneIndex.children(obj):
             self.set_hide_viewport_recursive(o, hide)
 
     def show_animation(self, model_obj, animation_id):
-        for animations_obj in model_obj.children:
-            for i, anim_obj in enumerate(animations_obj.children):
+        for animations_obj in SceneIndex.children(model_obj):
+            for i, anim_obj in enumerate(SceneIndex.children(animations_obj)):
                 anim_node = anim_obj.dynamic_properties.to_node(ET.Element("Config"))
                 anim_idx = get_text(anim_node, "AnimationIndex")
                 if animation_id == anim_idx:
@@ -841,48 +1169,43 @@ class ShowSequence(Operator):
                 else:
                     self.set_hide_viewport_recursive(anim_obj, True)
     def show_sequence(self, seq_obj):
-        for track_obj in seq_obj.children:
+        for track_obj in SceneIndex.children(seq_obj):
             track_node = track_obj.dynamic_properties.to_node(ET.Element("Track"))
             for track_element_node in track_node.findall("TrackElement"):
                 model_name = get_text(track_element_node, "BlenderModelID", "")
                 animation_id = get_text(track_element_node, "AnimationID", "")
-                if animation_id != "" and model_name != "" and model_name in bpy.data.objects:
-                    model_obj = bpy.data.objects[model_name]
+                model_obj = SceneIndex.get(model_name) if animation_id != "" and model_name != "" else None
+                if model_obj is not None:
                     self.show_animation(model_obj, animation_id)
                     model_obj.display_type = "WIRE"
     
     def show_sequences_in_subfiles(self, main_file_obj, selected_sequence_id):
         if main_file_obj is not None:
-            for anim_sequences in main_file_obj.children:
-                if not get_anno_object_class(anim_sequences) == AnimationSequences:
-                    continue
-                for subfile_seq in anim_sequences.children:
-                    if not get_anno_object_class(subfile_seq) == AnimationSequence:
-                        continue
+            for anim_sequences in SceneIndex.children_of_class(main_file_obj, AnimationSequences):
+                for subfile_seq in SceneIndex.children_of_class(anim_sequences, AnimationSequence):
                     seq_node = subfile_seq.dynamic_properties.to_node(ET.Element("Config"))
                     sequence_id = get_text(seq_node, "SequenceID")
                     if selected_sequence_id == sequence_id:
                         self.show_sequence(subfile_seq)
-            for file_obj in main_file_obj.children:
-                if not get_anno_object_class(file_obj) == SubFile:
-                    continue
-                for subfile_main_file_obj in file_obj.children:
-                    if not get_anno_object_class(subfile_main_file_obj) == MainFile:
-                        continue
+            for file_obj in SceneIndex.children_of_class(main_file_obj, SubFile):
+                for subfile_main_file_obj in SceneIndex.children_of_class(file_obj, MainFile):
                     self.show_sequences_in_subfiles(subfile_main_file_obj, selected_sequence_id)
                     
     def hide_animated_models(self, obj):
-        if get_anno_object_class(obj) != Model:
-            for c in obj.children:
+        children = SceneIndex.children(obj)
+        if SceneIndex.class_name(obj) != Model.__name__:
+            for c in children:
                 self.hide_animated_models(c)
             return
-        if len(obj.children) > 0:
+        if len(children) > 0:
             self.set_hide_viewport_recursive(obj, True)
     def _show_sequence(self, seq_obj):  
         seq_node = seq_obj.dynamic_properties.to_node(ET.Element("Config"))
         selected_sequence_id = get_text(seq_node, "SequenceID")
         #self.show_sequence(seq_obj)
         main_file_obj = get_main_file_obj(seq_obj)
+        if main_file_obj is None:
+            return
         self.hide_animated_models(main_file_obj)
         self.show_sequences_in_subfiles(main_file_obj, selected_sequence_id)
         
@@ -901,43 +1224,35 @@ class ShowModel(Operator):
     
     def set_hide_viewport_recursive(self, obj, hide):
         obj.hide_set(state=hide)
-        for o in obj.children:
+        for o in SceneIndex.children(obj):
             self.set_hide_viewport_recursive(o, hide)
 
     def hide_animation(self, model_obj):
-        for animations_obj in model_obj.children:
-            for i, anim_obj in enumerate(animations_obj.children):
+        for animations_obj in SceneIndex.children(model_obj):
+            for i, anim_obj in enumerate(SceneIndex.children(animations_obj)):
                 self.set_hide_viewport_recursive(anim_obj, True)
     def hide_sequence(self, seq_obj):
-        for track_obj in seq_obj.children:
+        for track_obj in SceneIndex.children(seq_obj):
             track_node = track_obj.dynamic_properties.to_node(ET.Element("Track"))
             for track_element_node in track_node.findall("TrackElement"):
                 model_name = get_text(track_element_node, "BlenderModelID", "")
                 animation_id = get_text(track_element_node, "AnimationID", "")
-                if animation_id != "" and model_name != "" and model_name in bpy.data.objects:
-                    model_obj = bpy.data.objects[model_name]
+                model_obj = SceneIndex.get(model_name) if animation_id != "" and model_name != "" else None
+                if model_obj is not None:
                     self.hide_animation(model_obj)
                     model_obj.display_type = "TEXTURED"
 
     
     def hide_sequences_in_subfiles(self, main_file_obj, selected_sequence_id):
         if main_file_obj is not None:
-            for anim_sequences in main_file_obj.children:
-                if not get_anno_object_class(anim_sequences) == AnimationSequences:
-                    continue
-                for subfile_seq in anim_sequences.children:
-                    if not get_anno_object_class(subfile_seq) == AnimationSequence:
-                        continue
+            for anim_sequences in SceneIndex.children_of_class(main_file_obj, AnimationSequences):
+                for subfile_seq in SceneIndex.children_of_class(anim_sequences, AnimationSequence):
                     seq_node = subfile_seq.dynamic_properties.to_node(ET.Element("Config"))
                     sequence_id = get_text(seq_node, "SequenceID")
                     if selected_sequence_id != sequence_id:
                         self.hide_sequence(subfile_seq)
-            for file_obj in main_file_obj.children:
-                if not get_anno_object_class(file_obj) == SubFile:
-                    continue
-                for subfile_main_file_obj in file_obj.children:
-                    if not get_anno_object_class(subfile_main_file_obj) == MainFile:
-                        continue
+            for file_obj in SceneIndex.children_of_class(main_file_obj, SubFile):
+                for subfile_main_file_obj in SceneIndex.children_of_class(file_obj, MainFile):
                     self.hide_sequences_in_subfiles(subfile_main_file_obj, selected_sequence_id)
     def execute(self, context):
         seq_obj = context.active_object
@@ -985,7 +1300,9 @@ class PT_AnnoObjectPropertyPanel(Panel):
         if "AnimationSequence" == obj.anno_object_class_str:
             col.operator(ShowSequence.bl_idname, text = "Show Sequence")    
             col.operator(ShowModel.bl_idname, text = "Show Model")   
-        if obj.instance_collection is not None: 
+        if get_subfile_instance_obj(obj) is not None:
+            col.operator(MakeSubfileInstanceReal.bl_idname, text = "Make Subfile Real")
+        elif obj.instance_collection is not None: 
             col.operator(MakeCollectionInstanceReal.bl_idname, text = "Make Collection Instance Real") 
             col.operator(InstancedCollectionToSubFile.bl_idname, text = "Instanced Collection To FILE_")  
 
@@ -1096,6 +1413,7 @@ classes = [
     ShowSequence,
     ShowModel,
     MakeCollectionInstanceReal,
+    MakeSubfileInstanceReal,
     InstancedCollectionToSubFile,
     
     XMLPropertyGroup,
@@ -1123,8 +1441,19 @@ def register():
     bpy.types.Object.dynamic_properties = bpy.props.PointerProperty(type = XMLPropertyGroup)
     bpy.types.Material.dynamic_properties = bpy.props.PointerProperty(type = XMLPropertyGroup)
     #CollectionProperty(type = AnnoImageTextureProperties)
+    for handlers in [bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post]:
+        handlers.append(clear_tag_indices)
+    bpy.app.handlers.save_pre.append(collapse_compact_xml)
+    bpy.app.handlers.load_post.append(clear_compact_xml)
 
 def unregister():
+    for handlers in [bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post]:
+        if clear_tag_indices in handlers:
+            handlers.remove(clear_tag_indices)
+    for handlers, handler in [(bpy.app.handlers.save_pre, collapse_compact_xml), (bpy.app.handlers.load_post, clear_compact_xml)]:
+        if handler in handlers:
+            handlers.remove(handler)
+    TagIndex.clear()
     del bpy.types.ShaderNodeTexImage.anno_properties
     del bpy.types.Object.dynamic_properties
     del bpy.types.Scene.anno_xml_import_object_class
@@ -7,11 +7,13 @@ import os
 import random
 import re
 import subprocess
+import time
 from pathlib import Path, PurePath
 from typing import Tuple, List, NewType, Any, Union, Dict, Optional, TypeVar, Type
 from abc import ABC, abstractmethod
 from bpy.props import EnumProperty, BoolProperty, PointerProperty, IntProperty, FloatProperty, CollectionProperty, StringProperty, FloatVectorProperty
 from bpy.types import PropertyGroup, Panel, Operator, UIList
+from bpy.app.handlers import persistent
 import bmesh
 import sys
 
@@ -19,8 +21,16 @@ from collections import defaultdict
 from math import radians
 from .prefs import IO_AnnocfgPreferences
 from .utils import *
-from .transform import Transform
+from .transform import Transform, TransformBatch
 from .material import Material, ClothMaterial
+from .conversion import convert_to_glb, convert_animation_to_glb, glb_path, animated_glb_path, is_converted
+from .conversion_cache import ConversionCache
+from .parse_cache import ParsedFileCache, load_prp
+from .cfg_cache import CfgCache
+from .blob_store import XMLBlobStore
+from .assets_index import AssetsXML
+from .scene_index import SceneIndex
+from .xml_writer import StreamedElement
 from .feedback_ui import FeedbackConfigItem, GUIDVariationListItem, FeedbackSequenceListItem
 from . import feedback_enums
 
@@ -39,35 +49,79 @@ from .shaders.prop_grass_shader import GrassPropShader
 from .shaders.destruct_shader import DestructShader
 from .shaders.water_shader import LiquidShader
 from .shaders.glass_shader import GlassShader
-# import numpy as np
+import numpy as np
 
-def convert_to_glb(fullpath: Path):
-    rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
-    if rdm4_path.exists() and fullpath.exists():
-        subprocess.call(f"\"{rdm4_path}\" --input \"{fullpath}\" -n --outdst \"{fullpath.parent}\"", shell = True)
-
-def convert_to_glb_if_required(data_path: Union[str, Path]):
+def convert_to_glb_if_required(data_path: Union[str, Path]) -> Optional[Path]:
+    """Returns the path of the .glb file, converts the .rdm file first if there is no valid .glb yet."""
     if data_path is None:
         return None
     fullpath = data_path_to_absolute_path(data_path)
-    glb_fullpath = fullpath.with_suffix(".glb")
-    if fullpath.exists() and not glb_fullpath.exists():
-        convert_to_glb(fullpath)
+    glb_fullpath = glb_path(fullpath)
+    if fullpath.exists() and not is_converted(glb_fullpath, [fullpath]):
+        convert_to_glb(fullpath, output = glb_fullpath)
+        ConversionCache.flush()
+    return glb_fullpath
+
+class ImportedModelCache:
+    """The imported (and mirrored) object of every .glb, so importing the same model again does not run the glTF importer
+    and the mirroring again. Later imports get a copy of the template object that shares its mesh,
+    their materials are linked to the object (see AnnoObject.apply_materials_to_object)."""
+    # (.glb path, modification time, mirror_models) -> template object, not linked to the scene
+    templates: Dict[Tuple[str, int, bool], BlenderObject] = {}
+    hits = 0
+    
+    @classmethod
+    def key(cls, glb_fullpath: Path) -> Tuple[str, int, bool]:
+        return (str(glb_fullpath), glb_fullpath.stat().st_mtime_ns, IO_AnnocfgPreferences.mirror_models())
+    
+    @classmethod
+    def get(cls, glb_fullpath: Path) -> Optional[BlenderObject]:
+        """A copy of the template, linked to the active collection and active like an object from the glTF importer."""
+        key = cls.key(glb_fullpath)
+        template = cls.templates.get(key)
+        if template is None:
+            return None
+        try:
+            mirrored = template.data.get(Transform.MIRRORED_PROPERTY, False)
+        except ReferenceError:
+            del cls.templates[key]
+            return None
+        if mirrored != IO_AnnocfgPreferences.mirror_models():
+            del cls.templates[key]
+            bpy.data.objects.remove(template)
+            return None
+        obj = template.copy()
+        bpy.context.collection.objects.link(obj)
+        for selected_obj in bpy.context.selected_objects:
+            selected_obj.select_set(False)
+        obj.select_set(True)
+        bpy.context.view_layer.objects.active = obj
+        cls.hits += 1
+        return obj
+    
+    @classmethod
+    def add(cls, glb_fullpath: Path, obj: BlenderObject):
+        # Only plain meshes, the template would miss the other objects of the file.
+        if obj.type != 'MESH' or obj.children:
+            return
+        cls.templates[cls.key(glb_fullpath)] = obj.copy()
 
 def import_model_to_scene(data_path: Union[str, Path, None]) -> BlenderObject:
     print(data_path)
     if not data_path:
         print("invalid data path")
         return add_empty_to_scene()
-    fullpath = data_path_to_absolute_path(data_path)
-    convert_to_glb_if_required(fullpath)
+    fullpath = convert_to_glb_if_required(data_path)
     if fullpath is None:
         #self.report({'INFO'}, f"Missing file: Cannot find rmd model {data_path}.")
         return None
-    fullpath = fullpath.with_suffix(".glb")
     if not fullpath.exists():
         #self.report({'INFO'}, f"Missing file: Cannot find glb model {data_path}.")
         return None
+    obj = ImportedModelCache.get(fullpath)
+    if obj is not None:
+        print(obj.name, obj.type, "(reused)")
+        return obj
     # bpy.context.view_layer.objects.active = None
     # for obj in bpy.data.objects:
     #     obj.select_set(False)
@@ -75,16 +129,9 @@ def import_model_to_scene(data_path: Union[str, Path, None]) -> BlenderObject:
     obj = bpy.context.active_object
     print(obj.name, obj.type)
     Transform.mirror_mesh(obj)
+    ImportedModelCache.add(fullpath, obj)
     return obj
 
-def convert_animation_to_glb(model_fullpath, animation_fullpath: Path):
-    #Usage: ./rdm4-bin.exe -i rdm/container_ship_tycoons_lod1.rdm -sam anim/container_ship_tycoons_idle01.rdm
-    rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
-    if rdm4_path.exists() and animation_fullpath.exists() and model_fullpath.exists():
-        out_filename = animation_fullpath.parent
-        subprocess.call(f"\"{rdm4_path}\" -i \"{model_fullpath}\" -sam \"{animation_fullpath}\" --force --outdst \"{out_filename}\"", shell = True)
-
-
 def import_animated_model_to_scene(model_data_path: Union[str, Path, None], animation_data_path) -> BlenderObject:
     print(model_data_path, animation_data_path)
     if not model_data_path or not animation_data_path:
@@ -94,17 +141,12 @@ def import_animated_model_to_scene(model_data_path: Union[str, Path, None], anim
     fullpath = data_path_to_absolute_path(animation_data_path)
     if fullpath is None:
         return None
-    combined_path = Path(model_fullpath.parent, Path(model_fullpath.stem + "_a_"+Path(animation_data_path).stem + ".glb"))
-    if not combined_path.exists():
-            
-        out_fullpath = Path(fullpath.parent, Path("out.glb"))
-        if out_fullpath.exists():
-            out_fullpath.unlink()
-        if fullpath.exists():
-            convert_animation_to_glb(model_fullpath, fullpath)
-        if not out_fullpath.exists():
+    combined_path = animated_glb_path(model_fullpath, fullpath)
+    if not is_converted(combined_path, [model_fullpath, fullpath]):
+        converted = convert_animation_to_glb(model_fullpath, fullpath, output = combined_path)
+        ConversionCache.flush()
+        if not converted:
             return None
-        out_fullpath.replace(combined_path)
         print("Saved animation ", animation_data_path, " of model ", model_data_path, " to ", combined_path)
     if not combined_path.exists():
         print(f"Warning: Conversion of {animation_data_path} for model {model_data_path} failed.")
@@ -340,8 +382,9 @@ class AnnoObject(ABC):
                 find_or_create(transform_node, xml_path).text = format_float(value)
         if cls.has_materials:
             materials_node = find_or_create(node, "Materials")
-            if obj.data and obj.data.materials:
-                for blender_material in obj.data.materials:
+            if obj.data and obj.material_slots:
+                # The slots can be linked to the object, see apply_materials_to_object.
+                for blender_material in [slot.material for slot in obj.material_slots if slot.material is not None]:
                     output_node = blender_material.node_tree.nodes.get("Material Output")
                     surface_socket = output_node.inputs.get("Surface")
                     connected = [l for l in blender_material.node_tree.links if l.to_socket == surface_socket]
@@ -437,11 +480,16 @@ class AnnoObject(ABC):
         for i, material in enumerate(materials):
             if not material:
                 continue
-            slot = i
-            old_material = obj.data.materials[slot]
-            obj.data.materials[slot] = material
-            old_material.user_clear()
-            bpy.data.materials.remove(old_material)
+            # The mesh can be shared with other objects of the same model (ImportedModelCache), so the material is linked to the object.
+            # Only the first object replaces the material of the mesh from the glTF importer, which has no other users.
+            old_material = obj.data.materials[i]
+            if old_material is None or old_material.users == 1 and old_material != material:
+                obj.data.materials[i] = material
+                if old_material is not None:
+                    bpy.data.materials.remove(old_material)
+            slot = obj.material_slots[i]
+            slot.link = 'OBJECT'
+            slot.material = material
         
 
 
@@ -688,6 +736,52 @@ def recursive_add_to_collection(obj, collection):
     for c in obj.children:
         recursive_add_to_collection(c, collection)
 
+class HierarchyTemplate():
+    """An imported hierarchy that is placed again by copying its objects, which share their data (like Alt+D).
+    References to objects of the hierarchy (BlenderModelID, ... and armature modifiers) are pointed to the copies.
+    The objects with references are looked up once, copies only walk their properties.
+    """
+    def __init__(self, root_obj: BlenderObject):
+        self.objects = [root_obj] + list(root_obj.children_recursive)
+        index_by_pointer = {obj.as_pointer(): i for i, obj in enumerate(self.objects)}
+        self.parent_indices = [index_by_pointer.get(obj.parent.as_pointer()) if obj.parent is not None else None for obj in self.objects]
+        self.collections = [list(obj.users_collection) for obj in self.objects]
+        pointers = set(index_by_pointer)
+        self.referencing_indices = [i for i, obj in enumerate(self.objects) if self.has_references(obj, pointers)]
+    
+    @classmethod
+    def object_pointer_items(cls, group):
+        yield from group.object_pointer_properties
+        for child_group in group.dynamic_properties:
+            yield from cls.object_pointer_items(child_group)
+    
+    @classmethod
+    def has_references(cls, obj, pointers) -> bool:
+        for item in cls.object_pointer_items(obj.dynamic_properties):
+            if item.value is not None and item.value.as_pointer() in pointers:
+                return True
+        return any(mod.type == "ARMATURE" and mod.object is not None and mod.object.as_pointer() in pointers for mod in obj.modifiers)
+    
+    def copy(self, parent_obj) -> BlenderObject:
+        """Returns the copy of the root object, parented to parent_obj."""
+        copies = []
+        for obj, parent_index, collections in zip(self.objects, self.parent_indices, self.collections):
+            copy = obj.copy()
+            for collection in collections:
+                collection.objects.link(copy)
+            copy.parent = copies[parent_index] if parent_index is not None else parent_obj
+            copies.append(copy)
+        copy_by_pointer = {obj.as_pointer(): copy for obj, copy in zip(self.objects, copies)}
+        for i in self.referencing_indices:
+            copy = copies[i]
+            for item in self.object_pointer_items(copy.dynamic_properties):
+                if item.value is not None and item.value.as_pointer() in copy_by_pointer:
+                    item.value = copy_by_pointer[item.value.as_pointer()]
+            for mod in copy.modifiers:
+                if mod.type == "ARMATURE" and mod.object is not None and mod.object.as_pointer() in copy_by_pointer:
+                    mod.object = copy_by_pointer[mod.object.as_pointer()]
+        return copies[0]
+
 class SubFile(AnnoObject):
     has_transform = True
     transform_paths = {
@@ -705,6 +799,11 @@ class SubFile(AnnoObject):
     }
     enforce_equal_scale = True #scale.x, .y and .z must be equal
     has_materials = False
+    
+    # data path -> collection with the imported hierarchy, shared by all references to the same file.
+    subfile_collections: Dict[str, bpy.types.Collection] = {}
+    subfiles_built = 0
+    subfiles_instanced = 0
 
     @classmethod
     def default_node(cls: Type[T]):
@@ -719,13 +818,12 @@ class SubFile(AnnoObject):
     @classmethod 
     def try_loading_from_library(cls, data_path, last_modified):
         from datetime import datetime
-        libpath = IO_AnnocfgPreferences.get_cfg_cache_path()
-        p = Path(libpath, Path(data_path + ".blend"))
+        p = CfgCache.blend_path(data_path)
         if p.exists():
             cache_last_modified = p.stat().st_mtime
             if cache_last_modified < last_modified:
                 print(f"Cache Invalidation for {p}, modified {data_path} at {datetime.fromtimestamp(last_modified)}, last cache update at {datetime.fromtimestamp(cache_last_modified)}")
-                p.unlink()
+                CfgCache.remove(data_path)
                 return None
             
             with bpy.data.libraries.load(str(p)) as (data_from, data_to):
@@ -774,6 +872,7 @@ class SubFile(AnnoObject):
         bpy.data.libraries.write(str(filepath), set(objects), fake_user=True)
         bpy.context.scene.collection.children.unlink(collection)
         bpy.data.collections.remove(collection)
+        CfgCache.record_cached(data_path)
         
     @classmethod 
     def load_subfile(cls, data_path):
@@ -784,30 +883,80 @@ class SubFile(AnnoObject):
             return add_empty_to_scene()
         
         last_modified = fullpath.stat().st_mtime
+        CfgCache.record_use(data_path)
         
-        if IO_AnnocfgPreferences.cfg_cache_loading_enabled(): #ToDo: Remove True here!!!
+        if IO_AnnocfgPreferences.cfg_cache_loading_enabled():
             file_obj = cls.try_loading_from_library(data_path, last_modified)
             if file_obj is not None:
+                CfgCache.record_hit(data_path)
                 return file_obj
+            CfgCache.record_miss(data_path)
         
-        tree = ET.parse(fullpath)
-        root = tree.getroot()
+        start = time.perf_counter()
+        root = ParsedFileCache.parse(fullpath)
         if root is None:
             return add_empty_to_scene()
         
         file_obj = MainFile.xml_to_blender(root)
         file_obj.name = "MAIN_FILE_" + fullpath.name
+        CfgCache.record_import_time(data_path, (time.perf_counter() - start) * 1000.0)
         
-        if random.random() < IO_AnnocfgPreferences.cfg_cache_probability():
+        if CfgCache.should_cache(data_path):
             cls.cache_to_library(file_obj, data_path)
         return file_obj
     
     
+    @classmethod
+    def get_subfile_collection(cls, data_path):
+        """Returns the (hidden) collection that contains the hierarchy of this subfile. Imports it on the first call."""
+        collection = cls.subfile_collections.get(data_path)
+        if collection is not None:
+            try:
+                collection.name
+                return collection
+            except ReferenceError:
+                # Deleted, or a different .blend has been loaded.
+                del cls.subfile_collections[data_path]
+        
+        file_obj = cls.load_subfile(data_path)
+        cls.subfiles_built += 1
+        if file_obj.instance_type == 'COLLECTION' and file_obj.instance_collection is not None:
+            # Loaded from the cfg cache, which already is a collection instance.
+            collection = file_obj.instance_collection
+            bpy.data.objects.remove(file_obj, do_unlink=True)
+        else:
+            collection = bpy.data.collections.new("SUBFILE_" + Path(data_path).name)
+            recursive_add_to_collection(file_obj, collection)
+            for obj in collection.all_objects:
+                for other_collection in list(obj.users_collection):
+                    if other_collection != collection:
+                        other_collection.objects.unlink(obj)
+        collection["anno_subfile"] = data_path
+        cls.subfile_collections[data_path] = collection
+        return collection
+    
+    @classmethod
+    def instance_subfile(cls, data_path):
+        collection = cls.get_subfile_collection(data_path)
+        cls.subfiles_instanced += 1
+        instance = bpy.data.objects.new(collection.name, None)
+        instance.instance_type = 'COLLECTION'
+        instance.instance_collection = collection
+        bpy.context.scene.collection.objects.link(instance)
+        return instance
+    
+    @classmethod
+    def statistics(cls) -> str:
+        return f"Subfiles: {cls.subfiles_built} imported, {cls.subfiles_instanced} instances"
+    
     @classmethod
     def add_blender_object_to_scene(cls, node) -> BlenderObject:
         subfile_obj = add_empty_to_scene()
         data_path = get_text(node, "FileName", None)
-        file_obj = cls.load_subfile(data_path)  
+        if IO_AnnocfgPreferences.instance_subfiles() and data_path and data_path_to_absolute_path(data_path).exists():
+            file_obj = cls.instance_subfile(data_path)
+        else:
+            file_obj = cls.load_subfile(data_path)  
         file_obj.parent = subfile_obj
         return subfile_obj
 
@@ -932,12 +1081,7 @@ class Prop(AnnoObject):
 
         print(prop_file)
 
-        proc_args = f"\"{IO_AnnocfgPreferences.get_path_to_filedb_reader()}\" fctohex -d -y -f \"{prop_file}\""
-        subprocess.call(proc_args)
-
-        xml_path = prop_file.with_suffix(".xml")
-        tree = ET.parse(xml_path)
-        root = tree.getroot()
+        root = ParsedFileCache.parse(prop_file, load_prp)
 
         # get prop node
         prop_node = root.find("Prop")
@@ -1184,9 +1328,10 @@ class IfoPlane(AnnoObject):
     @classmethod
     def add_blender_object_to_scene(cls, node) -> BlenderObject:
         vertices = []
+        mirror_models = IO_AnnocfgPreferences.mirror_models()
         for pos_node in list(node.findall("Position")):
             x = parse_float_node(pos_node, "xf")
-            if IO_AnnocfgPreferences.mirror_models():
+            if mirror_models:
                 x *= -1
             y = - parse_float_node(pos_node, "zf")
             vertices.append((x,y, 0.0))
@@ -1198,10 +1343,11 @@ class IfoPlane(AnnoObject):
     @classmethod 
     def blender_to_xml(cls, obj, parent_node, child_map):
         node = super().blender_to_xml(obj, parent_node, child_map)
+        mirror_models = IO_AnnocfgPreferences.mirror_models()
         for vert in obj.data.vertices:
             coords = obj.matrix_local @ vert.co
             x = coords.x
-            if IO_AnnocfgPreferences.mirror_models():
+            if mirror_models:
                 x *= -1
             y = -coords.y
             position_node = ET.SubElement(node, "Position")
@@ -1224,7 +1370,8 @@ class IfoMeshHeightmap(AnnoObject):
         stepy = float(get_text(node, "StepSize/y"))
         width = int(get_text(node, "Heightmap/Width"))
         height = int(get_text(node, "Heightmap/Height"))
-        heightdata = [float(s.text) for s in node.findall("Heightmap/Map/i")]
+        map_nodes = node.findall("Heightmap/Map/i")
+        heightdata = np.fromiter((float(s.text) for s in map_nodes), dtype = np.float32, count = len(map_nodes))
         node.find("Heightmap").remove(node.find("Heightmap/Map"))
         print(f"Heightmap w={width} x h={height} => {len(heightdata)}")
         
@@ -1233,26 +1380,24 @@ class IfoMeshHeightmap(AnnoObject):
         col = bpy.data.collections.get("Collection")
         col.objects.link(obj)
         bpy.context.view_layer.objects.active = obj
-        verts = []
-        i = 0
-        for a in range(height):
-            for b in range(width):
-                verts.append((startx + b * stepx, starty + a * stepy, heightdata[i]))
-                i += 1
-
-        mesh.from_pydata(verts, [], [])
-        for i, vert in enumerate(obj.data.vertices):
-            vert.co.y *= -1
-            vert.co.x *= -1
+        
+        # Row major (y, then x), mirrored along x and y.
+        a, b = np.divmod(np.arange(width * height), width)
+        verts = np.empty((width * height, 3), dtype = np.float32)
+        verts[:, 0] = -(startx + b * stepx)
+        verts[:, 1] = -(starty + a * stepy)
+        verts[:, 2] = heightdata[:width * height]
+        mesh.vertices.add(len(verts))
+        mesh.attributes["position"].data.foreach_set("vector", verts.ravel())
+        mesh.update()
         return obj
 
     @classmethod 
     def blender_to_xml(cls, obj, parent_node, child_map):
         node = super().blender_to_xml(obj, parent_node, child_map)
-        map_node = ET.SubElement(node.find("Heightmap"), "Map")
-        for vert in obj.data.vertices:
-            z = vert.co.z
-            ET.SubElement(map_node, "i").text = format_float(z)
+        verts = np.empty(len(obj.data.vertices) * 3, dtype = np.float32)
+        obj.data.attributes["position"].data.foreach_get("vector", verts)
+        StreamedElement.append_to(node.find("Heightmap"), "Map", (("i", format_float(z)) for z in verts[2::3].tolist()))
         return node
 
 class Sequence(AnnoObject):
@@ -1797,8 +1942,9 @@ class PropGridInstance:
     def str_to_bool(cls, b):
         return b in ["True", "true", "TRUE"]
     @classmethod
-    def xml_to_blender(cls, node: ET.Element, prop_objects = [], parent_obj = None) -> BlenderObject:
+    def xml_to_blender(cls, node: ET.Element, prop_objects = [], parent_obj = None, transform_data = None) -> BlenderObject:
         """
+        With transform_data (see new_transform_data), the transform is only collected and applied later for all instances at once.
         <None>
             <Index>67</Index> #Use the prop at index 67 of FileNames
             <Position>153,76723 0,1976307 31,871208</Position> #Coordinates x z y for blender?
@@ -1816,18 +1962,17 @@ class PropGridInstance:
         
         set_anno_object_class(obj, cls)
         
-        location = [float(s) for s in get_text_and_delete(node, "Position", "0,0 0,0 0,0").replace(",", ".").split(" ")]
-        rotation = [float(s) for s in get_text_and_delete(node, "Rotation", "1,0 0,0 0,0 0,0").replace(",", ".").split(" ")]
-        rotation = [rotation[3], rotation[0], rotation[1], rotation[2]] #xzyw -> wxzy
-        #rotation = [rotation[1], rotation[2], rotation[3], rotation[0]] #xzyw -> wxzy or something else
-        scale    = [float(s) for s in get_text_and_delete(node, "Scale", "1,0 1,0 1,0").replace(",", ".").split(" ")]
+        if transform_data is None:
+            transform = cls.parse_transform(node)
+        else:
+            cls.add_transform(transform_data, obj, node)
         
         if node.find("AdaptTerrainHeight") is not None:
             node.find("AdaptTerrainHeight").text = str(int(cls.str_to_bool(node.find("AdaptTerrainHeight").text)))
         else:
             ET.SubElement(node, "AdaptTerrainHeight").text = "0"
-        transform = Transform(location, rotation, scale, anno_coords = True)
-        transform.apply_to(obj)
+        if transform_data is None:
+            transform.apply_to(obj)
 
         obj.dynamic_properties.from_node(node)
         return obj
@@ -1840,24 +1985,234 @@ class PropGridInstance:
         
         ET.SubElement(node, "FileName").text = get_text(base_node, "FileName")
         ET.SubElement(node, "Color").text = get_text(base_node, "Color", "1 1 1 1")
-        if base_node.find("AdaptTerrainHeight") is not None:
-            adapt = bool(int(get_text(base_node, "AdaptTerrainHeight")))
-            ET.SubElement(node, "AdaptTerrainHeight").text = str(adapt)
-        else:
-            adapt = bool(int(get_text(base_node, "Flags")))
-            ET.SubElement(node, "AdaptTerrainHeight").text = str(adapt)
-        
-        transform = Transform(obj.location, obj.rotation_quaternion, obj.scale, anno_coords = False)
-        transform.convert_to_anno_coords()
-        location = [format_float(f) for f in transform.location]
-        rotation = [format_float(f) for f in[transform.rotation[1], transform.rotation[2], transform.rotation[3], transform.rotation[0]]] #wxzy ->xzyw
-        scale = [format_float(f) for f in transform.scale]
+        ET.SubElement(node, "AdaptTerrainHeight").text = str(cls.adapt_terrain_height(base_node))
         
-        ET.SubElement(node, "Position").text = ' '.join(location).replace(".", ",")
-        ET.SubElement(node, "Rotation").text = ' '.join(rotation).replace(".", ",")
-        ET.SubElement(node, "Scale").text = ' '.join(scale).replace(".", ",")
-
+        cls.transform_to_node(node, obj.location, obj.rotation_quaternion, obj.scale)
         return node
+    
+    @classmethod
+    def adapt_terrain_height(cls, base_node: ET.Element) -> bool:
+        if base_node.find("AdaptTerrainHeight") is not None:
+            return bool(int(get_text(base_node, "AdaptTerrainHeight")))
+        return bool(int(get_text(base_node, "Flags")))
+    
+    @classmethod
+    def instance_record(cls, obj, index_by_filename: Dict[str, int], transform_texts = None):
+        """Same content as blender_to_xml (with the Index instead of the FileName), as record for the StreamingXMLWriter.
+        transform_texts are the (Position, Rotation, Scale) texts of the object if already known (TransformBatch.texts)."""
+        base_node = obj.dynamic_properties.to_node(ET.Element("None"))
+        file_name = get_text(base_node, "FileName")
+        if file_name not in index_by_filename:
+            index_by_filename[file_name] = len(index_by_filename)
+        if transform_texts is None:
+            transform_texts = cls.transform_texts(obj.location, obj.rotation_quaternion, obj.scale)
+        position, rotation, scale = transform_texts
+        return ("None", [
+            ("Color", get_text(base_node, "Color", "1 1 1 1")),
+            ("AdaptTerrainHeight", str(cls.adapt_terrain_height(base_node))),
+            ("Position", position),
+            ("Rotation", rotation),
+            ("Scale", scale),
+            ("Index", str(index_by_filename[file_name])),
+        ])
+    
+    @classmethod
+    def take_transform_texts(cls, node: ET.Element) -> Tuple[str, str, str]:
+        """Removes Position, Rotation and Scale from the node and returns their texts."""
+        position = get_text_and_delete(node, "Position", "0,0 0,0 0,0")
+        rotation = get_text_and_delete(node, "Rotation", "1,0 0,0 0,0 0,0")
+        scale = get_text_and_delete(node, "Scale", "1,0 1,0 1,0")
+        return (position, rotation, scale)
+    
+    @classmethod
+    def parse_transform(cls, node: ET.Element) -> Transform:
+        position, rotation, scale = cls.take_transform_texts(node)
+        return Transform.from_prop_grid_texts(position, rotation, scale)
+    
+    @classmethod
+    def new_transform_data(cls) -> Dict[str, list]:
+        return {"objects": [], "position": [], "rotation": [], "scale": []}
+    
+    @classmethod
+    def add_transform(cls, transform_data: Dict[str, list], obj, node: ET.Element):
+        position, rotation, scale = cls.take_transform_texts(node)
+        transform_data["objects"].append(obj)
+        transform_data["position"].append(position)
+        transform_data["rotation"].append(rotation)
+        transform_data["scale"].append(scale)
+    
+    @classmethod
+    def apply_transform_data(cls, transform_data: Dict[str, list]):
+        """Applies the collected transforms to their objects, at once."""
+        batch = TransformBatch.from_texts(transform_data["position"], transform_data["rotation"], transform_data["scale"])
+        batch.convert_to_blender_coords()
+        batch.apply_to_objects(transform_data["objects"])
+    
+    @classmethod
+    def transform_texts(cls, location, rotation, scale) -> Tuple[str, str, str]:
+        """Position, Rotation and Scale texts (in anno coordinates) of the blender transform."""
+        return Transform.prop_grid_texts(location, rotation, scale)
+    
+    @classmethod
+    def transform_to_node(cls, node: ET.Element, location, rotation, scale):
+        """Adds Position, Rotation and Scale (in anno coordinates) of the blender transform to the node."""
+        position, rotation, scale = cls.transform_texts(location, rotation, scale)
+        ET.SubElement(node, "Position").text = position
+        ET.SubElement(node, "Rotation").text = rotation
+        ET.SubElement(node, "Scale").text = scale
+
+
+class PropGridPointCloud:
+    """All instances of an island prop grid as a single point cloud object.
+    Each point stores its prop index, rotation, scale, color and AdaptTerrainHeight as attributes,
+    a geometry nodes modifier instances the blueprint props (kept in a collection that is not part of the scene) on them.
+    Much faster than one blender object per instance (PropGridInstance) for islands with 100k+ props.
+    """
+    node_group_name = "AnnoPropGridInstances"
+    
+    @classmethod
+    def add_blender_object_to_scene(cls, node) -> BlenderObject:
+        mesh = bpy.data.meshes.new("PROP_GRID")
+        obj = bpy.data.objects.new("PROP_GRID", mesh)
+        bpy.context.scene.collection.objects.link(obj)
+        return obj
+    
+    @classmethod
+    def create_blueprint_collection(cls, prop_objects, data_paths) -> bpy.types.Collection:
+        """Moves the blueprint props into a hidden collection. Collection Info sorts its children by name, 
+        so the zero padded index in the name keeps the order of the FileNames."""
+        collection = bpy.data.collections.new("PROP_GRID_BLUEPRINTS")
+        for i, data_path in enumerate(data_paths):
+            prop_obj = prop_objects[i]
+            if prop_obj is None:
+                # Skipped props still need their slot, otherwise the following indices would be shifted.
+                prop_obj = bpy.data.objects.new("empty", None)
+            prop_obj.name = f"PROP_{i:05d}_{Path(data_path).stem}"
+            # Blueprints must not be exported as props of the island.
+            set_anno_object_class(prop_obj, NoAnnoObject)
+            for other_collection in list(prop_obj.users_collection):
+                other_collection.objects.unlink(prop_obj)
+            collection.objects.link(prop_obj)
+        return collection
+    
+    @classmethod
+    def enabled_output(cls, node, name):
+        for socket in node.outputs:
+            if socket.name == name and socket.enabled:
+                return socket
+        return node.outputs[name]
+    
+    @classmethod
+    def named_attribute_node(cls, node_group, name, data_type):
+        attribute_node = node_group.nodes.new("GeometryNodeInputNamedAttribute")
+        attribute_node.data_type = data_type
+        attribute_node.inputs["Name"].default_value = name
+        return cls.enabled_output(attribute_node, "Attribute")
+    
+    @classmethod
+    def create_node_group(cls, collection) -> bpy.types.NodeTree:
+        node_group = bpy.data.node_groups.new(cls.node_group_name, "GeometryNodeTree")
+        node_group.interface.new_socket("Geometry", in_out = "INPUT", socket_type = "NodeSocketGeometry")
+        node_group.interface.new_socket("Geometry", in_out = "OUTPUT", socket_type = "NodeSocketGeometry")
+        nodes = node_group.nodes
+        links = node_group.links
+        group_input = nodes.new("NodeGroupInput")
+        group_output = nodes.new("NodeGroupOutput")
+        
+        collection_info = nodes.new("GeometryNodeCollectionInfo")
+        collection_info.transform_space = "ORIGINAL"
+        collection_info.inputs["Collection"].default_value = collection
+        collection_info.inputs["Separate Children"].default_value = True
+        collection_info.inputs["Reset Children"].default_value = True
+        
+        instance_on_points = nodes.new("GeometryNodeInstanceOnPoints")
+        instance_on_points.inputs["Pick Instance"].default_value = True
+        links.new(group_input.outputs[0], instance_on_points.inputs["Points"])
+        links.new(collection_info.outputs["Instances"], instance_on_points.inputs["Instance"])
+        links.new(cls.named_attribute_node(node_group, "prop_index", "INT"), instance_on_points.inputs["Instance Index"])
+        links.new(cls.named_attribute_node(node_group, "rotation", "QUATERNION"), instance_on_points.inputs["Rotation"])
+        links.new(cls.named_attribute_node(node_group, "scale", "FLOAT_VECTOR"), instance_on_points.inputs["Scale"])
+        links.new(instance_on_points.outputs["Instances"], group_output.inputs[0])
+        return node_group
+    
+    @classmethod
+    def parse_color(cls, text: str) -> List[float]:
+        color = [float(s) for s in text.replace(",", ".").split(" ")]
+        return (color + [1.0, 1.0, 1.0, 1.0])[:4]
+    
+    @classmethod
+    def new_instance_data(cls) -> Dict[str, list]:
+        """position, rotation and scale are the texts of the instances, they are parsed and converted at once (TransformBatch) in create_object."""
+        return {"position": [], "rotation": [], "scale": [], "prop_index": [], "color": [], "adapt_terrain_height": []}
+    
+    @classmethod
+    def add_instance(cls, instance_data: Dict[str, list], instance_node: ET.Element):
+        position, rotation, scale = PropGridInstance.take_transform_texts(instance_node)
+        instance_data["position"].append(position)
+        instance_data["rotation"].append(rotation)
+        instance_data["scale"].append(scale)
+        instance_data["prop_index"].append(int(get_text(instance_node, "Index", "-1")))
+        instance_data["color"].extend(cls.parse_color(get_text(instance_node, "Color", "1 1 1 1")))
+        instance_data["adapt_terrain_height"].append(PropGridInstance.str_to_bool(get_text(instance_node, "AdaptTerrainHeight", "False")))
+    
+    @classmethod
+    def xml_to_blender(cls, instances_node: ET.Element, prop_objects, data_paths, parent_obj = None) -> BlenderObject:
+        instance_data = cls.new_instance_data()
+        if instances_node is not None:
+            for instance_node in instances_node:
+                cls.add_instance(instance_data, instance_node)
+        return cls.create_object(instance_data, prop_objects, data_paths, parent_obj)
+    
+    @classmethod
+    def create_object(cls, instance_data: Dict[str, list], prop_objects, data_paths, parent_obj = None) -> BlenderObject:
+        obj = cls.add_blender_object_to_scene(None)
+        if parent_obj:
+            obj.parent = parent_obj
+        set_anno_object_class(obj, cls)
+        obj["prop_filenames"] = list(data_paths)
+        
+        mesh = obj.data
+        batch = TransformBatch.from_texts(instance_data["position"], instance_data["rotation"], instance_data["scale"])
+        batch.convert_to_blender_coords()
+        batch.to_points(mesh)
+        mesh.attributes.new("prop_index", "INT", "POINT").data.foreach_set("value", instance_data["prop_index"])
+        mesh.attributes.new("color", "FLOAT_COLOR", "POINT").data.foreach_set("color", instance_data["color"])
+        mesh.attributes.new("adapt_terrain_height", "BOOLEAN", "POINT").data.foreach_set("value", instance_data["adapt_terrain_height"])
+        mesh.update()
+        
+        collection = cls.create_blueprint_collection(prop_objects, data_paths)
+        modifier = obj.modifiers.new("Prop Instances", "NODES")
+        modifier.node_group = cls.create_node_group(collection)
+        return obj
+    
+    @classmethod
+    def instance_records(cls, obj, index_by_filename: Dict[str, int]):
+        """Yields one instance record (see StreamingXMLWriter) per point. index_by_filename is extended by new file names."""
+        data_paths = list(obj["prop_filenames"])
+        mesh = obj.data
+        count = len(mesh.vertices)
+        prop_indices = [0] * count
+        colors = [0.0] * (4 * count)
+        adapt_terrain_heights = [False] * count
+        mesh.attributes["prop_index"].data.foreach_get("value", prop_indices)
+        mesh.attributes["color"].data.foreach_get("color", colors)
+        mesh.attributes["adapt_terrain_height"].data.foreach_get("value", adapt_terrain_heights)
+        transform_texts = TransformBatch.from_points(mesh).convert_to_anno_coords().texts()
+        
+        for i in range(count):
+            prop_index = prop_indices[i]
+            file_name = data_paths[prop_index] if 0 <= prop_index < len(data_paths) else ""
+            if file_name not in index_by_filename:
+                index_by_filename[file_name] = len(index_by_filename)
+            position, rotation, scale = transform_texts[i]
+            yield ("None", [
+                ("Color", ' '.join([format_float(f) for f in colors[4*i:4*i+4]]).replace(".", ",")),
+                ("AdaptTerrainHeight", str(adapt_terrain_heights[i])),
+                ("Position", position),
+                ("Rotation", rotation),
+                ("Scale", scale),
+                ("Index", str(index_by_filename[file_name])),
+            ])
 
 
 class IslandFile:
@@ -1867,142 +2222,182 @@ class IslandFile:
         return file_obj
     @classmethod
     def blender_to_xml(cls, obj, parent = None, child_map = None):
-        """Only exports the prop grid. Not the heighmap or the prop FileNames."""
-        base_node = ET.fromstring(obj["islandxml"])
+        """Only exports the prop grid. Not the heighmap or the prop FileNames.
+        Instances and FileNames are StreamedElements, write the result with the StreamingXMLWriter."""
+        base_node = XMLBlobStore.load(obj, "islandxml")
+        if base_node is None:
+            print(f"Error: {obj.name} has no stored xml, the island needs to be imported again.")
+            return None
         
         prop_grid_node = base_node.find("PropGrid")
-        if prop_grid_node.find("Instances"): #delete existing
+        if prop_grid_node.find("Instances") is not None: #delete existing
             prop_grid_node.remove(prop_grid_node.find("Instances"))
-        instances_node = ET.SubElement(prop_grid_node, "Instances")
+        if prop_grid_node.find("FileNames") is not None: #delete existing
+            prop_grid_node.remove(prop_grid_node.find("FileNames"))
         
+        # Filled while the instances are written, which happens before the FileNames are written.
         index_by_filename = {}
-        index = 0
-        
-        for obj in bpy.data.objects:
-            if get_anno_object_class(obj) not in [PropGridInstance, Prop]:
+        StreamedElement.append_to(prop_grid_node, "Instances", cls.instance_records(index_by_filename))
+        StreamedElement.append_to(prop_grid_node, "FileNames", cls.filename_records(index_by_filename))
+        return base_node
+    
+    @classmethod
+    def instance_records(cls, index_by_filename: Dict[str, int]):
+        objs = list(SceneIndex.objects_of_class(PropGridPointCloud, PropGridInstance, Prop))
+        #when .cfgs are imported there will be props with parents, so don't use them.
+        instance_objs = [obj for obj in objs if SceneIndex.class_name(obj) != PropGridPointCloud.__name__ and obj.parent is None]
+        transform_texts_by_obj = dict(zip(instance_objs, TransformBatch.from_objects(instance_objs).convert_to_anno_coords().texts()))
+        for obj in objs:
+            if SceneIndex.class_name(obj) == PropGridPointCloud.__name__:
+                yield from PropGridPointCloud.instance_records(obj, index_by_filename)
                 continue
-            if obj.parent is not None: #when .cfgs are imported there will be props with parents, so don't use them.
+            if obj.parent is not None:
                 continue
-            prop_node = PropGridInstance.blender_to_xml(obj)
-            file_name = get_text_and_delete(prop_node, "FileName")
-            if file_name not in index_by_filename:
-                index_by_filename[file_name] = index
-                index += 1
-            ET.SubElement(prop_node, "Index").text = str(index_by_filename[file_name])
-            instances_node.append(prop_node)
-            
-        if prop_grid_node.find("FileNames"): #delete existing
-            prop_grid_node.remove(prop_grid_node.find("FileNames"))
-        filenames_node = ET.SubElement(prop_grid_node, "FileNames")
-        
+            yield PropGridInstance.instance_record(obj, index_by_filename, transform_texts_by_obj[obj])
+    
+    @classmethod
+    def filename_records(cls, index_by_filename: Dict[str, int]):
         print(index_by_filename.items())
         for filename, index in sorted(index_by_filename.items(), key = lambda kv: kv[1]):
-            ET.SubElement(filenames_node, "None").text = filename
+            yield ("None", filename)
+    
+    @classmethod
+    def create_terrain(cls, subdivision_x: int, subdivision_y: int, size_x: float, size_y: float, heights) -> BlenderObject:
+        """Creates the same grid as the landscape add-on (vertex i * subdivision_y + j at column i, row j), mirrored along x.
+        heights has one value per vertex."""
+        vertex_count = subdivision_x * subdivision_y
+        i, j = np.divmod(np.arange(vertex_count), subdivision_y)
+        verts = np.zeros((vertex_count, 3), dtype = np.float32)
+        verts[:, 0] = -size_x * (i / (subdivision_x - 1) - 0.5)
+        verts[:, 1] = size_y * (j / (subdivision_y - 1) - 0.5)
+        height_count = min(len(heights), vertex_count)
+        verts[:height_count, 2] = heights[:height_count]
+        
+        # One quad (A, B, C, D) per cell, A = (i, j-1), B = (i, j), C = (i-1, j), D = (i-1, j-1)
+        i, j = np.meshgrid(np.arange(1, subdivision_x), np.arange(1, subdivision_y), indexing = "ij")
+        a = (i * subdivision_y + j - 1).ravel()
+        c = ((i - 1) * subdivision_y + j).ravel()
+        loops = np.column_stack((a, a + 1, c, c - 1)).ravel()
+        face_count = len(a)
+        
+        mesh = bpy.data.meshes.new("Landscape")
+        mesh.vertices.add(vertex_count)
+        mesh.loops.add(len(loops))
+        mesh.polygons.add(face_count)
+        # The attributes behind vertices.co and loops.vertex_index, writing them directly is a plain copy (~100x faster).
+        mesh.attributes["position"].data.foreach_set("vector", verts.ravel())
+        mesh.attributes[".corner_vert"].data.foreach_set("value", loops.astype(np.int32))
+        mesh.polygons.foreach_set("loop_start", np.arange(0, len(loops), 4, dtype = np.int32))
+        mesh.update(calc_edges = True)
         
-        return base_node
+        obj = bpy.data.objects.new(mesh.name, mesh)
+        bpy.context.scene.collection.objects.link(obj)
+        return obj
     
     @classmethod
-    def xml_to_blender(cls, node: ET.Element, prop_import_mode) -> BlenderObject:
-        
-        obj = cls.add_blender_object_to_scene(node)
-        obj["islandxml"] = ET.tostring(node)
-        obj.name = "ISLAND_FILE"
-        set_anno_object_class(obj, cls)
-        
-        terrain_node = node.find("Terrain")
-        if terrain_node is not None:
-            heightmap_node = terrain_node.find("CoarseHeightMap")
-            width = int(get_text(heightmap_node, "width"))
-            height = int(get_text(heightmap_node, "width"))
-            data = [int(s) for s in get_text(heightmap_node, "map").split(" ")]
-            print(f"Heightmap w={width} x h={height} => {len(data)}")
-            grid_width = float(get_text(terrain_node,"GridWidth", "8192"))
-            grid_height = float(get_text(terrain_node,"GridHeight", "8192"))
-            unit_scale = float(get_text(terrain_node,"UnitScale", "0,03125").replace(",", "."))
+    def store_skeleton(cls, obj, node: ET.Element):
+        """Stores the island for the export, without the instances and file names of the prop grid (the export regenerates both)."""
+        removed_children = []
+        for regenerated_node in [node.find("PropGrid/Instances"), node.find("PropGrid/FileNames")]:
+            if regenerated_node is None:
+                continue
+            removed_children.append((regenerated_node, list(regenerated_node)))
+            del regenerated_node[:]
+        XMLBlobStore.store(obj, "islandxml", node)
+        for regenerated_node, children in removed_children:
+            regenerated_node.extend(children)
+    
+    @classmethod
+    def import_terrain(cls, terrain_node: ET.Element):
+        heightmap_node = terrain_node.find("CoarseHeightMap")
+        width = int(get_text(heightmap_node, "width"))
+        height = int(get_text(heightmap_node, "width"))
+        data = np.fromstring(get_text(heightmap_node, "map"), dtype = np.float32, sep = " ")
+        print(f"Heightmap w={width} x h={height} => {len(data)}")
+        grid_width = float(get_text(terrain_node,"GridWidth", "8192"))
+        grid_height = float(get_text(terrain_node,"GridHeight", "8192"))
+        unit_scale = float(get_text(terrain_node,"UnitScale", "0,03125").replace(",", "."))
+        max_height = 8192
+        min_height = float(get_text(terrain_node,"MinMeshLevel", "0"))
+        #0,03125
+        terrain_obj = cls.create_terrain(width, height, grid_width*unit_scale, grid_width*unit_scale, data / max_height * 32)
+        terrain_obj.location.x -= grid_width*unit_scale/2
+        terrain_obj.location.y -= grid_width*unit_scale/2
+        terrain_obj.rotation_euler[2] = radians(90.0)
+        
+        if False:
+            #Make a terrain texture
+            print("Making heightmap")
+            image = bpy.data.images.new("TerrainHeightmap", width=width, height=height)
+            pixels = [None] * width * height
+            maxh = 0.0
+            np_array = np.zeros((width,height,4), dtype = np.float16)
+            for x, row in enumerate(np_array):
+                for y, pix in enumerate(row):
+                    index = (x * np_array.shape[0]) + y
+                    
+                    h = ((data[index]+max_height)/(2*max_height))
+                    pix[0] = h
+                    pix[1] = h
+                    pix[2] = h
+                    pix[3] = 1.0
+                    # For some reason, the height value does not convert correctly. Super weird...
+                    # In theory, after subtracting 0.5 and multiplying with 64, we should get the exact same heightmap...
+            # return obj
+            # for x in range(width):
+            #     for y in range(height):
+            #         index = (y * width) + x
+            #         h = (data[index]/8192.0*0.5)+0.5
+                    
+            #         maxh = max(maxh, data[index])
+            #         r = h
+            #         g = h
+            #         b = h
+            #         a = 1.0
+            #         np_array[index] = [r,g,b,a]
+            #         pixels[index] = [r, g, b, a]
+            # print("Maximum height value", maxh)
+            # flatten list
+            # pixels = [chan for px in pixels for chan in px]
+            image.pixels = np_array.ravel()
+            image.filepath_raw = "C:/Users/test.png"
+            image.file_format = 'PNG'
+            # image.save()
+            # bpy.context.scene.render.image_settings.color_depth = '16'
+
+            #Save as 16bit BW
+            scene = bpy.context.scene
+            settings = scene.render.image_settings
+            old_color_depth, old_format, old_color_mode = (settings.color_depth, settings.file_format, settings.color_mode)
+            settings.color_depth = '16'
+            settings.file_format = 'PNG'
+            settings.color_mode = 'BW'
+            # Save with scene
+            image.save_render('C:/Users/test_smart.png', scene = scene)
+            #Reset settings
+            settings.color_depth = old_color_depth
+            settings.file_format = old_format
+            settings.color_mode = old_color_mode
+            print("Exported image")
+            
             bpy.ops.mesh.landscape_add(subdivision_x=width, subdivision_y=height, mesh_size_x=grid_width*unit_scale, mesh_size_y=grid_width*unit_scale,
-                                       height=0, refresh=True)
+                                        height=0, refresh=True)
             terrain_obj = bpy.context.active_object
-            max_height = 8192
-            min_height = float(get_text(terrain_node,"MinMeshLevel", "0"))
-            #0,03125
-            for i, vert in enumerate(terrain_obj.data.vertices):
-                vert.co.z = data[i] / max_height * 32
-                vert.co.x *= -1
+            heightTex = bpy.data.textures.new('HeightMap', type = 'IMAGE')
+            heightTex.image = image
+
             terrain_obj.location.x -= grid_width*unit_scale/2
             terrain_obj.location.y -= grid_width*unit_scale/2
-            terrain_obj.rotation_euler[2] = radians(90.0)
-            
-            if False:
-                #Make a terrain texture
-                print("Making heightmap")
-                image = bpy.data.images.new("TerrainHeightmap", width=width, height=height)
-                pixels = [None] * width * height
-                maxh = 0.0
-                np_array = np.zeros((width,height,4), dtype = np.float16)
-                for x, row in enumerate(np_array):
-                    for y, pix in enumerate(row):
-                        index = (x * np_array.shape[0]) + y
-                        
-                        h = ((data[index]+max_height)/(2*max_height))
-                        pix[0] = h
-                        pix[1] = h
-                        pix[2] = h
-                        pix[3] = 1.0
-                        # For some reason, the height value does not convert correctly. Super weird...
-                        # In theory, after subtracting 0.5 and multiplying with 64, we should get the exact same heightmap...
-                # return obj
-                # for x in range(width):
-                #     for y in range(height):
-                #         index = (y * width) + x
-                #         h = (data[index]/8192.0*0.5)+0.5
-                        
-                #         maxh = max(maxh, data[index])
-                #         r = h
-                #         g = h
-                #         b = h
-                #         a = 1.0
-                #         np_array[index] = [r,g,b,a]
-                #         pixels[index] = [r, g, b, a]
-                # print("Maximum height value", maxh)
-                # flatten list
-                # pixels = [chan for px in pixels for chan in px]
-                image.pixels = np_array.ravel()
-                image.filepath_raw = "C:/Users/test.png"
-                image.file_format = 'PNG'
-                # image.save()
-                # bpy.context.scene.render.image_settings.color_depth = '16'
-
-                #Save as 16bit BW
-                scene = bpy.context.scene
-                settings = scene.render.image_settings
-                old_color_depth, old_format, old_color_mode = (settings.color_depth, settings.file_format, settings.color_mode)
-                settings.color_depth = '16'
-                settings.file_format = 'PNG'
-                settings.color_mode = 'BW'
-                # Save with scene
-                image.save_render('C:/Users/test_smart.png', scene = scene)
-                #Reset settings
-                settings.color_depth = old_color_depth
-                settings.file_format = old_format
-                settings.color_mode = old_color_mode
-                print("Exported image")
-                
-                bpy.ops.mesh.landscape_add(subdivision_x=width, subdivision_y=height, mesh_size_x=grid_width*unit_scale, mesh_size_y=grid_width*unit_scale,
-                                            height=0, refresh=True)
-                terrain_obj = bpy.context.active_object
-                heightTex = bpy.data.textures.new('HeightMap', type = 'IMAGE')
-                heightTex.image = image
-
-                terrain_obj.location.x -= grid_width*unit_scale/2
-                terrain_obj.location.y -= grid_width*unit_scale/2
-            
-        if prop_import_mode == "None":
-            return obj
-        filenames_node = node.find("PropGrid/FileNames")
+
+    @classmethod
+    def create_prop_blueprints(cls, filenames_node: Optional[ET.Element], prop_import_mode) -> Tuple[List[Optional[BlenderObject]], List[str]]:
+        """Imports one prop per entry of the FileNames (None for skipped vegetation). Returns the props and their data paths."""
         prop_objects = []
+        data_paths = []
         if filenames_node is not None:
             for i, file_node in enumerate(list(filenames_node)):
                 data_path = file_node.text
+                data_paths.append(data_path)
                 if prop_import_mode == "No Vegetation" and "vegetation" in data_path:
                     prop_objects.append(None)
                     continue
@@ -2016,23 +2411,130 @@ class IslandFile:
                         """)
                 prop_obj = Prop.xml_to_blender(prop_xml_node)
                 prop_objects.append(prop_obj)
+        return prop_objects, data_paths
+    
+    @classmethod
+    def delete_prop_blueprints(cls, prop_objects):
+        for prop_obj in prop_objects:
+            if prop_obj is None:
+                continue
+            bpy.data.objects.remove(prop_obj, do_unlink=True)
+    
+    @classmethod
+    def xml_to_blender(cls, node: ET.Element, prop_import_mode, point_instancing = False) -> BlenderObject:
+        
+        obj = cls.add_blender_object_to_scene(node)
+        obj.name = "ISLAND_FILE"
+        set_anno_object_class(obj, cls)
+        cls.store_skeleton(obj, node)
+        
+        terrain_node = node.find("Terrain")
+        if terrain_node is not None:
+            cls.import_terrain(terrain_node)
+            
+        if prop_import_mode == "None":
+            return obj
+        prop_objects, data_paths = cls.create_prop_blueprints(node.find("PropGrid/FileNames"), prop_import_mode)
             
         instances_node = node.find("PropGrid/Instances")
+        if point_instancing:
+            PropGridPointCloud.xml_to_blender(instances_node, prop_objects, data_paths, obj)
+            return obj
         if instances_node is not None:
             instance_nodes = list(instances_node)
             print(len(instance_nodes), " Objects.")
+            transform_data = PropGridInstance.new_transform_data()
             for i, instance_node in enumerate(instance_nodes):
-                if i % int(len(instance_nodes)/100) == 0: 
+                if i % max(1, int(len(instance_nodes)/100)) == 0: 
                     print(str(float(i) / len(instance_nodes) * 100.0) + "%")
-                PropGridInstance.xml_to_blender(instance_node, prop_objects)
+                PropGridInstance.xml_to_blender(instance_node, prop_objects, transform_data = transform_data)
+            PropGridInstance.apply_transform_data(transform_data)
         else:
             print("Island missing PropGrid")
             print(node.find("PropGrid"))
         #delete the blueprint props
-        for prop_obj in prop_objects:
-            if prop_obj is None:
+        cls.delete_prop_blueprints(prop_objects)
+        return obj
+    
+    @classmethod
+    def is_instance_element(cls, element_stack) -> bool:
+        """True if the element that just ended (element_stack holds its ancestors) is a PropGrid instance."""
+        return len(element_stack) == 3 and element_stack[2].tag == "Instances" and element_stack[1].tag == "PropGrid"
+    
+    @classmethod
+    def read_file_names(cls, fullpath: Path) -> Optional[ET.Element]:
+        """First pass over the island file: Only the PropGrid/FileNames, the instances are dropped as soon as they have been read.
+        The FileNames come after the instances, so this is needed to import the instances while streaming them in the second pass."""
+        element_stack = []
+        for event, element in ET.iterparse(fullpath, events = ("start", "end")):
+            if event == "start":
+                element_stack.append(element)
                 continue
-            bpy.data.objects.remove(prop_obj, do_unlink=True)
+            element_stack.pop()
+            if cls.is_instance_element(element_stack):
+                # The instance is the only child left, so this is cheap.
+                del element_stack[2][:]
+            elif len(element_stack) == 2 and element.tag == "FileNames" and element_stack[1].tag == "PropGrid":
+                return element
+        return None
+    
+    @classmethod
+    def import_file(cls, fullpath: Path, prop_import_mode, point_instancing = False, conversion_plan = None) -> BlenderObject:
+        """Streams the island file (iterparse) instead of parsing it as a whole.
+        A first pass reads the FileNames and creates the prop blueprints (after executing the conversion plan, if any).
+        In the second pass, every PropGrid instance is imported as soon as it has been read and is removed from the tree afterwards,
+        so only the skeleton of the island (everything but the instances) is kept and stored for the export.
+        """
+        obj = cls.add_blender_object_to_scene(None)
+        obj.name = "ISLAND_FILE"
+        set_anno_object_class(obj, cls)
+        
+        import_props = prop_import_mode != "None"
+        prop_objects = None
+        data_paths = []
+        point_cloud_data = PropGridPointCloud.new_instance_data()
+        transform_data = PropGridInstance.new_transform_data()
+        instance_count = 0
+        
+        if import_props:
+            file_names_node = cls.read_file_names(fullpath)
+            if conversion_plan is not None and file_names_node is not None:
+                conversion_plan.add_island_props(file_names_node, skip_vegetation = prop_import_mode == "No Vegetation")
+                conversion_plan.execute()
+            prop_objects, data_paths = cls.create_prop_blueprints(file_names_node, prop_import_mode)
+        
+        root = None
+        element_stack = []
+        for event, element in ET.iterparse(fullpath, events = ("start", "end")):
+            if event == "start":
+                if root is None:
+                    root = element
+                element_stack.append(element)
+                continue
+            element_stack.pop()
+            if cls.is_instance_element(element_stack):
+                instance_count += 1
+                if import_props:
+                    if point_instancing:
+                        PropGridPointCloud.add_instance(point_cloud_data, element)
+                    else:
+                        PropGridInstance.xml_to_blender(element, prop_objects, transform_data = transform_data)
+                    if instance_count % 10000 == 0:
+                        print(f"{instance_count} Objects")
+                # The instance is the only child left, so this is cheap.
+                del element_stack[2][:]
+            elif len(element_stack) == 1 and element.tag == "Terrain":
+                cls.import_terrain(element)
+        print(f"{instance_count} Objects.")
+        
+        if import_props:
+            if point_instancing:
+                PropGridPointCloud.create_object(point_cloud_data, prop_objects, data_paths, obj)
+            else:
+                PropGridInstance.apply_transform_data(transform_data)
+                cls.delete_prop_blueprints(prop_objects)
+        
+        cls.store_skeleton(obj, root)
         return obj
 
 class BezierCurve():
@@ -2149,67 +2651,6 @@ class BezierCurve():
         return node
 
 
-class AssetsXML():
-    instance = None
-    def __init__(self):
-        self.path = Path(IO_AnnocfgPreferences.get_path_to_rda_folder(), Path("data/config/export/main/asset/assets.xml"))
-        if not self.path.exists():
-            raise Exception(f"Assets.xml required for this island file. Expected it at '{self.path}'")
-        
-        print("Loading assets.xml")
-        self.tree = ET.parse(self.path)
-        self.root = self.tree.getroot()
-        print("Assets.xml loaded.")
-        
-        self.cfg_cache = {}
-        self.assets_by_guid = {}
-        self.extract_assets(self.root)
-        print("Asset Dict completed")
-        
-    def extract_assets(self, node):
-        if node.tag != "Asset":
-            for c in list(node):
-                self.extract_assets(c)
-            return
-        guid_node = node.find("Values/Standard/GUID")
-        if guid_node is None:
-            return
-        self.assets_by_guid[guid_node.text] = node
-
-    @classmethod
-    def get_instance(cls):
-        if not cls.instance:
-            cls.instance = cls()
-        return cls.instance
-        
-    def get_asset(self, guid):
-        return self.assets_by_guid.get(str(guid), None)
-        asset_node = self.root.find(f".//Asset/Values/Standard[GUID='{guid}']/../..")
-        return asset_node
-    
-    def get_variation_cfg_and_name(self, guid, index):
-        if (guid, index) in self.cfg_cache:
-            return self.cfg_cache[guid, index]
-        asset_node = self.get_asset(guid)
-        if asset_node is None:
-            print("Cannot find asset with guid {guid}")
-            self.cfg_cache[(guid, index)] = None, None
-            return None, None
-        if asset_node.find("Values/Object/Variations") is None:
-            return None, None
-        variations = list(asset_node.find("Values/Object/Variations"))
-        name = asset_node.find("Values/Standard/Name").text
-        if index >= len(variations):
-            print("Missing variation {index} for guid {guid} ({name})")
-            self.cfg_cache[(guid, index)] = None, None
-            return None, None
-        item = variations[index]
-        cfg_filename = item.find("Filename").text
-        
-        self.cfg_cache[(guid, index)] = (cfg_filename, name)
-        return (cfg_filename, name)
-
-
 class GameObject:
     @classmethod
     def add_blender_object_to_scene(cls, node) -> BlenderObject:
@@ -2287,8 +2728,8 @@ class GameObject:
         return obj
         
     @classmethod
-    def xml_to_blender(cls, node: ET.Element, assetsXML, parent_obj = None) -> BlenderObject:
-        """
+    def xml_to_blender(cls, node: ET.Element, assetsXML, parent_obj = None, subfile_template: Optional[HierarchyTemplate] = None) -> BlenderObject:
+        """subfile_template: Copied instead of importing the .cfg of the object again (objects with the same guid and variation).
         <None>
             <guid>100689</guid>
             <ID>-9221085318956974056</ID>
@@ -2354,20 +2795,16 @@ class GameObject:
         variation = int(get_text(node, "Variation", "0"))
         file_name, asset_name = assetsXML.get_variation_cfg_and_name(guid, variation)
         obj.name = "GameObject_" + str(asset_name)
-        if file_name is not None:
+        if file_name is not None and subfile_template is not None:
+            subfile_template.copy(obj)
+        elif file_name is not None:
             try:
-                subfile_node = ET.fromstring(f"""
-                    <Config>
-                        <FileName>{file_name}</FileName>
-                        <ConfigType>FILE</ConfigType>
-                        <Transformer>
-                            <Config>
-                            <ConfigType>ORIENTATION_TRANSFORM</ConfigType>
-                            <Conditions>0</Conditions>
-                            </Config>
-                        </Transformer>
-                    </Config>
-                """)
+                subfile_node = ET.Element("Config")
+                ET.SubElement(subfile_node, "FileName").text = file_name
+                ET.SubElement(subfile_node, "ConfigType").text = "FILE"
+                transformer_node = ET.SubElement(ET.SubElement(subfile_node, "Transformer"), "Config")
+                ET.SubElement(transformer_node, "ConfigType").text = "ORIENTATION_TRANSFORM"
+                ET.SubElement(transformer_node, "Conditions").text = "0"
                 blender_obj = SubFile.xml_to_blender(subfile_node, obj)
             except Exception as ex:
                 print(f"Error {guid} {variation} {file_name} {ex}")
@@ -2391,10 +2828,9 @@ class GameObject:
                 ET.SubElement(mesh_node, "Scale").text =  scale[0].replace(".", ",")
         else:
             ET.SubElement(mesh_node, "Scale").text = ' '.join(scale).replace(".", ",")
-        for child in obj.children:
-            if get_anno_object_class(child) == BezierCurve:
-                bezier_node = BezierCurve.blender_to_xml(child, node, child_map)
-                node.append(bezier_node)
+        for child in SceneIndex.children_of_class(obj, BezierCurve):
+            bezier_node = BezierCurve.blender_to_xml(child, node, child_map)
+            node.append(bezier_node)
         return node
     
     
@@ -2405,7 +2841,75 @@ class IslandGamedataFile:
         file_obj = add_empty_to_scene()  
         return file_obj
     @classmethod
-    def create_maps(cls, node: ET.Element):
+    def decode_bit_map(cls, map_node: ET.Element, width: int, height: int):
+        """One bit per cell, least significant bit first."""
+        byte_data = np.fromstring(get_text(map_node, "bits", ""), dtype = np.uint8, sep = " ")
+        bits = np.unpackbits(byte_data, bitorder = "little")
+        data = np.zeros(width * height, dtype = np.float32)
+        count = min(len(bits), len(data))
+        data[:count] = bits[:count]
+        return data
+    
+    @classmethod
+    def decode_value_map(cls, map_node: ET.Element, width: int, height: int):
+        """One int16 per cell, returned as (upper byte, lower byte) in [0, 1]."""
+        values = np.fromstring(get_text(map_node, "val", ""), dtype = np.int32, sep = " ").astype(np.int16).view(np.uint16)
+        data = np.zeros(width * height, dtype = np.uint16)
+        count = min(len(values), len(data))
+        data[:count] = values[:count]
+        return (data >> 8).astype(np.float32) / 255.0, (data & 0xFF).astype(np.float32) / 255.0
+    
+    @classmethod
+    def create_map_image(cls, name: str, width: int, height: int, red, green, blue, directory: Optional[Path]):
+        pixels = np.ones((width * height, 4), dtype = np.float32)
+        pixels[:, 0] = red
+        pixels[:, 1] = green
+        pixels[:, 2] = blue
+        image = bpy.data.images.new(name, width=width, height=height)
+        image.pixels.foreach_set(pixels.ravel())
+        if directory is not None:
+            directory.mkdir(parents = True, exist_ok = True)
+            image.filepath_raw = str(Path(directory, f"{name}.png"))
+            image.file_format = 'PNG'
+            image.save()
+        else:
+            image.pack()
+        return image
+    
+    @classmethod
+    def create_map_overlay(cls, image, width: int, height: int, parent_obj):
+        """A plane covering the map cells (column = x, row = z in anno coordinates) textured with the map."""
+        corners = []
+        for x, z in [(0, 0), (width, 0), (width, height), (0, height)]:
+            transform = Transform(loc = [float(x), 0.05, float(z)], anno_coords = True)
+            transform.convert_to_blender_coords()
+            corners.append(transform.location)
+        mesh = bpy.data.meshes.new(image.name)
+        mesh.from_pydata(corners, [], [(0, 1, 2, 3)])
+        uv_layer = mesh.uv_layers.new()
+        uv_layer.data.foreach_set("uv", [0.0, 0.0, 1.0, 0.0, 1.0, 1.0, 0.0, 1.0])
+        mesh.update()
+        
+        material = bpy.data.materials.new(image.name)
+        material.use_nodes = True
+        texture_node = material.node_tree.nodes.new("ShaderNodeTexImage")
+        texture_node.image = image
+        texture_node.interpolation = "Closest"
+        bsdf = material.node_tree.nodes["Principled BSDF"]
+        material.node_tree.links.new(texture_node.outputs["Color"], bsdf.inputs["Base Color"])
+        mesh.materials.append(material)
+        
+        obj = bpy.data.objects.new("MAP_" + image.name, mesh)
+        bpy.context.scene.collection.objects.link(obj)
+        obj.parent = parent_obj
+        obj.hide_render = True
+        return obj
+    
+    @classmethod
+    def create_maps(cls, node: ET.Element, directory: Optional[Path] = None, parent_obj = None, overlays = False):
+        """Decodes the water, river, environment and area id maps into images.
+        Saves them to directory (packed into the .blend if None) and adds an overlay plane for each if requested."""
+        images = []
         bit_map_nodes = [
             node.find("./GameSessionManager/WorldManager/Water"),
             node.find("./GameSessionManager/WorldManager/RiverGrid"),
@@ -2415,96 +2919,118 @@ class IslandGamedataFile:
                 continue
             width = int(get_text(map_node, "x", "0"))
             height = int(get_text(map_node, "y", "0"))
-            byte_data = [int(i) for i in get_text(map_node, "bits").split(" ")]
-            data = [0] * (width*height)
-            for i, byte in enumerate(byte_data):
-                bytestring = "{0:08b}".format(byte)[::-1]
-                for j, bit in enumerate(bytestring):
-                    data[i*8 + j] = int(bit)
-            image = bpy.data.images.new(map_node.tag, width=width, height=height)
-            pixels = [None] * width * height
-            np_array = np.zeros((width,height,4), dtype = np.float16)
-            for x, row in enumerate(np_array):
-                for y, pix in enumerate(row):
-                    index = ((x * np_array.shape[0]) + y)
-                    h = data[index]
-                    pix[0] = h
-                    pix[1] = h
-                    pix[2] = h
-                    pix[3] = 1.0
-            image.pixels = np_array.ravel()
-            image.filepath_raw = f"C:/Users/{map_node.tag}.png"
-            image.file_format = 'PNG'
-            image.save()
+            data = cls.decode_bit_map(map_node, width, height)
+            images.append((cls.create_map_image(map_node.tag, width, height, data, data, data, directory), width, height))
         val_map_nodes = [
             node.find("./GameSessionManager/WorldManager/EnvironmentGrid/EnvironmentGRid"),
-            node.find("./GameSessionManager/AreaIDs"), #int16, but still looks somewhat wrong.
+            node.find("./GameSessionManager/AreaIDs"),
         ]
         for map_node in val_map_nodes:
             if map_node is None:
                 continue
             width = int(get_text(map_node, "x", "0"))
             height = int(get_text(map_node, "y", "0"))
-            data = [int(i) for i in get_text(map_node, "val").split(" ")]
-            print(width*height, len(data), len(data)/width/height)
-            image = bpy.data.images.new(map_node.tag, width=width, height=height)
-            pixels = [None] * width * height
-            np_array = np.zeros((width,height,4), dtype = np.float16)
-            for x, row in enumerate(np_array):
-                for y, pix in enumerate(row):
-                    index = (x * np_array.shape[0]) + y
-                    upper_byte = data[index] & (1<<16)-(1<<8)
-                    lower_byte = data[index] & (1<<8)
-                    pix[0] = upper_byte / 255.0
-                    pix[1] = lower_byte / 255.0
-                    pix[2] = 0.0
-                    pix[3] = 1.0
-            image.pixels = np_array.ravel()
-            image.filepath_raw = f"C:/Users/{map_node.tag}.png"
-            image.file_format = 'PNG'
-            image.save()
+            upper_bytes, lower_bytes = cls.decode_value_map(map_node, width, height)
+            images.append((cls.create_map_image(map_node.tag, width, height, upper_bytes, lower_bytes, 0.0, directory), width, height))
+        if overlays:
+            for image, width, height in images:
+                cls.create_map_overlay(image, width, height, parent_obj)
+        return [image for image, _, _ in images]
             
     @classmethod
-    def xml_to_blender(cls, node: ET.Element, assetsXML) -> BlenderObject:
+    def store_skeleton(cls, obj, node: ET.Element):
+        """Stores the file for the export. Only the IDs of the game objects are kept, the export regenerates them
+        and uses the IDs to put them back into their original container."""
+        removed_children = []
+        for objects_node in node.findall("./GameSessionManager/AreaManagerData/None/Data/Content/AreaObjectManager/GameObject/objects"):
+            children = list(objects_node)
+            stubs = []
+            for obj_node in children:
+                stub = ET.Element(obj_node.tag)
+                ET.SubElement(stub, "ID").text = get_text(obj_node, "ID")
+                stubs.append(stub)
+            objects_node[:] = stubs
+            removed_children.append((objects_node, children))
+        XMLBlobStore.store(obj, "islandgamedataxml", node)
+        for objects_node, children in removed_children:
+            objects_node[:] = children
+    
+    @classmethod
+    def xml_to_blender(cls, node: ET.Element, assetsXML, conversion_plan = None) -> BlenderObject:
         obj = cls.add_blender_object_to_scene(node)
-        obj["islandgamedataxml"] = ET.tostring(node)
         obj.name = "ISLAND_GAMEDATA_FILE"
         set_anno_object_class(obj, cls)
-        #create_maps(node)
-        
-        objects_nodes = node.findall("./GameSessionManager/AreaManagerData/None/Data/Content/AreaObjectManager/GameObject/objects")
-        for c, objects_node in enumerate(objects_nodes):
-            for i, obj_node in enumerate(objects_node):
-                print(f"Container {c+1} / {len(objects_nodes)}; Object {i+1} / {len(objects_node)},")
-                GameObject.xml_to_blender(obj_node, assetsXML)
+        cls.store_skeleton(obj, node)
+        
+        # Objects with the same guid and variation share their .cfg, import it once and then place all of them.
+        buckets = defaultdict(list)
+        for objects_node in node.findall("./GameSessionManager/AreaManagerData/None/Data/Content/AreaObjectManager/GameObject/objects"):
+            for obj_node in objects_node:
+                buckets[(get_text(obj_node, "guid"), int(get_text(obj_node, "Variation", "0")))].append(obj_node)
+        
+        if conversion_plan is not None:
+            for guid, variation in buckets.keys():
+                file_name, _ = assetsXML.get_variation_cfg_and_name(guid, variation)
+                if file_name is not None:
+                    conversion_plan.add_subfile(file_name)
+            conversion_plan.execute()
+        
+        bucket_statistics = []
+        for b, ((guid, variation), obj_nodes) in enumerate(buckets.items()):
+            start = time.perf_counter()
+            _, asset_name = assetsXML.get_variation_cfg_and_name(guid, variation)
+            print(f"Bucket {b+1} / {len(buckets)}: {asset_name} ({guid}, variation {variation}), {len(obj_nodes)} objects")
+            # The first object imports the .cfg (or its collection if subfiles are instanced), the others get a copy of it.
+            first_obj = GameObject.xml_to_blender(obj_nodes[0], assetsXML)
+            subfile_obj = next((child for child in first_obj.children if get_anno_object_class(child) == SubFile), None)
+            subfile_template = HierarchyTemplate(subfile_obj) if subfile_obj is not None else None
+            import_time = time.perf_counter() - start
+            for obj_node in obj_nodes[1:]:
+                GameObject.xml_to_blender(obj_node, assetsXML, subfile_template = subfile_template)
+            place_time = time.perf_counter() - start - import_time
+            bucket_statistics.append((asset_name, guid, variation, len(obj_nodes), import_time, place_time))
+        
+        print(f"Imported {sum(stats[3] for stats in bucket_statistics)} game objects in {len(bucket_statistics)} buckets:")
+        for asset_name, guid, variation, count, import_time, place_time in sorted(bucket_statistics, key = lambda stats: stats[4] + stats[5], reverse = True):
+            print(f"    {count:5d}x {asset_name} ({guid}, variation {variation}): import {import_time * 1000.0:.0f} ms, placement {place_time * 1000.0:.0f} ms")
+        return obj
     
     @classmethod
     def blender_to_xml(cls, obj, randomize_ids = False):
         """Only exports the prop grid. Not the heighmap or the prop FileNames."""
-        base_node = ET.fromstring(obj["islandgamedataxml"])
+        base_node = XMLBlobStore.load(obj, "islandgamedataxml")
+        if base_node is None:
+            print(f"Error: {obj.name} has no stored xml, the island needs to be imported again.")
+            return None
         
         objects_node_by_id = {}
-        objects_nodes = base_node.findall("./GameSessionManager/AreaManagerData/None/Data/Content/AreaObjectManager/GameObject/objects")
+        game_object_nodes = base_node.findall("./GameSessionManager/AreaManagerData/None/Data/Content/AreaObjectManager/GameObject")
+        objects_nodes = [objects_node for game_object_node in game_object_nodes for objects_node in game_object_node.findall("objects")]
         
         default_objects_node = objects_nodes[0]
         for c, objects_node in enumerate(objects_nodes):
             for i, obj_node in enumerate(list(objects_node)):
                 obj_id = get_text(obj_node, "ID")
                 objects_node_by_id[obj_id] = objects_node
-                objects_node.remove(obj_node)
-        for obj in bpy.data.objects:
-            if get_anno_object_class(obj) != GameObject:
-                continue
+        
+        # Only the objects are sorted into their containers here, their nodes are created while writing.
+        objs_by_objects_node = {objects_node: [] for objects_node in objects_nodes}
+        for obj in SceneIndex.objects_of_class(GameObject):
+            obj_id = obj.dynamic_properties.get_string("ID", "").replace("ID_", "")
+            objs_by_objects_node[objects_node_by_id.get(obj_id, default_objects_node)].append(obj)
+        
+        for game_object_node in game_object_nodes:
+            for objects_node in game_object_node.findall("objects"):
+                StreamedElement.replace(game_object_node, objects_node, cls.game_object_records(objs_by_objects_node[objects_node], randomize_ids))
+        return base_node   
+    
+    @classmethod
+    def game_object_records(cls, objs, randomize_ids = False):
+        for obj in objs:
             game_obj_node = GameObject.blender_to_xml(obj)
-            obj_id = get_text(game_obj_node, "ID")
-            objects_node = objects_node_by_id.get(obj_id, default_objects_node)
-            
             if randomize_ids:
                 game_obj_node.find("ID").text = str(random.randint(-2**63, 2**63-1))
-            
-            objects_node.append(game_obj_node)
-            
-        return base_node   
+            yield game_obj_node
 
 
 anno_object_classes = [
@@ -2512,6 +3038,7 @@ anno_object_classes = [
     SubFile, Decal, Propcontainer, Prop, Particle, IfoCube, IfoPlane, Sequence, DummyGroup,
     Dummy, Cf7DummyGroup, Cf7Dummy, FeedbackConfig,SimpleAnnoFeedbackEncodingObject, ArbitraryXMLAnnoObject, Light, Cloth, Material, IfoFile, Spline, IslandFile, PropGridInstance,
     IslandGamedataFile, GameObject, AnimationsNode, Animation, AnimationSequences, AnimationSequence, Track, TrackElement, IfoMeshHeightmap,BezierCurve,
+    PropGridPointCloud,
 ]
 
 def str_to_class(classname):
@@ -2529,7 +3056,19 @@ def set_anno_object_class(obj, cls: type):
     
 
     
+@persistent
+def clear_import_caches(*args):
+    """The import caches hold materials, objects and collections, which are invalid after loading another file and after undo/redo
+    (the ImportedModelCache templates have no users, they do not even survive an undo step)."""
+    Material.materialCache = {}
+    Prop.prop_data_by_filename = {}
+    Prop.prop_obj_blueprints = {}
+    SubFile.subfile_collections = {}
+    ImportedModelCache.templates = {}
+
 def register():
+    for handlers in [bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post]:
+        handlers.append(clear_import_caches)
     bpy.types.Object.anno_object_class_str = bpy.props.EnumProperty(name="Anno Object Class", description = "Determines the type of the object.",
                                                                 items = [(cls.__name__, cls.__name__, cls.__name__) for cls in anno_object_classes]
                                                                 , default = "NoAnnoObject")
@@ -2537,5 +3076,8 @@ def register():
     #CollectionProperty(type = AnnoImageTextureProperties)
 
 def unregister():
+    for handlers in [bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post]:
+        if clear_import_caches in handlers:
+            handlers.remove(clear_import_caches)
     del bpy.types.Object.anno_object_class_str
 
@@ -0,0 +1,139 @@
+import json
+import sqlite3
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .prefs import IO_AnnocfgPreferences
+
+
+class AssetsXML():
+    """GUID index of the assets.xml: GUID -> (Name, Template, Variations/Item/Filename list).
+
+    The assets.xml is several hundred MB, so it is only streamed (iterparse) once to build the index.
+    The index is stored as sqlite database (in the conversion cache folder if set, otherwise next to the assets.xml)
+    and rebuilt when the size or modification time of the assets.xml changes.
+    All callers share one instance (get_instance).
+    """
+    instance = None
+    FORMAT_VERSION = "1"
+    INDEX_NAME = "assets_index.sqlite"
+
+    def __init__(self):
+        self.path = Path(IO_AnnocfgPreferences.get_path_to_rda_folder(), Path("data/config/export/main/asset/assets.xml"))
+        if not self.path.exists():
+            raise Exception(f"Assets.xml required for this island file. Expected it at '{self.path}'")
+        self.cfg_cache = {}
+        self.assets_by_guid = {}
+        self.source_id = self.get_source_id()
+        self.index_path = self.get_index_path()
+        self.connection = sqlite3.connect(str(self.index_path))
+        if not self.is_index_valid():
+            self.build_index()
+
+    def get_source_id(self) -> str:
+        stat = self.path.stat()
+        return f"{self.path.as_posix()}|{stat.st_size}|{stat.st_mtime_ns}"
+
+    def get_index_path(self) -> Path:
+        cache_path = IO_AnnocfgPreferences.get_conversion_cache_path()
+        if cache_path is not None:
+            cache_path.mkdir(parents = True, exist_ok = True)
+            return Path(cache_path, self.INDEX_NAME)
+        return Path(self.path.parent, self.INDEX_NAME)
+
+    def is_index_valid(self) -> bool:
+        try:
+            meta = dict(self.connection.execute("SELECT key, value FROM meta").fetchall())
+        except sqlite3.DatabaseError:
+            return False
+        return meta.get("version") == self.FORMAT_VERSION and meta.get("source") == self.source_id
+
+    def is_current(self) -> bool:
+        return self.path.exists() and self.get_source_id() == self.source_id
+
+    def build_index(self):
+        print("Indexing assets.xml")
+        connection = self.connection
+        connection.execute("DROP TABLE IF EXISTS meta")
+        connection.execute("DROP TABLE IF EXISTS assets")
+        connection.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+        connection.execute("CREATE TABLE assets (guid TEXT PRIMARY KEY, name TEXT, template TEXT, variations TEXT)")
+        rows = []
+        count = 0
+        element_stack = []
+        asset_depth = 0
+        for event, element in ET.iterparse(self.path, events = ("start", "end")):
+            if event == "start":
+                element_stack.append(element)
+                if element.tag == "Asset":
+                    asset_depth += 1
+                continue
+            element_stack.pop()
+            if element.tag != "Asset":
+                continue
+            asset_depth -= 1
+            # Nested assets belong to their outer asset.
+            if asset_depth > 0:
+                continue
+            row = self.asset_row(element)
+            if row is not None:
+                rows.append(row)
+            if element_stack:
+                element_stack[-1].remove(element)
+            if len(rows) >= 10000:
+                connection.executemany("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?)", rows)
+                count += len(rows)
+                rows = []
+        connection.executemany("INSERT OR REPLACE INTO assets VALUES (?, ?, ?, ?)", rows)
+        count += len(rows)
+        connection.executemany("INSERT INTO meta VALUES (?, ?)", [("version", self.FORMAT_VERSION), ("source", self.source_id)])
+        connection.commit()
+        print(f"Indexed {count} assets in {self.index_path}")
+
+    def asset_row(self, asset_node: ET.Element) -> Optional[Tuple[str, Optional[str], Optional[str], Optional[str]]]:
+        guid = asset_node.findtext("Values/Standard/GUID")
+        if guid is None:
+            return None
+        variations_node = asset_node.find("Values/Object/Variations")
+        variations = None
+        if variations_node is not None:
+            variations = json.dumps([item.findtext("Filename") for item in variations_node])
+        return (guid, asset_node.findtext("Values/Standard/Name"), asset_node.findtext("Template"), variations)
+
+    @classmethod
+    def get_instance(cls):
+        if not cls.instance or not cls.instance.is_current():
+            cls.instance = cls()
+        return cls.instance
+
+    def get_asset(self, guid) -> Optional[Tuple[Optional[str], Optional[str], Optional[List[Optional[str]]]]]:
+        """Returns (name, template, variation filenames or None) of the asset."""
+        guid = str(guid)
+        if guid not in self.assets_by_guid:
+            row = self.connection.execute("SELECT name, template, variations FROM assets WHERE guid = ?", (guid,)).fetchone()
+            if row is not None:
+                name, template, variations = row
+                row = (name, template, json.loads(variations) if variations is not None else None)
+            self.assets_by_guid[guid] = row
+        return self.assets_by_guid[guid]
+
+    def get_variation_cfg_and_name(self, guid, index):
+        if (guid, index) in self.cfg_cache:
+            return self.cfg_cache[guid, index]
+        asset = self.get_asset(guid)
+        if asset is None:
+            print(f"Cannot find asset with guid {guid}")
+            self.cfg_cache[(guid, index)] = None, None
+            return None, None
+        name, template, variations = asset
+        if variations is None:
+            return None, None
+        if index >= len(variations):
+            print(f"Missing variation {index} for guid {guid} ({name})")
+            self.cfg_cache[(guid, index)] = None, None
+            return None, None
+        cfg_filename = variations[index]
+
+        self.cfg_cache[(guid, index)] = (cfg_filename, name)
+        return (cfg_filename, name)
@@ -0,0 +1,84 @@
+import base64
+import zlib
+import xml.etree.ElementTree as ET
+from typing import Optional
+
+import bpy
+from bpy.app.handlers import persistent
+
+
+class XMLBlobStore():
+    """Stores the xml needed to export a file again (f.e. the skeleton of an island) outside of the object.
+    The xml is compressed (zlib, base64 encoded) into a hidden text datablock, the object property only contains its name.
+    Keeps ID properties small, which are otherwise copied with every undo step and written on every save.
+    Objects imported with older versions still contain the xml itself, it is read as well.
+    Texts of deleted objects are removed before saving.
+    """
+    TEXT_PREFIX = ".anno_xml_"
+    COMPRESSION_LEVEL = 6
+    PROPERTY_NAMES = ["islandxml", "islandgamedataxml"]
+
+    @classmethod
+    def store(cls, obj, property_name: str, node: ET.Element):
+        cls.remove(obj, property_name)
+        text = bpy.data.texts.new(cls.TEXT_PREFIX + obj.name)
+        text.use_fake_user = True
+        text.from_string(base64.b64encode(zlib.compress(ET.tostring(node), cls.COMPRESSION_LEVEL)).decode("ascii"))
+        obj[property_name] = text.name
+
+    @classmethod
+    def load(cls, obj, property_name: str) -> Optional[ET.Element]:
+        """Returns None if the object has no xml or its text is missing."""
+        value = obj.get(property_name)
+        if value is None:
+            return None
+        if cls.is_inline(value):
+            return ET.fromstring(value)
+        text = bpy.data.texts.get(value)
+        if text is None:
+            print(f"Error: Missing xml data {value} of {obj.name}")
+            return None
+        return ET.fromstring(zlib.decompress(base64.b64decode(text.as_string())))
+
+    @classmethod
+    def remove(cls, obj, property_name: str):
+        value = obj.get(property_name)
+        if value is None or cls.is_inline(value):
+            return
+        text = bpy.data.texts.get(value)
+        if text is not None:
+            bpy.data.texts.remove(text)
+
+    @classmethod
+    def is_inline(cls, value) -> bool:
+        if isinstance(value, bytes):
+            return True
+        return not str(value).startswith(cls.TEXT_PREFIX)
+
+    @classmethod
+    def remove_orphans(cls):
+        """Removes the texts that no object (with users, deleted objects stay in bpy.data until saved) refers to."""
+        used_names = set()
+        for obj in bpy.data.objects:
+            if obj.users == 0:
+                continue
+            for property_name in cls.PROPERTY_NAMES:
+                value = obj.get(property_name)
+                if value is not None and not cls.is_inline(value):
+                    used_names.add(value)
+        for text in [text for text in bpy.data.texts if text.name.startswith(cls.TEXT_PREFIX) and text.name not in used_names]:
+            print(f"Removing xml data {text.name}, its object was deleted")
+            bpy.data.texts.remove(text)
+
+
+@persistent
+def remove_orphan_xml_blobs(*args):
+    XMLBlobStore.remove_orphans()
+
+
+def register():
+    bpy.app.handlers.save_pre.append(remove_orphan_xml_blobs)
+
+def unregister():
+    if remove_orphan_xml_blobs in bpy.app.handlers.save_pre:
+        bpy.app.handlers.save_pre.remove(remove_orphan_xml_blobs)
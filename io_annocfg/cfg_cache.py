@@ -0,0 +1,197 @@
+import json
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import bpy
+from bpy.app.handlers import persistent
+
+from .prefs import IO_AnnocfgPreferences
+
+
+class CfgCache():
+    """Bookkeeping for the .blend files of the cfg cache (see SubFile.cache_to_library).
+
+    Every use of a subfile is counted in a statistics file in the cache folder, so the counters survive restarts.
+    The file is written at the end of every operator (and before saving), not for every use.
+    A subfile is only cached once it has been used often enough or when importing it took long enough.
+    If the cache grows beyond its budget, the least recently (LRU) or least frequently (LFU) used files are deleted.
+    """
+    FORMAT_VERSION = 1
+    STATISTICS_NAME = "cache_statistics.json"
+
+    entries: Dict[str, dict] = {}
+    hits = 0
+    misses = 0
+    statistics_root: Optional[Path] = None
+    dirty = False
+
+    @classmethod
+    def root(cls) -> Path:
+        root = IO_AnnocfgPreferences.get_cfg_cache_path()
+        if root != cls.statistics_root:
+            cls.load_statistics(root)
+        return root
+
+    @classmethod
+    def blend_path(cls, data_path: str) -> Path:
+        return Path(IO_AnnocfgPreferences.get_cfg_cache_path(), Path(data_path + ".blend"))
+
+    @classmethod
+    def load_statistics(cls, root: Path):
+        cls.entries = {}
+        cls.hits = 0
+        cls.misses = 0
+        cls.statistics_root = root
+        cls.dirty = False
+        statistics_path = Path(root, cls.STATISTICS_NAME)
+        if statistics_path.exists():
+            try:
+                with open(statistics_path, "r") as f:
+                    content = json.load(f)
+                if content.get("version") == cls.FORMAT_VERSION:
+                    cls.entries = content.get("entries", {})
+                    cls.hits = content.get("hits", 0)
+                    cls.misses = content.get("misses", 0)
+                    return
+            except (OSError, ValueError) as ex:
+                print(f"Warning: Could not read cfg cache statistics {statistics_path}: {ex}")
+        # No (valid) statistics yet, but there may already be cached files.
+        if root.exists():
+            for blend_file in root.rglob("*.blend"):
+                stat = blend_file.stat()
+                data_path = blend_file.relative_to(root).with_suffix("").as_posix()
+                cls.entries[data_path] = {"uses": 0, "last_used": stat.st_mtime, "import_ms": 0.0, "size": stat.st_size}
+            cls.dirty = len(cls.entries) > 0
+
+    @classmethod
+    def flush(cls):
+        if not cls.dirty or cls.statistics_root is None or not cls.statistics_root.exists():
+            return
+        statistics_path = Path(cls.statistics_root, cls.STATISTICS_NAME)
+        temp_path = statistics_path.with_suffix(".tmp")
+        try:
+            with open(temp_path, "w") as f:
+                json.dump({"version": cls.FORMAT_VERSION, "hits": cls.hits, "misses": cls.misses, "entries": cls.entries}, f)
+            os.replace(temp_path, statistics_path)
+        except OSError as ex:
+            print(f"Warning: Could not write cfg cache statistics {statistics_path}: {ex}")
+            return
+        cls.dirty = False
+
+    @classmethod
+    def entry(cls, data_path: str) -> dict:
+        cls.root()
+        if data_path not in cls.entries:
+            cls.entries[data_path] = {"uses": 0, "last_used": 0.0, "import_ms": 0.0, "size": 0}
+        return cls.entries[data_path]
+
+    @classmethod
+    def record_use(cls, data_path: str):
+        entry = cls.entry(data_path)
+        entry["uses"] += 1
+        entry["last_used"] = time.time()
+        cls.dirty = True
+
+    @classmethod
+    def record_hit(cls, data_path: str):
+        cls.root()
+        cls.hits += 1
+        cls.dirty = True
+
+    @classmethod
+    def record_miss(cls, data_path: str):
+        cls.root()
+        cls.misses += 1
+        cls.dirty = True
+
+    @classmethod
+    def record_import_time(cls, data_path: str, import_ms: float):
+        entry = cls.entry(data_path)
+        entry["import_ms"] = import_ms
+        cls.dirty = True
+
+    @classmethod
+    def should_cache(cls, data_path: str) -> bool:
+        if not IO_AnnocfgPreferences.cfg_cache_writing_enabled():
+            return False
+        entry = cls.entry(data_path)
+        if entry["uses"] >= IO_AnnocfgPreferences.cfg_cache_min_uses():
+            return True
+        return entry["import_ms"] >= IO_AnnocfgPreferences.cfg_cache_min_import_ms()
+
+    @classmethod
+    def record_cached(cls, data_path: str):
+        blend_path = cls.blend_path(data_path)
+        if not blend_path.exists():
+            return
+        entry = cls.entry(data_path)
+        entry["size"] = blend_path.stat().st_size
+        cls.dirty = True
+        cls.evict(keep = data_path)
+
+    @classmethod
+    def remove(cls, data_path: str):
+        blend_path = cls.blend_path(data_path)
+        if blend_path.exists():
+            blend_path.unlink()
+        entry = cls.entry(data_path)
+        entry["size"] = 0
+        cls.dirty = True
+
+    @classmethod
+    def total_size(cls) -> int:
+        cls.root()
+        return sum(entry["size"] for entry in cls.entries.values())
+
+    @classmethod
+    def eviction_order(cls) -> List[str]:
+        cached = [data_path for data_path, entry in cls.entries.items() if entry["size"] > 0]
+        if IO_AnnocfgPreferences.cfg_cache_eviction_policy() == "LFU":
+            return sorted(cached, key = lambda data_path: (cls.entries[data_path]["uses"], cls.entries[data_path]["last_used"]))
+        return sorted(cached, key = lambda data_path: cls.entries[data_path]["last_used"])
+
+    @classmethod
+    def evict(cls, keep: Optional[str] = None):
+        """Deletes cached files (in the order of the eviction policy) until the cache fits into its budget."""
+        budget = IO_AnnocfgPreferences.cfg_cache_budget_mb() * 1024 * 1024
+        if budget <= 0:
+            return
+        total_size = cls.total_size()
+        for data_path in cls.eviction_order():
+            if total_size <= budget:
+                break
+            if data_path == keep:
+                continue
+            total_size -= cls.entries[data_path]["size"]
+            print(f"Evicting {data_path} from the cfg cache")
+            cls.remove(data_path)
+
+    @classmethod
+    def top_entries(cls, count: int = 10) -> List[Tuple[str, dict]]:
+        cls.root()
+        return sorted(cls.entries.items(), key = lambda item: item[1]["uses"], reverse = True)[:count]
+
+    @classmethod
+    def hit_rate(cls) -> float:
+        cls.root()
+        total = cls.hits + cls.misses
+        return cls.hits / total * 100.0 if total else 0.0
+
+
+@persistent
+def flush_cfg_cache_statistics(*args):
+    CfgCache.flush()
+
+
+def register():
+    IO_AnnocfgPreferences.snapshot_end_callbacks.append(CfgCache.flush)
+    bpy.app.handlers.save_pre.append(flush_cfg_cache_statistics)
+
+def unregister():
+    CfgCache.flush()
+    if CfgCache.flush in IO_AnnocfgPreferences.snapshot_end_callbacks:
+        IO_AnnocfgPreferences.snapshot_end_callbacks.remove(CfgCache.flush)
+    if flush_cfg_cache_statistics in bpy.app.handlers.save_pre:
+        bpy.app.handlers.save_pre.remove(flush_cfg_cache_statistics)
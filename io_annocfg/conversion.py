@@ -0,0 +1,138 @@
+import os
+import shutil
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional
+
+from .prefs import IO_AnnocfgPreferences
+from .conversion_cache import ConversionCache
+
+RDM4_ARGUMENTS = "-n"
+TEXCONV_ARGUMENTS = "-ft PNG -sepalpha -y"
+
+
+def glb_path(fullpath: Path, rdm4_path: Optional[Path] = None) -> Path:
+    """Returns where the .glb of the .rdm file is (or will be) stored: In the conversion cache or next to the .rdm file."""
+    if rdm4_path is None:
+        rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
+    flags = {"mirror_models": IO_AnnocfgPreferences.mirror_models()}
+    cached_path = ConversionCache.output_path("glb", [fullpath], fullpath.stem + ".glb", rdm4_path, RDM4_ARGUMENTS, flags)
+    if cached_path is not None:
+        return cached_path
+    return fullpath.with_suffix(".glb")
+
+def animated_glb_path(model_fullpath: Path, animation_fullpath: Path, rdm4_path: Optional[Path] = None) -> Path:
+    filename = model_fullpath.stem + "_a_" + animation_fullpath.stem + ".glb"
+    if rdm4_path is None:
+        rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
+    flags = {"mirror_models": IO_AnnocfgPreferences.mirror_models()}
+    cached_path = ConversionCache.output_path("animated_glb", [model_fullpath, animation_fullpath], filename, rdm4_path, "-sam --force", flags)
+    if cached_path is not None:
+        return cached_path
+    return Path(model_fullpath.parent, Path(filename))
+
+def png_path(fullpath: Path, texconv_path: Optional[Path] = None) -> Path:
+    if texconv_path is None:
+        texconv_path = IO_AnnocfgPreferences.get_path_to_texconv()
+    flags = {"texture_quality": IO_AnnocfgPreferences.get_texture_quality()}
+    cached_path = ConversionCache.output_path("png", [fullpath], fullpath.stem + ".png", texconv_path, TEXCONV_ARGUMENTS, flags)
+    if cached_path is not None:
+        return cached_path
+    return fullpath.with_suffix(".png")
+
+def is_converted(output: Path, sources: List[Path]) -> bool:
+    """True if output is a valid conversion of the sources.
+    Outside of the conversion cache, the output must not be older than any of the sources."""
+    if ConversionCache.is_managed(output):
+        return ConversionCache.contains(output)
+    if not output.exists():
+        return False
+    output_last_modified = output.stat().st_mtime
+    return all(not source.exists() or source.stat().st_mtime <= output_last_modified for source in sources)
+
+def convert_to_glb(fullpath: Path, rdm4_path: Optional[Path] = None, output: Optional[Path] = None):
+    if rdm4_path is None:
+        rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
+    if output is None:
+        output = fullpath.with_suffix(".glb")
+    if rdm4_path.exists() and fullpath.exists():
+        output.parent.mkdir(parents = True, exist_ok = True)
+        subprocess.call(f"\"{rdm4_path}\" --input \"{fullpath}\" {RDM4_ARGUMENTS} --outdst \"{output.parent}\"", shell = True)
+        ConversionCache.register(output)
+
+def convert_animation_to_glb(model_fullpath: Path, animation_fullpath: Path, rdm4_path: Optional[Path] = None, output: Optional[Path] = None) -> bool:
+    """Converts the animation into <model>_a_<animation>.glb (next to the model or in the conversion cache).
+    rdm4 always names its output out.glb, so every conversion gets its own output folder.
+    Otherwise, two animations from the same folder could not be converted at the same time.
+
+    Returns:
+        bool: True if the combined .glb has been written.
+    """
+    #Usage: ./rdm4-bin.exe -i rdm/container_ship_tycoons_lod1.rdm -sam anim/container_ship_tycoons_idle01.rdm
+    if rdm4_path is None:
+        rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
+    if not rdm4_path.exists() or not animation_fullpath.exists() or not model_fullpath.exists():
+        return False
+    if output is None:
+        output = Path(model_fullpath.parent, model_fullpath.stem + "_a_" + animation_fullpath.stem + ".glb")
+    with tempfile.TemporaryDirectory(prefix = "annocfg_") as out_dir:
+        subprocess.call(f"\"{rdm4_path}\" -i \"{model_fullpath}\" -sam \"{animation_fullpath}\" --force --outdst \"{out_dir}\"", shell = True)
+        out_fullpath = Path(out_dir, "out.glb")
+        if not out_fullpath.exists():
+            return False
+        output.parent.mkdir(parents = True, exist_ok = True)
+        shutil.move(str(out_fullpath), str(output))
+    ConversionCache.register(output)
+    return True
+
+def prp_xml_is_current(prp_fullpath: Path) -> bool:
+    xml_path = prp_fullpath.with_suffix(".xml")
+    return xml_path.exists() and xml_path.stat().st_mtime >= prp_fullpath.stat().st_mtime
+
+def convert_prp_to_xml(prp_fullpath: Path, filedb_reader_path: Optional[Path] = None):
+    if filedb_reader_path is None:
+        filedb_reader_path = IO_AnnocfgPreferences.get_path_to_filedb_reader()
+    subprocess.call(f"\"{filedb_reader_path}\" fctohex -d -y -f \"{prp_fullpath}\"")
+
+def convert_to_png(fullpath: Path, texconv_path: Optional[Path] = None, output: Optional[Path] = None) -> bool:
+    """Converts the .dds file to .png. Returns True if successful, False otherwise."""
+    if texconv_path is None:
+        texconv_path = IO_AnnocfgPreferences.get_path_to_texconv()
+    if output is None:
+        output = fullpath.with_suffix(".png")
+    if not texconv_path.exists():
+        return False
+    if not fullpath.exists():
+        return False
+    try:
+        output.parent.mkdir(parents = True, exist_ok = True)
+        subprocess.call(f"\"{texconv_path}\" {TEXCONV_ARGUMENTS} -o \"{output.parent}\" \"{fullpath}\"")
+    except:
+        return False
+    ConversionCache.register(output)
+    return output.exists()
+
+def run_conversions(jobs: List[Callable[[], object]], max_workers: Optional[int] = None):
+    """Runs the conversion jobs, at most max_workers (default: number of cores) at the same time.
+    The jobs only wait for the external converter processes, so threads are enough to keep every core busy.
+    Jobs must not touch bpy, resolve all paths and preferences before creating them.
+    """
+    if not jobs:
+        return
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(jobs)))
+    if max_workers == 1:
+        for job in jobs:
+            job()
+        ConversionCache.flush()
+        return
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        futures = [executor.submit(job) for job in jobs]
+        for future in futures:
+            exception = future.exception()
+            if exception is not None:
+                print(f"Warning: Conversion failed: {exception}")
+    ConversionCache.flush()
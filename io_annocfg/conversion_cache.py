@@ -0,0 +1,159 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from .prefs import IO_AnnocfgPreferences
+
+
+class ConversionCache():
+    """Content addressed storage for converted files (.glb, .png) outside of the rda folder.
+
+    The key of an entry is a hash over the source files (path, size, modification time and optionally their content),
+    the converter executable and its arguments. A modified source file therefore gets a new key and is converted again.
+    The manifest stores the sources and flags of every entry; only entries listed in it are used,
+    so outputs of interrupted conversions are never served.
+    Disabled (and the outputs are stored next to the source files) while no cache path is set.
+    """
+    FORMAT_VERSION = 1
+    MANIFEST_NAME = "manifest.json"
+
+    lock = threading.Lock()
+    manifest: Dict[str, dict] = {}
+    manifest_root: Optional[Path] = None
+    dirty = False
+    pending: Dict[Path, Tuple[str, dict]] = {}
+    source_by_output: Optional[Dict[Path, Path]] = None
+    key_by_sources: Dict[Tuple[str, ...], str] = {}
+    tool_ids: Dict[Path, list] = {}
+    content_hashes: Dict[Tuple[str, int, int], str] = {}
+
+    @classmethod
+    def root(cls) -> Optional[Path]:
+        root = IO_AnnocfgPreferences.get_conversion_cache_path()
+        if root is not None and root != cls.manifest_root:
+            cls.load_manifest(root)
+        return root
+
+    @classmethod
+    def load_manifest(cls, root: Path):
+        with cls.lock:
+            cls.manifest = {}
+            cls.key_by_sources = {}
+            cls.manifest_root = root
+            cls.dirty = False
+            cls.source_by_output = None
+            manifest_path = Path(root, cls.MANIFEST_NAME)
+            if not manifest_path.exists():
+                return
+            try:
+                with open(manifest_path, "r") as f:
+                    content = json.load(f)
+                if content.get("version") == cls.FORMAT_VERSION:
+                    cls.manifest = content.get("entries", {})
+                    cls.key_by_sources = {(record["kind"], *record["sources"]): key for key, record in cls.manifest.items()}
+            except (OSError, ValueError) as ex:
+                print(f"Warning: Could not read conversion cache manifest {manifest_path}: {ex}")
+
+    @classmethod
+    def flush(cls):
+        with cls.lock:
+            if not cls.dirty or cls.manifest_root is None:
+                return
+            cls.manifest_root.mkdir(parents = True, exist_ok = True)
+            manifest_path = Path(cls.manifest_root, cls.MANIFEST_NAME)
+            temp_path = manifest_path.with_suffix(".tmp")
+            with open(temp_path, "w") as f:
+                json.dump({"version": cls.FORMAT_VERSION, "entries": cls.manifest}, f)
+            os.replace(temp_path, manifest_path)
+            cls.dirty = False
+
+    @classmethod
+    def tool_id(cls, tool_path: Path) -> list:
+        # The converters have no version flag, so a new executable is detected by its size and modification time.
+        if tool_path not in cls.tool_ids:
+            stat = tool_path.stat() if tool_path.exists() else None
+            cls.tool_ids[tool_path] = [tool_path.name, stat.st_size if stat else 0, stat.st_mtime_ns if stat else 0]
+        return cls.tool_ids[tool_path]
+
+    @classmethod
+    def source_fingerprint(cls, source: Path, use_content_hash: bool) -> list:
+        stat = source.stat()
+        fingerprint = [source.as_posix(), stat.st_size, stat.st_mtime_ns]
+        if use_content_hash:
+            hash_key = (source.as_posix(), stat.st_size, stat.st_mtime_ns)
+            if hash_key not in cls.content_hashes:
+                with open(source, "rb") as f:
+                    cls.content_hashes[hash_key] = hashlib.sha1(f.read()).hexdigest()
+            fingerprint.append(cls.content_hashes[hash_key])
+        return fingerprint
+
+    @classmethod
+    def output_path(cls, kind: str, sources: List[Path], filename: str, tool_path: Path, arguments: str, flags: Dict[str, object]) -> Optional[Path]:
+        """Returns the path the converted file has in the cache (existing or not), None if the cache is disabled.
+        Has to be called from the main thread, the conversion itself can run anywhere.
+        """
+        root = cls.root()
+        if root is None or not all(source.exists() for source in sources):
+            return None
+        use_content_hash = IO_AnnocfgPreferences.conversion_cache_hash_enabled()
+        fingerprint = [cls.FORMAT_VERSION, kind, cls.tool_id(tool_path), arguments]
+        fingerprint += [cls.source_fingerprint(source, use_content_hash) for source in sources]
+        key = hashlib.sha1(json.dumps(fingerprint).encode("utf-8")).hexdigest()
+        output = Path(root, key[:2], key, filename)
+        if key not in cls.manifest:
+            record = {
+                "kind": kind,
+                "sources": [source.as_posix() for source in sources],
+                "fingerprint": fingerprint,
+                "converter": cls.tool_id(tool_path),
+                "arguments": arguments,
+                "flags": flags,
+                "output": output.relative_to(root).as_posix(),
+            }
+            with cls.lock:
+                cls.pending[output] = (key, record)
+        return output
+
+    @classmethod
+    def is_managed(cls, output: Path) -> bool:
+        return cls.manifest_root is not None and output.is_relative_to(cls.manifest_root)
+
+    @classmethod
+    def contains(cls, output: Path) -> bool:
+        key = output.parent.name
+        return key in cls.manifest and output.exists()
+
+    @classmethod
+    def register(cls, output: Path):
+        """Adds a finished conversion to the manifest and removes outdated conversions of the same sources. Thread safe."""
+        with cls.lock:
+            key, record = cls.pending.pop(output, (None, None))
+            if key is None or not output.exists():
+                return
+            sources_key = (record["kind"], *record["sources"])
+            old_key = cls.key_by_sources.get(sources_key)
+            if old_key is not None and old_key != key:
+                cls.manifest.pop(old_key, None)
+                shutil.rmtree(Path(cls.manifest_root, old_key[:2], old_key), ignore_errors = True)
+            cls.key_by_sources[sources_key] = key
+            record["created"] = time.time()
+            cls.manifest[key] = record
+            cls.dirty = True
+            cls.source_by_output = None
+
+    @classmethod
+    def source_path(cls, output: Path) -> Optional[Path]:
+        """Returns the (first) source file of a cached output, f.e. to export the data path of a cached texture."""
+        output = Path(output)
+        cls.root()
+        if not cls.is_managed(output):
+            return None
+        with cls.lock:
+            if cls.source_by_output is None:
+                cls.source_by_output = {Path(cls.manifest_root, record["output"]): Path(record["sources"][0]) for record in cls.manifest.values()}
+            return cls.source_by_output.get(output)
@@ -0,0 +1,163 @@
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Dict, Set, Tuple, Union
+
+from .prefs import IO_AnnocfgPreferences
+from .utils import data_path_to_absolute_path, get_text
+from .conversion import convert_to_glb, convert_animation_to_glb, convert_to_png, convert_prp_to_xml, prp_xml_is_current, run_conversions, \
+    glb_path, animated_glb_path, png_path, is_converted
+from .parse_cache import ParsedFileCache, load_prp
+from .cfg_cache import CfgCache
+from .texture_registry import TextureRegistry
+from .path_index import DirectoryIndex
+from . import anno_objects
+
+
+class ConversionPlan():
+    """Collects every file an import has to convert before any blender object is created.
+    Walks the .cfg (and all of its subfiles and .prp files) and converts everything that is missing in parallel,
+    so that the object creation afterwards only has to load existing .glb and .png files.
+    """
+    def __init__(self, include_animations: bool = False):
+        self.include_animations = include_animations
+        self.cfg_files: Set[Path] = set()
+        self.prp_files: Set[Path] = set()
+        # source file(s) -> output file
+        self.models: Dict[Path, Path] = {}
+        self.animations: Dict[Tuple[Path, Path], Path] = {}
+        self.textures: Dict[Path, Path] = {}
+        self.texture_data_paths: Set[Path] = set()
+
+    def add_cfg_file(self, fullpath: Path):
+        if fullpath in self.cfg_files or not fullpath.exists():
+            return
+        self.cfg_files.add(fullpath)
+        try:
+            root = ParsedFileCache.parse(fullpath)
+        except ET.ParseError as ex:
+            print(f"Warning: Could not plan conversions for {fullpath}: {ex}")
+            return
+        self.add_cfg_node(root)
+
+    def add_subfile(self, data_path: str):
+        fullpath = data_path_to_absolute_path(data_path)
+        if not fullpath.exists() or self.is_in_cfg_cache(data_path, fullpath):
+            return
+        self.add_cfg_file(fullpath)
+
+    def is_in_cfg_cache(self, data_path: str, fullpath: Path) -> bool:
+        # Subfiles loaded from the cfg cache do not need any conversions.
+        if not IO_AnnocfgPreferences.cfg_cache_loading_enabled():
+            return False
+        cache_file = CfgCache.blend_path(data_path)
+        return cache_file.exists() and cache_file.stat().st_mtime >= fullpath.stat().st_mtime
+
+    def add_cfg_node(self, node: ET.Element):
+        for material_owner_node in node.findall("Models/Config") + node.findall("Clothes/Config") + node.findall("Decals/Config"):
+            for material_node in material_owner_node.findall("Materials/Config"):
+                shader = anno_objects.AnnoObject.model_shaders_by_id.get(get_text(material_node, "ShaderID"), anno_objects.AnnoObject.default_shader)
+                self.add_material(material_node, shader)
+        for model_node in node.findall("Models/Config") + node.findall("Clothes/Config"):
+            model_data_path = get_text(model_node, "FileName")
+            self.add_model(model_data_path)
+            if self.include_animations:
+                for anim_node in model_node.findall("Animations/Config"):
+                    self.add_animation(model_data_path, get_text(anim_node, "FileName"))
+        for file_node in node.findall("Files/Config"):
+            self.add_subfile(get_text(file_node, "FileName"))
+        for prop_node in node.findall("PropContainers/Config/Props/Config"):
+            self.add_prop(get_text(prop_node, "FileName"))
+
+    def add_model(self, data_path: Union[str, Path]):
+        if not data_path:
+            return
+        fullpath = data_path_to_absolute_path(data_path)
+        if fullpath in self.models or not fullpath.exists():
+            return
+        output = glb_path(fullpath)
+        if not is_converted(output, [fullpath]):
+            self.models[fullpath] = output
+
+    def add_animation(self, model_data_path: str, animation_data_path: str):
+        if not model_data_path or not animation_data_path:
+            return
+        model_fullpath = data_path_to_absolute_path(model_data_path)
+        animation_fullpath = data_path_to_absolute_path(animation_data_path)
+        if not model_fullpath.exists() or not animation_fullpath.exists():
+            return
+        output = animated_glb_path(model_fullpath, animation_fullpath)
+        if not is_converted(output, [model_fullpath, animation_fullpath]):
+            self.animations[(model_fullpath, animation_fullpath)] = output
+
+    def add_material(self, material_node: ET.Element, shader):
+        for texture_data_path in shader.texture_data_paths(material_node):
+            self.add_texture(texture_data_path)
+
+    def add_texture(self, dds_data_path: Path):
+        # Many materials share the same textures, only resolve and convert each of them once.
+        if dds_data_path in self.texture_data_paths:
+            return
+        self.texture_data_paths.add(dds_data_path)
+        fullpath, output = TextureRegistry.resolve(dds_data_path)
+        if fullpath in self.textures or TextureRegistry.is_missing(fullpath):
+            return
+        if not fullpath.exists():
+            TextureRegistry.add_missing(fullpath, "file not found")
+            return
+        if not is_converted(output, [fullpath]):
+            self.textures[fullpath] = output
+
+    def add_prop(self, data_path: str):
+        if not data_path:
+            return
+        fullpath = data_path_to_absolute_path(data_path)
+        if fullpath.suffix == ".prp" and fullpath.exists():
+            self.prp_files.add(fullpath)
+
+    def add_island_props(self, file_names_node: ET.Element, skip_vegetation: bool = False):
+        for file_node in file_names_node:
+            data_path = file_node.text
+            if not data_path or (skip_vegetation and "vegetation" in data_path):
+                continue
+            self.add_prop(data_path)
+
+    def add_prop_meshes(self):
+        for prp_file in self.prp_files:
+            try:
+                prop_node = ParsedFileCache.parse(prp_file, load_prp).find("Prop")
+            except (OSError, ET.ParseError):
+                continue
+            if prop_node is None:
+                continue
+            self.add_model(get_text(prop_node, "MeshFileName"))
+            shader = anno_objects.Prop.shader_classes.get(get_text(prop_node, "Type"), anno_objects.Prop.default_shader)
+            for material_node in prop_node.findall("Materials/*"):
+                self.add_material(material_node, shader)
+
+    def execute(self):
+        """Converts all collected files. The .prp files go first, their meshes are only known afterwards."""
+        filedb_reader_path = IO_AnnocfgPreferences.get_path_to_filedb_reader()
+        rdm4_path = IO_AnnocfgPreferences.get_path_to_rdm4()
+        texconv_path = IO_AnnocfgPreferences.get_path_to_texconv()
+
+        outdated_prp_files = [prp_file for prp_file in self.prp_files if not prp_xml_is_current(prp_file) and not ParsedFileCache.contains(prp_file)]
+        if outdated_prp_files and filedb_reader_path.exists():
+            print(f"Converting {len(outdated_prp_files)} .prp files")
+            run_conversions([lambda p = prp_file: convert_prp_to_xml(p, filedb_reader_path) for prp_file in outdated_prp_files])
+        self.add_prop_meshes()
+
+        jobs = []
+        if rdm4_path.exists():
+            jobs += [lambda p = model, o = output: convert_to_glb(p, rdm4_path, o) for model, output in self.models.items()]
+            jobs += [lambda m = model, a = anim, o = output: convert_animation_to_glb(m, a, rdm4_path, o) for (model, anim), output in self.animations.items()]
+        if texconv_path.exists():
+            jobs += [lambda p = texture, o = output: convert_to_png(p, texconv_path, o) for texture, output in self.textures.items()]
+        if jobs:
+            print(f"Converting {len(self.models)} models, {len(self.animations)} animations and {len(self.textures)} textures")
+        run_conversions(jobs)
+        DirectoryIndex.flush()
+        if texconv_path.exists():
+            # Not tried again when the materials are created.
+            for texture, output in self.textures.items():
+                if not output.exists():
+                    TextureRegistry.add_missing(texture, "conversion failed")
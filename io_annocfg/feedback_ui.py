@@ -3,8 +3,12 @@ from bpy.props import StringProperty, IntProperty, CollectionProperty, PointerPr
 from bpy.types import PropertyGroup, UIList, Operator, Panel
 from . import feedback_enums
 from .utils import data_path_to_absolute_path, to_data_path, get_text
+from .prefs import with_settings_snapshot
 import xml.etree.ElementTree as ET
 from . import anno_objects
+from . import conversion_plan
+from .parse_cache import ParsedFileCache
+from .scene_index import SceneIndex
 import random
 
 
@@ -350,6 +354,7 @@ class FEEDBACK_OT_LoadFeedbackUnit(Operator):
     bl_idname = "feedback_unit.load"
     bl_label = "Loads one of the GuidVariation cfgs. Can be used to visualize the feedback. No effect in game."
 
+    @with_settings_snapshot
     def execute(self, context):
         obj = context.active_object
         guid_list = obj.feedback_guid_list
@@ -386,11 +391,16 @@ class FEEDBACK_OT_LoadFeedbackUnit(Operator):
         if not absolute_path.exists():
             self.report({'INFO'}, f"Missing file: {absolute_path}")
             return
-        tree = ET.parse(absolute_path)
-        root = tree.getroot()
+        root = ParsedFileCache.parse(absolute_path)
         if root is None:
             return
         
+        # The animations are loaded right afterwards, convert them together with the models.
+        plan = conversion_plan.ConversionPlan(include_animations = True)
+        plan.cfg_files.add(absolute_path)
+        plan.add_cfg_node(root)
+        plan.execute()
+        
         file_obj = anno_objects.MainFile.xml_to_blender(root)
         file_obj.name = name
         
@@ -507,12 +517,8 @@ def available_animations(unit_obj):
     if unit_obj is None:
         return ["UNKNOWN (Load Feedback Unit First)"]
     sequences = []
-    for anim_sequences in unit_obj.children:
-        if not anno_objects.get_anno_object_class(anim_sequences) == anno_objects.AnimationSequences:
-            continue
-        for subfile_seq in anim_sequences.children:
-            if not anno_objects.get_anno_object_class(subfile_seq) == anno_objects.AnimationSequence:
-                continue
+    for anim_sequences in SceneIndex.children_of_class(unit_obj, anno_objects.AnimationSequences):
+        for subfile_seq in SceneIndex.children_of_class(anim_sequences, anno_objects.AnimationSequence):
             seq_node = subfile_seq.dynamic_properties.to_node(ET.Element("Config"))
             sequence_id = int(get_text(seq_node, "SequenceID"))
             sequence_id = feedback_enums.NAME_BY_SEQUENCE_ID.get(sequence_id, str(sequence_id))
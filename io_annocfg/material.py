@@ -11,8 +11,13 @@ import subprocess
 from collections import defaultdict
 from .prefs import IO_AnnocfgPreferences
 from .utils import *
+from .conversion import convert_to_png, png_path, is_converted
+from .conversion_cache import ConversionCache
+from .texture_registry import TextureRegistry
 
 from .shaders import default_shader as SHADER
+from .shaders.shader_library import ShaderLibrary
+from .shaders.shader_components import strip_texture_quality
 
 
 class Material:
@@ -119,10 +124,11 @@ class Material:
                 instance.texture_enabled[texture_name] = shader_node.anno_properties.enabled
                 continue
             filepath_full = os.path.realpath(bpy.path.abspath(shader_node.image.filepath, library=shader_node.image.library))
+            filepath_full = ConversionCache.source_path(filepath_full) or filepath_full
             texture_path = to_data_path(filepath_full)
             #Rename "data/.../some_diff_0.png" to "data/.../some_diff.psd"
             extension = shader_node.anno_properties.original_file_extension
-            texture_path = Path(texture_path.as_posix().replace(instance.texture_quality_suffix()+".", ".")).with_suffix(extension)
+            texture_path = strip_texture_quality(texture_path).with_suffix(extension)
             instance.textures[texture_name] = texture_path.as_posix()
             instance.texture_enabled[texture_name] = shader_node.anno_properties.enabled
         for color_name in cls.color_definitions:
@@ -169,24 +175,19 @@ class Material:
             ET.SubElement(node, prop).text = str(value)
         return node
     
-    def convert_to_png(self, fullpath: Path) -> bool:
+    def convert_to_png(self, fullpath: Path, output: Optional[Path] = None) -> bool:
         """Converts the .dds file to .png. Returns True if successful, False otherwise.
 
         Args:
             fullpath (str): .dds file
+            output (str): .png file, defaults to the .dds file with a .png extension
 
         Returns:
             bool: Successful
         """
-        if not IO_AnnocfgPreferences.get_path_to_texconv().exists():
-            return False
-        if not fullpath.exists():
-            return False
-        try:
-            subprocess.call(f"\"{IO_AnnocfgPreferences.get_path_to_texconv()}\" -ft PNG -sepalpha -y -o \"{fullpath.parent}\" \"{fullpath}\"")
-        except:
-            return False
-        return fullpath.with_suffix(".png").exists()
+        success = convert_to_png(fullpath, output = output)
+        ConversionCache.flush()
+        return success
     
     def get_texture(self, texture_path: Path):
         """Tries to find the texture texture_path with ending "_0.png" (quality setting can be changed) in the list of loaded textures.
@@ -202,21 +203,7 @@ class Material:
             return None
         texture_path = Path(texture_path)
         texture_path = Path(texture_path.parent, texture_path.stem + self.texture_quality_suffix()+".dds")
-        png_file = texture_path.with_suffix(".png")
-        fullpath = data_path_to_absolute_path(texture_path)
-        png_fullpath = data_path_to_absolute_path(png_file)
-        image = bpy.data.images.get(str(png_file.name), None)
-        if image is not None:
-            image_path_full = os.path.normpath(bpy.path.abspath(image.filepath, library=image.library))
-            if str(image_path_full) == str(png_fullpath):
-                return image
-        if not png_fullpath.exists():
-            success = self.convert_to_png(fullpath)
-            if not success:
-                print("Failed to convert texture", fullpath)
-                return None
-        image = bpy.data.images.load(str(png_fullpath))
-        return image
+        return TextureRegistry.get_image(texture_path)
 
     
 
@@ -228,9 +215,7 @@ class Material:
     
     def add_anno_shader(self, nodes):
         group = nodes.new(type='ShaderNodeGroup')
-        if not "AnnoDefaultShader" in bpy.data.node_groups:
-            SHADER.AnnoDefaultShader().create_anno_shader()            
-        group.node_tree = bpy.data.node_groups["AnnoDefaultShader"]
+        group.node_tree = ShaderLibrary.get_node_group(SHADER.AnnoDefaultShader())
         return group
         
     def as_blender_material(self):
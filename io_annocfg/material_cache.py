@@ -0,0 +1,198 @@
+import hashlib
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import bpy
+from bpy.app.handlers import persistent
+
+from .prefs import IO_AnnocfgPreferences
+
+
+class MaterialCache():
+    """Reuses blender materials for material nodes with the same content instead of building the node tree again.
+
+    The key is a hash of the shader, the texture quality and the normalized material node (tag paths and stripped texts, sorted),
+    so the same material imported from different props/models/cfgs (whitespace and tag order differ) becomes one blender material.
+    The key is stored on the material (HASH_PROPERTY), the name -> key index is rebuilt from bpy.data.materials after a file is loaded.
+    If a material library folder is set in the preferences, every created material is also written to <key>.blend in that folder
+    and later sessions append it from there.
+    """
+    HASH_PROPERTY = "anno_material_hash"
+    # Change when the shaders build different node trees, old library entries are then no longer used.
+    FORMAT_VERSION = "1"
+    DUPLICATE_SUFFIX = re.compile(r"^(.*)\.[0-9]{3}$")
+
+    material_name_by_hash: Dict[str, str] = {}
+    index_valid = False
+    hits = 0
+    library_hits = 0
+    misses = 0
+
+    @classmethod
+    def invalidate(cls):
+        cls.material_name_by_hash = {}
+        cls.index_valid = False
+
+    @classmethod
+    def ensure_index(cls):
+        if cls.index_valid:
+            return
+        cls.material_name_by_hash = {}
+        for material in bpy.data.materials:
+            key = material.get(cls.HASH_PROPERTY)
+            if key is not None:
+                cls.material_name_by_hash[key] = material.name
+        cls.index_valid = True
+
+    @classmethod
+    def normalized_lines(cls, node: ET.Element, path: str, lines: List[str]):
+        counts: Dict[str, int] = {}
+        for child in node:
+            index = counts.get(child.tag, 0)
+            counts[child.tag] = index + 1
+            child_path = f"{path}/{child.tag}[{index}]"
+            lines.append(f"{child_path}={(child.text or '').strip()}")
+            cls.normalized_lines(child, child_path, lines)
+
+    @classmethod
+    def key(cls, shader, material_node: ET.Element) -> str:
+        lines = []
+        cls.normalized_lines(material_node, "", lines)
+        lines.sort()
+        content = "\n".join([
+            cls.FORMAT_VERSION,
+            type(shader).__name__,
+            shader.shader_id,
+            IO_AnnocfgPreferences.get_texture_quality(),
+        ] + lines)
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[bpy.types.Material]:
+        cls.ensure_index()
+        name = cls.material_name_by_hash.get(key)
+        if name is None:
+            return None
+        material = bpy.data.materials.get(name)
+        if material is None or material.get(cls.HASH_PROPERTY) != key:
+            # Renamed or deleted since it was indexed.
+            cls.invalidate()
+            cls.ensure_index()
+            name = cls.material_name_by_hash.get(key)
+            material = bpy.data.materials.get(name) if name is not None else None
+        return material
+
+    @classmethod
+    def add(cls, key: str, material: bpy.types.Material):
+        material[cls.HASH_PROPERTY] = key
+        cls.ensure_index()
+        cls.material_name_by_hash[key] = material.name
+
+    @classmethod
+    def get_or_create(cls, shader, material_node: ET.Element, create: Callable[[ET.Element], bpy.types.Material]) -> bpy.types.Material:
+        key = cls.key(shader, material_node)
+        material = cls.get(key)
+        if material is not None:
+            cls.hits += 1
+            return material
+        material = cls.load_from_library(key)
+        if material is not None:
+            cls.library_hits += 1
+            cls.add(key, material)
+            return material
+        cls.misses += 1
+        material = create(material_node)
+        cls.add(key, material)
+        cls.write_to_library(key, material)
+        return material
+
+    @classmethod
+    def library_file(cls, key: str) -> Optional[Path]:
+        library_path = IO_AnnocfgPreferences.get_material_library_path()
+        if library_path is None:
+            return None
+        return Path(library_path, key + ".blend")
+
+    @classmethod
+    def load_from_library(cls, key: str) -> Optional[bpy.types.Material]:
+        path = cls.library_file(key)
+        if path is None or not path.exists():
+            return None
+        node_groups_before = set(bpy.data.node_groups)
+        images_before = set(bpy.data.images)
+        try:
+            with bpy.data.libraries.load(str(path), link = False) as (data_from, data_to):
+                data_to.materials = list(data_from.materials)
+        except Exception as ex:
+            print(f"Warning: Could not load material library file {path}: {ex}")
+            return None
+        materials = [material for material in data_to.materials if material is not None]
+        new_node_groups = [group for group in bpy.data.node_groups if group not in node_groups_before]
+        new_images = [image for image in bpy.data.images if image not in images_before]
+        if len(materials) != 1 or any(not cls.image_exists(image) for image in new_images):
+            # Textures of the library entry are gone (f.e. a different conversion cache), build the material again.
+            print(f"Warning: Outdated material library file {path}")
+            for material in materials:
+                bpy.data.materials.remove(material)
+            for group in new_node_groups:
+                bpy.data.node_groups.remove(group)
+            for image in new_images:
+                bpy.data.images.remove(image)
+            return None
+        cls.merge_duplicates(new_node_groups, bpy.data.node_groups)
+        cls.merge_duplicates(new_images, bpy.data.images)
+        material = materials[0]
+        material.use_fake_user = False
+        return material
+
+    @classmethod
+    def image_exists(cls, image) -> bool:
+        if image.packed_file is not None or image.source != 'FILE':
+            return True
+        return Path(bpy.path.abspath(image.filepath)).exists()
+
+    @classmethod
+    def merge_duplicates(cls, new_datablocks, collection):
+        """Appending creates "AnnoDefaultShader.001" etc. if the file already contains them, use the existing ones instead."""
+        for datablock in new_datablocks:
+            match = cls.DUPLICATE_SUFFIX.match(datablock.name)
+            if match is None:
+                continue
+            existing = collection.get(match.group(1))
+            if existing is None or existing in new_datablocks:
+                continue
+            datablock.user_remap(existing)
+            collection.remove(datablock)
+
+    @classmethod
+    def write_to_library(cls, key: str, material: bpy.types.Material):
+        path = cls.library_file(key)
+        if path is None or path.exists():
+            return
+        try:
+            path.parent.mkdir(parents = True, exist_ok = True)
+            bpy.data.libraries.write(str(path), {material}, fake_user = True, path_remap = 'ABSOLUTE')
+        except Exception as ex:
+            print(f"Warning: Could not write material library file {path}: {ex}")
+
+    @classmethod
+    def statistics(cls) -> str:
+        total = cls.hits + cls.library_hits + cls.misses
+        hit_rate = (cls.hits + cls.library_hits) / total * 100.0 if total else 0.0
+        return f"Material cache: {cls.hits} reused, {cls.library_hits} from library, {cls.misses} created ({hit_rate:.0f}% hit rate)"
+
+
+@persistent
+def material_cache_invalidate(*args):
+    MaterialCache.invalidate()
+
+
+def register():
+    bpy.app.handlers.load_post.append(material_cache_invalidate)
+
+def unregister():
+    if material_cache_invalidate in bpy.app.handlers.load_post:
+        bpy.app.handlers.load_post.remove(material_cache_invalidate)
+    MaterialCache.invalidate()
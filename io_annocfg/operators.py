@@ -3,7 +3,7 @@ import bpy
 
 from bpy_extras.io_utils import ImportHelper, ExportHelper
 from bpy_extras.object_utils import AddObjectHelper, object_data_add
-from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty,CollectionProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty, FloatProperty, CollectionProperty
 from bpy.types import Operator, AddonPreferences
 from bpy.types import Object as BlenderObject
 import xml.etree.ElementTree as ET
@@ -18,7 +18,7 @@ from typing import Tuple, List, NewType, Any, Union, Dict, Optional, TypeVar, Ty
 
 from . import feedback_enums
 from .simple_anno_feedback_encoding import SimpleAnnoFeedbackEncoding
-from .prefs import IO_AnnocfgPreferences
+from .prefs import IO_AnnocfgPreferences, with_settings_snapshot
 from .anno_objects import get_anno_object_class, anno_object_classes, Transform, AnnoObject, MainFile, Model, SimpleAnnoFeedbackEncodingObject, \
     SubFile, Decal, Propcontainer, Prop, Particle, IfoCube, IfoPlane, Sequence, DummyGroup, ArbitraryXMLAnnoObject, Material, \
     Dummy, Cf7DummyGroup, Cf7Dummy, FeedbackConfig, Light, IfoFile, Cf7File, IslandFile, PropGridInstance, IslandGamedataFile, AssetsXML,\
@@ -26,6 +26,15 @@ from .anno_objects import get_anno_object_class, anno_object_classes, Transform,
 
 
 from .utils import data_path_to_absolute_path, to_data_path
+from .conversion_plan import ConversionPlan
+from .parse_cache import ParsedFileCache, load_cf7
+from .material_cache import MaterialCache
+from .texture_registry import TextureRegistry
+from .texture_lod import TextureLOD
+from .path_index import DirectoryIndex
+from .shaders.shader_library import ShaderLibrary
+from .scene_index import SceneIndex
+from .xml_writer import StreamingXMLWriter
 
 class ExportAnnoFc(Operator, ExportHelper):
     """Parses Anno (1800) .cfg files and automatically imports and positions all models, props, particles and decals in the scene. Can also import .prp files into your scene, but you must select a parent object"""
@@ -41,6 +50,7 @@ class ExportAnnoFc(Operator, ExportHelper):
             return False
         return get_anno_object_class(context.active_object) == Cf7File
     
+    @with_settings_snapshot
     def execute(self, context):
         if not context.active_object:
             self.report({'ERROR'}, f"CF7_FILE Object needs to be selected. CANCELLED")
@@ -73,13 +83,7 @@ class ExportAnnoFc(Operator, ExportHelper):
         return
     
     def initialize_child_map(self):
-        self.children_by_object = {}
-        for obj in bpy.data.objects:
-            if obj.parent is not None:
-                if obj.parent.name in self.children_by_object:
-                    self.children_by_object[obj.parent.name].append(obj)
-                else:
-                    self.children_by_object[obj.parent.name] = [obj]
+        self.children_by_object = SceneIndex.child_map()
 
 class ExportAnnoCfg(ExportAnnoFc, ExportHelper):
     """Exports the selected MAIN_FILE into a .cfg Anno file. Check the export ifo box to also create the .ifo/.cf7 file."""
@@ -136,6 +140,7 @@ class ExportAnnoCfg(ExportAnnoFc, ExportHelper):
         return get_anno_object_class(context.active_object) == MainFile
     
 
+    @with_settings_snapshot
     def execute(self, context):
         if not context.active_object:
             self.report({'ERROR'}, f"MAIN_FILE Object needs to be selected. CANCELLED")
@@ -193,9 +198,7 @@ class ExportAnnoCfg(ExportAnnoFc, ExportHelper):
         if self.delete_material_lod_info:
             self.visit_and_delete_material_lod(self.root)
         
-        tree = ET.ElementTree(self.root)
-        ET.indent(tree, space="\t", level=0)
-        tree.write(self.filepath)
+        StreamingXMLWriter.write(self.root, self.filepath)
         
         self.report({'INFO'}, 'cfg export completed')
 
@@ -207,10 +210,7 @@ class ExportAnnoCfg(ExportAnnoFc, ExportHelper):
     def export_ifo(self, ifo_obj, ifo_filepath):
         print("EXPORT IFO", ifo_obj.name)
         root = IfoFile.blender_to_xml(ifo_obj, None, self.children_by_object)
-        ifotree = ET.ElementTree(element = root)
-        
-        ET.indent(ifotree, space="\t", level=0)
-        ifotree.write(ifo_filepath)
+        StreamingXMLWriter.write(root, ifo_filepath)
 
     def export_cf7_file(self, cf7_object, cf7_filepath): 
         cf7root = Cf7File.blender_to_xml(cf7_object, None, self.children_by_object)
@@ -282,7 +282,9 @@ class ImportAnnoCfg(Operator, ImportHelper):
         options={'HIDDEN', 'SKIP_SAVE'},
     )
 
+    @with_settings_snapshot
     def execute(self, context):
+        TextureRegistry.reset_statistics()
         parent = context.active_object
         dirname = os.path.dirname(self.filepath)
         for f in self.files:
@@ -310,6 +312,11 @@ class ImportAnnoCfg(Operator, ImportHelper):
                     self.import_cf7_file(self.path.with_suffix(".cf7"), file_obj)
 
             self.report({'INFO'}, "Import of {self.filepath} completed!")
+        print(ParsedFileCache.statistics())
+        print(SubFile.statistics())
+        print(MaterialCache.statistics())
+        print(TextureRegistry.report())
+        print(DirectoryIndex.statistics())
         self.report({'INFO'}, "Imported all Files.")
         return {'FINISHED'}
     
@@ -332,6 +339,9 @@ class ImportAnnoCfg(Operator, ImportHelper):
                 </Transformer>
             </Config>
         """)
+        plan = ConversionPlan()
+        plan.add_subfile(file_name)
+        plan.execute()
         blender_obj = SubFile.xml_to_blender(node, parent)
         return {'FINISHED'}
     
@@ -348,8 +358,7 @@ class ImportAnnoCfg(Operator, ImportHelper):
         if not fullpath.exists():
             self.report({'INFO'}, f"Missing file {fullpath}")
             return
-        tree = ET.parse(fullpath)
-        root = tree.getroot()
+        root = ParsedFileCache.parse(fullpath)
         
         ifo_obj = IfoFile.xml_to_blender(root, file_obj)
         ifo_obj.name = "IFOFILE"
@@ -365,11 +374,7 @@ class ImportAnnoCfg(Operator, ImportHelper):
         if not fullpath.exists():
             self.report({'INFO'}, f"Missing file: {fullpath}")
             return
-        root = None
-        with open(fullpath) as f:
-            xml = '<cf7_imaginary_root>' + f.read() + '</cf7_imaginary_root>'
-            root = ET.fromstring(xml)
-        tree = ET.ElementTree(root)
+        root = ParsedFileCache.parse(fullpath, load_cf7)
         cf7_object = Cf7File.xml_to_blender(root, file_obj)
         cf7_object.name = "FCFILE"
 
@@ -390,11 +395,15 @@ class ImportAnnoCfg(Operator, ImportHelper):
         if not absolute_path.exists():
             self.report({'INFO'}, f"Missing file: {absolute_path}")
             return
-        tree = ET.parse(absolute_path)
-        root = tree.getroot()
+        root = ParsedFileCache.parse(absolute_path)
         if root is None:
             return
         
+        plan = ConversionPlan()
+        plan.cfg_files.add(absolute_path)
+        plan.add_cfg_node(root)
+        plan.execute()
+        
         file_obj = MainFile.xml_to_blender(root)
         file_obj.name = name
         
@@ -424,7 +433,14 @@ class ImportAnnoIsland(Operator, ImportHelper):
         ],
         name = "Props"
     )
+    
+    point_instancing: BoolProperty( #type: ignore
+        name = "Props as Point Cloud",
+        description = "Imports all prop instances as a single point cloud object (instanced with geometry nodes) instead of one object per prop. Much faster for large islands",
+        default = False,
+    )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.path = Path(self.filepath)
         
@@ -456,11 +472,10 @@ class ImportAnnoIsland(Operator, ImportHelper):
         #     self.report({'INFO'}, "Import completed!")
         #     return {"FINISHED"}
         
-        tree = ET.parse(self.path)
-        root = tree.getroot()
-        
-        file_obj = IslandFile.xml_to_blender(root, self.prop_import)
+        TextureRegistry.reset_statistics()
+        file_obj = IslandFile.import_file(self.path, self.prop_import, self.point_instancing, ConversionPlan())
         file_obj.name = "ISLAND_" + self.path.name
+        print(TextureRegistry.report())
 
         self.report({'INFO'}, "Import completed!")
         return {'FINISHED'}
@@ -478,7 +493,25 @@ class ImportAnnoIslandGamedata(Operator, ImportHelper):
         options={'HIDDEN'},
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
+    
+    map_import: EnumProperty( #type: ignore
+        default="None",
+        items = [
+            ("None", "None", "Does not import the maps"),
+            ("Images", "Images", "Imports the water, river, environment and area id maps as images"),
+            ("Overlays", "Images and Overlays", "Also adds a plane textured with each map to the island"),
+        ],
+        name = "Maps"
+    )
+    
+    map_directory: StringProperty( #type: ignore
+        name = "Map Folder",
+        description = "Folder the map images are saved to. Leave empty to pack them into the .blend file",
+        subtype = 'DIR_PATH',
+        default = "",
+    )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.path = Path(self.filepath)
         
@@ -488,9 +521,14 @@ class ImportAnnoIslandGamedata(Operator, ImportHelper):
         tree = ET.parse(self.path)
         root = tree.getroot()
         
-        assetsXML = AssetsXML()
+        assetsXML = AssetsXML.get_instance()
         
-        file_obj = IslandGamedataFile.xml_to_blender(root, assetsXML)
+        TextureRegistry.reset_statistics()
+        file_obj = IslandGamedataFile.xml_to_blender(root, assetsXML, ConversionPlan())
+        if self.map_import != "None":
+            map_directory = Path(self.map_directory) if self.map_directory else None
+            IslandGamedataFile.create_maps(root, map_directory, file_obj, overlays = self.map_import == "Overlays")
+        print(TextureRegistry.report())
         
         self.report({'INFO'}, "Import completed!")
         return {"FINISHED"}
@@ -510,6 +548,7 @@ class ExportAnnoIsland(Operator, ExportHelper):
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.path = Path(self.filepath)
         self.obj = context.active_object
@@ -519,10 +558,9 @@ class ExportAnnoIsland(Operator, ExportHelper):
         
         root = get_anno_object_class(self.obj).blender_to_xml(self.obj)
         if root is None:
+            self.report({'ERROR'}, f"{self.obj.name} has no stored island xml (missing text datablock). Import the island again.")
             return{'CANCELLED'}
-        tree = ET.ElementTree(root)
-        ET.indent(tree, space="\t", level=0)
-        tree.write(self.filepath)
+        StreamingXMLWriter.write(root, self.filepath)
         self.report({'INFO'}, 'Island export completed.')
         
         return {'FINISHED'}
@@ -548,6 +586,7 @@ class ExportAnnoIslandGamedata(Operator, ExportHelper):
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.path = Path(self.filepath)
         self.obj = context.active_object
@@ -557,10 +596,9 @@ class ExportAnnoIslandGamedata(Operator, ExportHelper):
         
         root = get_anno_object_class(self.obj).blender_to_xml(self.obj)
         if root is None:
+            self.report({'ERROR'}, f"{self.obj.name} has no stored island xml (missing text datablock). Import the island again.")
             return{'CANCELLED'}
-        tree = ET.ElementTree(root)
-        ET.indent(tree, space="\t", level=0)
-        tree.write(self.filepath)
+        StreamingXMLWriter.write(root, self.filepath)
         self.report({'INFO'}, 'Island export completed.')
         
         return {'FINISHED'}
@@ -583,6 +621,7 @@ class ImportAnnoModelOperator(Operator, ImportHelper):
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.obj = context.active_object
         if not self.obj or not get_anno_object_class(self.obj) == MainFile:
@@ -638,6 +677,7 @@ class ImportAnnoPropOperator(Operator, ImportHelper):
         maxlen=255,  # Max internal buffer length, longer would be clamped.
     )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.obj = context.active_object
         if not self.obj or not get_anno_object_class(self.obj) == Propcontainer:
@@ -691,6 +731,7 @@ class ExportAnnoModelOperator(Operator, ExportHelper):
         name = "Vertex Format"
     )
 
+    @with_settings_snapshot
     def execute(self, context):
         self.obj = context.active_object
         if not self.obj or not get_anno_object_class(self.obj) in [Model, Cloth]:
@@ -883,6 +924,7 @@ class OBJECT_OT_add_anno_object(Operator, AddObjectHelper):
         col = layout.column()
         col.prop(self, "object_type")
     
+    @with_settings_snapshot
     def execute(self, context):
         self.parent = context.active_object
         
@@ -907,6 +949,7 @@ class ImportAllPropsOperator(Operator, ImportHelper):
     use_filter_folder = True
     
     
+    @with_settings_snapshot
     def execute(self, context):
         self.report({'INFO'}, f"Importing all props from {self.filepath}...")
         dirpath = Path(self.filepath)
@@ -918,11 +961,15 @@ class ImportAllPropsOperator(Operator, ImportHelper):
             self.report({'ERROR_INVALID_INPUT'}, f"Invalid folder. Needs to be inside your rda folder.")
             return {"CANCELLED"}
         
+        plan = ConversionPlan()
+        prop_files = [p for p in DirectoryIndex.find_files(dirpath, ".prp") if "decal_detail" not in p.name]
+        for p in prop_files:
+            plan.add_prop(to_data_path(p).as_posix())
+        plan.execute()
+        
         i = 0
         y_loc = 0
-        for p in dirpath.rglob('*.prp'):
-            if "decal_detail" in p.name:
-                continue
+        for p in prop_files:
             print(p)
             i+=1
             data_path = to_data_path(p).as_posix()
@@ -966,6 +1013,7 @@ class ImportAllCfgsOperator(Operator, ImportHelper):
         for child in obj.children:
             self.add_to_collection_recursively(child, collection)
     
+    @with_settings_snapshot
     def execute(self, context):
         self.report({'INFO'}, f"Importing all cfgs from {self.filepath}...")
         dirpath = Path(self.filepath)
@@ -978,8 +1026,14 @@ class ImportAllCfgsOperator(Operator, ImportHelper):
             self.report({'ERROR_INVALID_INPUT'}, f"Invalid folder. Needs to be inside your rda folder.")
             return {"CANCELLED"}
         
+        plan = ConversionPlan()
+        cfg_files = DirectoryIndex.find_files(dirpath, ".cfg")
+        for p in cfg_files:
+            plan.add_subfile(to_data_path(p).as_posix())
+        plan.execute()
+        
         i = 0
-        for p in dirpath.rglob('*.cfg'):
+        for p in cfg_files:
             print(i, p)
             i+=1
             data_path = to_data_path(p).as_posix()
@@ -1009,6 +1063,100 @@ class ImportAllCfgsOperator(Operator, ImportHelper):
         return {"FINISHED"}
 
 
+class BuildShaderLibraryOperator(Operator):
+    """Builds the node groups of all anno shaders and writes them to the shader library, from which they are appended instead of built in every file.
+    Needed after the shaders have been changed, outdated node groups are built again otherwise."""
+
+    bl_idname = "anno_shader_library.build"
+    bl_label = "Build Shader Library"
+
+    @with_settings_snapshot
+    def execute(self, context):
+        path = ShaderLibrary.build_library()
+        self.report({'INFO'}, f"Wrote shader library {path}")
+        return {"FINISHED"}
+
+
+class SetTextureQualityOperator(Operator):
+    """Switches the textures of the chosen materials to another quality (_0.dds, _1.dds, _2.dds), f.e. after importing a large scene with low texture quality.
+    Optionally switches all other textures to a low quality. Does not change the export."""
+
+    bl_idname = "anno_textures.set_quality"
+    bl_label = "Set Anno Texture Quality"
+    bl_options = {'REGISTER', 'UNDO'}
+
+    target: EnumProperty( #type: ignore
+        name = "Materials",
+        default = "SELECTED",
+        items = [
+            ("SELECTED", "Selected Objects", "Materials of the selected objects, their children and instanced subfiles"),
+            ("NEAR_VIEW", "Near View", "Materials of all objects within the distance to the viewport (or the scene camera)"),
+            ("LIST", "Material List", "The materials named in the list"),
+            ("ALL", "All", "All materials"),
+        ],
+    )
+    quality: EnumProperty( #type: ignore
+        name = "Quality",
+        default = "0",
+        items = [
+            ("0", "High", "High (_0.dds)"),
+            ("1", "Medium", "Medium (_1.dds)"),
+            ("2", "Low", "Low (_2.dds)"),
+        ],
+    )
+    distance: FloatProperty( #type: ignore
+        name = "Distance",
+        default = 50.0,
+        min = 0.0,
+    )
+    material_names: StringProperty( #type: ignore
+        name = "Material List",
+        description = "Comma separated material names",
+        default = "",
+    )
+    reduce_others: BoolProperty( #type: ignore
+        name = "Reduce Other Materials",
+        description = "Switches the textures of all other materials to the other quality",
+        default = False,
+    )
+    other_quality: EnumProperty( #type: ignore
+        name = "Other Quality",
+        default = "2",
+        items = [
+            ("0", "High", "High (_0.dds)"),
+            ("1", "Medium", "Medium (_1.dds)"),
+            ("2", "Low", "Low (_2.dds)"),
+        ],
+    )
+
+    def view_location(self, context):
+        if context.space_data is not None and context.space_data.type == 'VIEW_3D':
+            return context.space_data.region_3d.view_matrix.inverted().translation
+        if context.scene.camera is not None:
+            return context.scene.camera.matrix_world.translation
+        return None
+
+    @with_settings_snapshot
+    def execute(self, context):
+        if self.target == "SELECTED":
+            materials = TextureLOD.object_materials(context.selected_objects)
+        elif self.target == "NEAR_VIEW":
+            location = self.view_location(context)
+            if location is None:
+                self.report({'ERROR_INVALID_CONTEXT'}, "Needs a 3d viewport or a scene camera.")
+                return {'CANCELLED'}
+            materials = TextureLOD.object_materials(TextureLOD.objects_near(location, self.distance))
+        elif self.target == "LIST":
+            names = [name.strip() for name in self.material_names.split(",") if name.strip()]
+            materials = [bpy.data.materials[name] for name in names if name in bpy.data.materials]
+        else:
+            materials = list(bpy.data.materials)
+        low_quality = self.other_quality if self.reduce_others else None
+        changed_high, changed_low = TextureLOD.apply(materials, self.quality, low_quality)
+        self.report({'INFO'}, f"Changed {changed_high} textures of {len(materials)} materials, {changed_low} other textures.")
+        return {"FINISHED"}
+
+
 
 
 classes = (
@@ -1021,6 +1169,8 @@ classes = (
     OBJECT_OT_add_anno_object,
     ImportAllPropsOperator,
     ImportAllCfgsOperator,
+    BuildShaderLibraryOperator,
+    SetTextureQualityOperator,
     ImportAnnoIsland,
     ImportAnnoIslandGamedata,
     ExportAnnoIsland,
@@ -1062,6 +1212,9 @@ def menu_func_import_all_props(self, context):
 def menu_func_import_all_cfgs(self, context):
     self.layout.operator(ImportAllCfgsOperator.bl_idname, text="Import Anno Cfgs Assets")
 
+def menu_func_set_texture_quality(self, context):
+    self.layout.operator(SetTextureQualityOperator.bl_idname, text="Set Anno Texture Quality")
+
 def menu_func_import_island(self, context):
     self.layout.operator(ImportAnnoIsland.bl_idname, text="Anno Island (.xml)")
 def menu_func_import_island_gamedata(self, context):
@@ -1101,6 +1254,7 @@ def register():
         bpy.types.TOPBAR_MT_file_export.append(func)
 
     bpy.types.VIEW3D_MT_mesh_add.append(add_anno_object_button)
+    bpy.types.VIEW3D_MT_object.append(menu_func_set_texture_quality)
 
 def unregister():
     from bpy.utils import unregister_class
@@ -1113,4 +1267,5 @@ def unregister():
     for func in export_funcs:
         bpy.types.TOPBAR_MT_file_export.remove(func)
         
-    bpy.types.VIEW3D_MT_mesh_add.remove(add_anno_object_button)
\ No newline at end of file
+    bpy.types.VIEW3D_MT_mesh_add.remove(add_anno_object_button)
+    bpy.types.VIEW3D_MT_object.remove(menu_func_set_texture_quality)
\ No newline at end of file
@@ -0,0 +1,151 @@
+import hashlib
+import marshal
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Optional, Tuple
+
+from .prefs import IO_AnnocfgPreferences
+from .conversion import prp_xml_is_current, convert_prp_to_xml
+
+
+def element_to_ir(node: ET.Element) -> tuple:
+    """Converts the element into nested tuples: (tag, text) for leaves, (tag, text, children[, attrib]) otherwise.
+    The indentation text of elements with children is dropped, nothing reads it.
+    """
+    children = tuple(element_to_ir(child) for child in node)
+    text = node.text
+    if children and text is not None and not text.strip():
+        text = None
+    if node.attrib:
+        return (node.tag, text, children, dict(node.attrib))
+    if children:
+        return (node.tag, text, children)
+    return (node.tag, text)
+
+def ir_to_element(ir: tuple) -> ET.Element:
+    root = ET.Element(ir[0], ir[3] if len(ir) > 3 else {})
+    root.text = ir[1]
+    stack = [(root, ir[2] if len(ir) > 2 else ())]
+    sub_element = ET.SubElement
+    while stack:
+        parent, children = stack.pop()
+        for child in children:
+            node = sub_element(parent, child[0], child[3]) if len(child) > 3 else sub_element(parent, child[0])
+            node.text = child[1]
+            if len(child) > 2 and child[2]:
+                stack.append((node, child[2]))
+    return root
+
+
+def load_prp(prp_fullpath: Path) -> ET.Element:
+    """Parses the .prp file, converts it with the FileDBReader first if its .xml is missing or outdated."""
+    if not prp_xml_is_current(prp_fullpath):
+        convert_prp_to_xml(prp_fullpath)
+    return ET.parse(prp_fullpath.with_suffix(".xml")).getroot()
+
+def load_cf7(cf7_fullpath: Path) -> ET.Element:
+    # .cf7 files have multiple root elements.
+    with open(cf7_fullpath) as f:
+        xml = '<cf7_imaginary_root>' + f.read() + '</cf7_imaginary_root>'
+    return ET.fromstring(xml)
+
+
+class ParsedFileCache():
+    """Cache for parsed .cfg, .ifo, .cf7 and .prp files, keyed by path, size and modification time.
+
+    Files are stored as nested tuples (see element_to_ir), which are immutable and can be shared.
+    Every call to parse returns a new element tree, the xml_to_blender functions consume (and modify) it.
+    The most recently used files are kept in memory, all files are persisted (marshal) in the "parsed" folder
+    of the conversion cache, or of the cfg cache folder if no conversion cache is set.
+    """
+    FORMAT_VERSION = 1
+    max_entries = 128
+
+    entries: "OrderedDict[Tuple[str, int, int], tuple]" = OrderedDict()
+    hits = 0
+    disk_hits = 0
+    misses = 0
+
+    @classmethod
+    def parse(cls, fullpath: Path, loader: Optional[Callable[[Path], ET.Element]] = None) -> ET.Element:
+        key = cls.file_key(fullpath)
+        ir = cls.entries.get(key)
+        if ir is not None:
+            cls.hits += 1
+            cls.entries.move_to_end(key)
+            return ir_to_element(ir)
+
+        ir = cls.load_from_disk(key)
+        if ir is not None:
+            cls.disk_hits += 1
+        else:
+            cls.misses += 1
+            root = loader(fullpath) if loader is not None else ET.parse(fullpath).getroot()
+            ir = element_to_ir(root)
+            cls.write_to_disk(key, ir)
+        cls.entries[key] = ir
+        if len(cls.entries) > cls.max_entries:
+            cls.entries.popitem(last = False)
+        return ir_to_element(ir)
+
+    @classmethod
+    def file_key(cls, fullpath: Path) -> Tuple[str, int, int]:
+        fullpath = Path(fullpath)
+        stat = fullpath.stat()
+        return (fullpath.as_posix(), stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    def contains(cls, fullpath: Path) -> bool:
+        """True if the file is cached (in memory or on disk). Loads it into memory if it was only on disk."""
+        key = cls.file_key(fullpath)
+        if key in cls.entries:
+            return True
+        ir = cls.load_from_disk(key)
+        if ir is None:
+            return False
+        cls.entries[key] = ir
+        if len(cls.entries) > cls.max_entries:
+            cls.entries.popitem(last = False)
+        return True
+
+    @classmethod
+    def disk_path(cls, key: Tuple[str, int, int]) -> Optional[Path]:
+        cache_path = IO_AnnocfgPreferences.get_conversion_cache_path()
+        if cache_path is None:
+            cache_path = IO_AnnocfgPreferences.get_cfg_cache_path()
+        if cache_path is None or str(cache_path) in ("", "."):
+            return None
+        return Path(cache_path, "parsed", hashlib.sha1(key[0].encode("utf-8")).hexdigest() + ".bin")
+
+    @classmethod
+    def load_from_disk(cls, key: Tuple[str, int, int]) -> Optional[tuple]:
+        path = cls.disk_path(key)
+        if path is None or not path.exists():
+            return None
+        try:
+            with open(path, "rb") as f:
+                version, stored_key, ir = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        if version != cls.FORMAT_VERSION or tuple(stored_key) != key:
+            return None
+        return ir
+
+    @classmethod
+    def write_to_disk(cls, key: Tuple[str, int, int], ir: tuple):
+        path = cls.disk_path(key)
+        if path is None:
+            return
+        try:
+            path.parent.mkdir(parents = True, exist_ok = True)
+            with open(path, "wb") as f:
+                marshal.dump((cls.FORMAT_VERSION, key, ir), f)
+        except OSError as ex:
+            print(f"Warning: Could not write parsed file cache {path}: {ex}")
+
+    @classmethod
+    def statistics(cls) -> str:
+        total = cls.hits + cls.disk_hits + cls.misses
+        hit_rate = (cls.hits + cls.disk_hits) / total * 100.0 if total else 0.0
+        return f"Parsed file cache: {cls.hits} memory hits, {cls.disk_hits} disk hits, {cls.misses} misses ({hit_rate:.0f}% hit rate)"
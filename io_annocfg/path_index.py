@@ -0,0 +1,246 @@
+import marshal
+import os
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple, Union
+
+from .prefs import IO_AnnocfgPreferences
+
+# mtime_ns, file names, subdirectory names, normalized (os.path.normcase) file names, normalized subdirectory names
+Listing = Tuple[int, Tuple[str, ...], Tuple[str, ...], FrozenSet[str], FrozenSet[str]]
+
+
+class DirectoryIndex():
+    """Answers "does this file exist" from directory listings instead of one stat call per lookup.
+
+    Every directory is listed (os.scandir) the first time a path in it is looked up. Afterwards, a lookup is a set lookup.
+    A directory that is missing in the listing of its parent is known to be missing without touching the file system,
+    so paths in missing mod folders cost nothing after the first lookup.
+    The listings are persisted in the conversion cache folder (if set). A listing is only used again while the mtime of its
+    directory is unchanged, which is checked once per directory and operator (refresh at the start of every settings snapshot),
+    so added or removed files are noticed. Data paths resolved to the rda or mod folder are remembered until the next refresh.
+    The parents of the rda and mod folders are not listed, a missing rda or mod folder is noticed by its own stat call.
+    """
+    FORMAT_VERSION = 1
+    INDEX_NAME = "directory_index.marshal"
+
+    # normalized directory -> listing, None if the directory does not exist.
+    listings: Dict[str, Optional[Listing]] = {}
+    # Directories whose listing has been checked since the last refresh.
+    validated: Set[str] = set()
+    # Directories that could not be listed (f.e. permissions), Path.exists is used for them.
+    unreadable: Set[str] = set()
+    # (data path, rda folder, mod folder) -> absolute path
+    resolved_paths: Dict[Tuple[str, str, str], Path] = {}
+    # absolute path -> data path, for the paths resolved above
+    data_paths: Dict[Path, Path] = {}
+    # Normalized rda and mod folders (and find_files roots), their parents are not checked.
+    roots: Set[str] = set()
+
+    loaded = False
+    loaded_from: Optional[Path] = None
+    dirty = False
+    scans = 0
+    lookups = 0
+
+    @classmethod
+    def index_path(cls) -> Optional[Path]:
+        cache_path = IO_AnnocfgPreferences.get_conversion_cache_path()
+        if cache_path is None:
+            return None
+        return Path(cache_path, cls.INDEX_NAME)
+
+    @classmethod
+    def load(cls):
+        path = cls.index_path()
+        if cls.loaded and path == cls.loaded_from:
+            return
+        cls.loaded = True
+        cls.loaded_from = path
+        cls.listings = {}
+        cls.validated = set()
+        cls.unreadable = set()
+        if path is None or not path.exists():
+            return
+        try:
+            with open(path, "rb") as f:
+                version, listings = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError) as ex:
+            print(f"Warning: Could not read directory index {path}: {ex}")
+            return
+        if version != cls.FORMAT_VERSION:
+            return
+        cls.listings = {directory: cls.make_listing(mtime, files, directories) for directory, (mtime, files, directories) in listings.items()}
+
+    @classmethod
+    def flush(cls):
+        path = cls.loaded_from
+        if not cls.dirty or path is None:
+            return
+        listings = {directory: listing[:3] for directory, listing in cls.listings.items() if listing is not None}
+        temp_path = path.with_suffix(".tmp")
+        try:
+            path.parent.mkdir(parents = True, exist_ok = True)
+            with open(temp_path, "wb") as f:
+                marshal.dump((cls.FORMAT_VERSION, listings), f)
+            os.replace(temp_path, path)
+        except OSError as ex:
+            print(f"Warning: Could not write directory index {path}: {ex}")
+            return
+        cls.dirty = False
+
+    @classmethod
+    def refresh(cls):
+        """The next lookups check the mtime of every directory again. Called at the start of every operator."""
+        cls.load()
+        cls.validated = set()
+        cls.unreadable = set()
+        cls.resolved_paths = {}
+        cls.data_paths = {}
+
+    @classmethod
+    def make_listing(cls, mtime: int, files: Tuple[str, ...], directories: Tuple[str, ...]) -> Listing:
+        return (mtime, files, directories, frozenset(os.path.normcase(name) for name in files), frozenset(os.path.normcase(name) for name in directories))
+
+    @classmethod
+    def listing(cls, directory: str) -> Optional[Listing]:
+        """Listing of the (normalized) directory, None if it does not exist or cannot be read."""
+        if directory in cls.validated:
+            return cls.listings.get(directory)
+        cls.load()
+        cls.validated.add(directory)
+        parent, name = os.path.split(directory)
+        if parent != directory and name and directory not in cls.roots:
+            parent_listing = cls.listing(parent)
+            if parent_listing is None and parent not in cls.unreadable:
+                cls.listings.pop(directory, None)
+                return None
+            if parent_listing is not None and name not in parent_listing[4]:
+                cls.listings.pop(directory, None)
+                return None
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            cls.listings.pop(directory, None)
+            return None
+        except OSError:
+            cls.unreadable.add(directory)
+            return None
+        listing = cls.listings.get(directory)
+        if listing is not None and listing[0] == mtime:
+            return listing
+        try:
+            files = []
+            directories = []
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        directories.append(entry.name)
+                    else:
+                        files.append(entry.name)
+        except NotADirectoryError:
+            cls.listings.pop(directory, None)
+            return None
+        except OSError:
+            cls.unreadable.add(directory)
+            return None
+        cls.scans += 1
+        cls.dirty = True
+        listing = cls.make_listing(mtime, tuple(files), tuple(directories))
+        cls.listings[directory] = listing
+        return listing
+
+    @classmethod
+    def normalize(cls, path: Union[str, Path]) -> str:
+        return os.path.normcase(os.path.abspath(path))
+
+    @classmethod
+    def add_root(cls, path: Union[str, Path]):
+        if path != "":
+            cls.roots.add(cls.normalize(path))
+
+    @classmethod
+    def split(cls, path: Union[str, Path]) -> Tuple[str, str]:
+        return os.path.split(cls.normalize(path))
+
+    @classmethod
+    def exists(cls, path: Union[str, Path]) -> bool:
+        cls.lookups += 1
+        directory, name = cls.split(path)
+        listing = cls.listing(directory)
+        if listing is None:
+            if directory in cls.unreadable:
+                return os.path.exists(path)
+            return False
+        return name in listing[3] or name in listing[4]
+
+    @classmethod
+    def is_dir(cls, path: Union[str, Path]) -> bool:
+        cls.lookups += 1
+        directory, name = cls.split(path)
+        listing = cls.listing(directory)
+        if listing is None:
+            if directory in cls.unreadable:
+                return os.path.isdir(path)
+            return False
+        return name in listing[4]
+
+    @classmethod
+    def find_files(cls, root: Path, suffix: str) -> List[Path]:
+        """All files with this suffix below root (like root.rglob("*" + suffix)), served from the listings."""
+        suffix = os.path.normcase(suffix)
+        cls.add_root(root)
+        found = []
+        stack = [str(root)]
+        while stack:
+            directory = stack.pop()
+            normalized = cls.normalize(directory)
+            listing = cls.listing(normalized)
+            if listing is None:
+                if normalized in cls.unreadable:
+                    found += [path for path in Path(directory).rglob("*" + suffix) if path.is_file()]
+                continue
+            found += [Path(directory, name) for name in listing[1] if os.path.normcase(name).endswith(suffix)]
+            stack += [os.path.join(directory, name) for name in listing[2]]
+        return sorted(found)
+
+    @classmethod
+    def resolve_data_path(cls, path: Path, rda_folder: str, mod_folder: str) -> Path:
+        """The file of the data path: In the mod folder if it exists there, otherwise in the rda folder.
+        If it exists in neither, the mod folder is preferred when it contains the directory of the file."""
+        key = (path.as_posix(), rda_folder, mod_folder)
+        resolved = cls.resolved_paths.get(key)
+        if resolved is not None:
+            return resolved
+        cls.add_root(rda_folder)
+        cls.add_root(mod_folder)
+        rda_absolute_path = Path(rda_folder, path)
+        resolved = rda_absolute_path
+        if mod_folder != "":
+            mod_absolute_path = Path(mod_folder, path)
+            if cls.exists(mod_absolute_path):
+                resolved = mod_absolute_path
+            elif cls.exists(rda_absolute_path):
+                resolved = rda_absolute_path
+            #Maybe it will be used with a different extension, etc. so have a look if the folder exists
+            elif cls.is_dir(mod_absolute_path.parent):
+                resolved = mod_absolute_path
+        cls.resolved_paths[key] = resolved
+        cls.data_paths[resolved] = path
+        return resolved
+
+    @classmethod
+    def statistics(cls) -> str:
+        return f"Directory index: {cls.lookups} lookups, {cls.scans} directories listed, {len(cls.resolved_paths)} data paths resolved"
+
+
+def register():
+    IO_AnnocfgPreferences.snapshot_start_callbacks.append(DirectoryIndex.refresh)
+    IO_AnnocfgPreferences.snapshot_end_callbacks.append(DirectoryIndex.flush)
+
+def unregister():
+    for callbacks, callback in [
+        (IO_AnnocfgPreferences.snapshot_start_callbacks, DirectoryIndex.refresh),
+        (IO_AnnocfgPreferences.snapshot_end_callbacks, DirectoryIndex.flush),
+    ]:
+        if callback in callbacks:
+            callbacks.remove(callback)
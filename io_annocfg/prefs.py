@@ -17,12 +17,99 @@
 # ##### END GPL LICENSE BLOCK #####
 import bpy
 from bpy.types import AddonPreferences, Scene
-from bpy.props import StringProperty, EnumProperty, BoolProperty, FloatProperty
+from bpy.props import StringProperty, EnumProperty, BoolProperty, FloatProperty, IntProperty
 
+import functools
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, List, NamedTuple, Optional
+
+
+class Settings(NamedTuple):
+    """Immutable copy of the add-on preferences.
+    Imports and exports take one snapshot when they start (IO_AnnocfgPreferences.snapshot), so the hot loops
+    (per object, per texture, per vertex) read a tuple field instead of going through bpy.context.preferences.addons every time.
+    New options are added here and in capture.
+    """
+    path_to_rda_folder: Path
+    path_to_rdm4: Path
+    path_to_texconv: Path
+    path_to_fc_converter: Path
+    path_to_filedb_reader: Path
+    texture_quality: str
+    splines_enabled: bool
+    mirror_models: bool
+    sequences_as_blender_objects: bool
+    cfg_cache_path: Path
+    cfg_cache_loading_enabled: bool
+    cfg_cache_writing_enabled: bool
+    cfg_cache_min_uses: int
+    cfg_cache_min_import_ms: float
+    cfg_cache_budget_mb: int
+    cfg_cache_eviction_policy: str
+    conversion_cache_path: Optional[Path]
+    conversion_cache_hash_enabled: bool
+    instance_subfiles: bool
+    material_library_path: Optional[Path]
+    compact_dynamic_properties: bool
+
+    # field -> function reading it from the add-on preferences, in the order of the fields.
+    READERS = {
+        "path_to_rda_folder": lambda preferences: Path(preferences.path_to_rda_folder),
+        "path_to_rdm4": lambda preferences: Path(preferences.path_to_rdm4),
+        "path_to_texconv": lambda preferences: Path(preferences.path_to_texconv),
+        "path_to_fc_converter": lambda preferences: Path(preferences.path_to_fc_converter),
+        "path_to_filedb_reader": lambda preferences: Path(preferences.path_to_filedb_reader),
+        "texture_quality": lambda preferences: preferences.texture_quality,
+        "splines_enabled": lambda preferences: preferences.enable_splines,
+        "mirror_models": lambda preferences: preferences.mirror_models_bool,
+        "sequences_as_blender_objects": lambda preferences: preferences.sequences_as_blender_objects,
+        "cfg_cache_path": lambda preferences: Path(preferences.cfg_cache_path),
+        "cfg_cache_loading_enabled": lambda preferences: preferences.cfg_cache_loading_enabled_bool,
+        "cfg_cache_writing_enabled": lambda preferences: preferences.cfg_cache_writing_enabled_bool,
+        "cfg_cache_min_uses": lambda preferences: preferences.cfg_cache_min_uses_int,
+        "cfg_cache_min_import_ms": lambda preferences: preferences.cfg_cache_min_import_ms_float,
+        "cfg_cache_budget_mb": lambda preferences: preferences.cfg_cache_budget_mb_int,
+        "cfg_cache_eviction_policy": lambda preferences: preferences.cfg_cache_eviction_policy,
+        "conversion_cache_path": lambda preferences: Settings.optional_path(preferences.conversion_cache_path),
+        "conversion_cache_hash_enabled": lambda preferences: preferences.conversion_cache_hash_bool,
+        "instance_subfiles": lambda preferences: preferences.instance_subfiles_bool,
+        "material_library_path": lambda preferences: Settings.optional_path(preferences.material_library_path),
+        "compact_dynamic_properties": lambda preferences: preferences.compact_dynamic_properties_bool,
+    }
+
+    @classmethod
+    def optional_path(cls, path: str) -> Optional[Path]:
+        if path == "":
+            return None
+        return Path(path)
+
+    @classmethod
+    def read(cls, preferences, field: str):
+        """Reads one setting from the add-on preferences."""
+        return cls.READERS[field](preferences)
+
+    @classmethod
+    def capture(cls, preferences) -> "Settings":
+        return cls(*(reader(preferences) for reader in cls.READERS.values()))
+
+
+def with_settings_snapshot(execute):
+    """Decorator for Operator.execute, runs it with one snapshot of the preferences."""
+    @functools.wraps(execute)
+    def execute_with_snapshot(self, context):
+        with IO_AnnocfgPreferences.snapshot():
+            return execute(self, context)
+    return execute_with_snapshot
+
 
 class IO_AnnocfgPreferences(AddonPreferences):
     bl_idname = __package__
+    # Settings of the running operator, see snapshot. Not annotated, it is no blender property.
+    active_settings = None
+    # Called at the start and the end of the outermost snapshot (of every operator), f.e. to refresh or write caches.
+    snapshot_start_callbacks: List[Callable[[], None]] = []
+    snapshot_end_callbacks: List[Callable[[], None]] = []
     
     path_to_rda_folder : StringProperty( # type: ignore
         name = "Path to rda Folder",
@@ -78,13 +165,6 @@ class IO_AnnocfgPreferences(AddonPreferences):
         description = "Turns sequences into blender objects and resolves ModelID (and ParticleID) references to their respective blender object. Allows easier handling of animated files and prevents errors coming from a reordering of the models when exporting. ",
         default = True
     )
-    cfg_cache_probability_float : FloatProperty( # type: ignore
-        name = "Cfg Cache Probability",
-        description = "Caches .cfg files in a specific library folder to allow faster retrieval. Set to 0 to disable and to 1 to cache everything. Use a value in between to only cache frequently used .cfgs (in expectation)",
-        default = 0.0,
-        min = 0.0,
-        max = 1.0,
-    )
     cfg_cache_loading_enabled_bool : BoolProperty( # type: ignore
         name = "Cfg Cache Loading Enabled",
         description = "Allow to load cached .cfgs",
@@ -96,6 +176,64 @@ class IO_AnnocfgPreferences(AddonPreferences):
         subtype='FILE_PATH',
         default = "C:\\Users\\Public\\Anno\\CfgCache",
     )
+    cfg_cache_writing_enabled_bool : BoolProperty( # type: ignore
+        name = "Cfg Cache Writing Enabled",
+        description = "Caches frequently used or slow to import .cfg files in the cfg cache folder",
+        default = False,
+    )
+    cfg_cache_min_uses_int : IntProperty( # type: ignore
+        name = "Cache After Uses",
+        description = "A .cfg file is cached once it has been imported this many times",
+        default = 3,
+        min = 1,
+    )
+    cfg_cache_min_import_ms_float : FloatProperty( # type: ignore
+        name = "Cache After Import Time (ms)",
+        description = "A .cfg file is also cached if importing it took at least this long",
+        default = 2000.0,
+        min = 0.0,
+    )
+    cfg_cache_budget_mb_int : IntProperty( # type: ignore
+        name = "Cfg Cache Budget (MB)",
+        description = "Maximum size of the cfg cache. The cached files are evicted according to the eviction policy once it is exceeded. Set to 0 for no limit",
+        default = 2048,
+        min = 0,
+    )
+    cfg_cache_eviction_policy : EnumProperty( #type: ignore
+        name = "Cfg Cache Eviction Policy",
+        description = "Which cached files are deleted first when the cfg cache exceeds its budget",
+        items = [
+            ("LRU", "Least Recently Used", "Deletes the files that have not been used for the longest time"),
+            ("LFU", "Least Frequently Used", "Deletes the files that have been used the least often"),
+        ],
+        default = "LRU")
+    conversion_cache_path : StringProperty( # type: ignore
+        name = "Path to conversion cache",
+        description = "Converted .glb and .png files are stored in this folder instead of next to the game files, which allows a read-only rda folder. Leave empty to store them next to the game files. Parsed .cfg, .ifo, .cf7 and .prp files are stored in its \"parsed\" subfolder, or in the one of the cfg cache if this is empty",
+        subtype='FILE_PATH',
+        default = "",
+    )
+    conversion_cache_hash_bool : BoolProperty( # type: ignore
+        name = "Hash Converted Files",
+        description = "Also compare the content of the source files (not only their size and modification time) to decide if a cached conversion is still valid. Slower",
+        default = False,
+    )
+    instance_subfiles_bool : BoolProperty( # type: ignore
+        name = "Instance Repeated Subfiles",
+        description = "Every subfile is only imported once, all other references to it become collection instances. Use 'Make Subfile Real' to edit a single copy",
+        default = True,
+    )
+    material_library_path : StringProperty( # type: ignore
+        name = "Path to material library",
+        description = "Imported materials are stored in this folder (one .blend per material) and reused by later sessions instead of building their node trees again. Leave empty to disable",
+        subtype='FILE_PATH',
+        default = "",
+    )
+    compact_dynamic_properties_bool : BoolProperty( # type: ignore
+        name = "Compact Object Properties",
+        description = "Imported objects keep their remaining xml as one compressed string instead of editable properties. They are expanded when shown in the Anno Object panel. Faster imports and smaller .blend files for large scenes",
+        default = False,
+    )
     
     def draw(self, context):
         layout = self.layout
@@ -109,45 +247,126 @@ class IO_AnnocfgPreferences(AddonPreferences):
         layout.prop(self, "enable_splines")
         layout.prop(self, "sequences_as_blender_objects")
         layout.prop(self, "cfg_cache_loading_enabled_bool")
-        layout.prop(self, "cfg_cache_probability_float")
+        layout.prop(self, "cfg_cache_writing_enabled_bool")
+        layout.prop(self, "cfg_cache_min_uses_int")
+        layout.prop(self, "cfg_cache_min_import_ms_float")
+        layout.prop(self, "cfg_cache_budget_mb_int")
+        layout.prop(self, "cfg_cache_eviction_policy")
         layout.prop(self, "cfg_cache_path")
+        self.draw_cfg_cache_statistics(layout)
+        layout.prop(self, "conversion_cache_path")
+        layout.prop(self, "conversion_cache_hash_bool")
+        layout.prop(self, "instance_subfiles_bool")
+        layout.prop(self, "material_library_path")
+        layout.operator("anno_shader_library.build")
+        layout.prop(self, "compact_dynamic_properties_bool")
+
+    def draw_cfg_cache_statistics(self, layout):
+        from .cfg_cache import CfgCache
+        if not Path(self.cfg_cache_path).exists():
+            return
+        box = layout.box()
+        box.label(text = f"Cfg Cache: {CfgCache.total_size() / (1024 * 1024):.1f} MB, {CfgCache.hit_rate():.0f}% hit rate ({CfgCache.hits} hits, {CfgCache.misses} misses)")
+        for data_path, entry in CfgCache.top_entries(5):
+            cached = "cached" if entry["size"] > 0 else "not cached"
+            box.label(text = f"{entry['uses']}x {data_path} ({entry['import_ms']:.0f} ms, {cached})")
+
+    @classmethod
+    def setting(cls, field: str):
+        """One value of the snapshot of the running import/export, otherwise only this value is read from the current preferences."""
+        if cls.active_settings is not None:
+            return getattr(cls.active_settings, field)
+        return Settings.read(bpy.context.preferences.addons[__package__].preferences, field)
+
+    @classmethod
+    def settings(cls) -> Settings:
+        """The snapshot of the running import/export (see snapshot), otherwise the current preferences."""
+        if cls.active_settings is not None:
+            return cls.active_settings
+        return Settings.capture(bpy.context.preferences.addons[__package__].preferences)
+
+    @classmethod
+    @contextmanager
+    def snapshot(cls):
+        """Reads the preferences once, all getters return the same values until the end of the block (nested blocks use the outer snapshot)."""
+        if cls.active_settings is not None:
+            yield cls.active_settings
+            return
+        cls.active_settings = cls.settings()
+        try:
+            for callback in cls.snapshot_start_callbacks:
+                callback()
+            yield cls.active_settings
+        finally:
+            try:
+                for callback in cls.snapshot_end_callbacks:
+                    callback()
+            finally:
+                cls.active_settings = None
 
     @classmethod
     def get_cfg_cache_path(cls):
-        return Path(bpy.context.preferences.addons[__package__].preferences.cfg_cache_path)
+        return cls.setting("cfg_cache_path")
     @classmethod
     def get_path_to_rda_folder(cls):
-        return Path(bpy.context.preferences.addons[__package__].preferences.path_to_rda_folder)
+        return cls.setting("path_to_rda_folder")
     @classmethod
     def get_path_to_rdm4(cls):
-        return Path(bpy.context.preferences.addons[__package__].preferences.path_to_rdm4)
+        return cls.setting("path_to_rdm4")
     @classmethod
     def get_path_to_texconv(cls):
-        return Path(bpy.context.preferences.addons[__package__].preferences.path_to_texconv)
+        return cls.setting("path_to_texconv")
     @classmethod
     def get_path_to_fc_converter(cls):
-        return Path(bpy.context.preferences.addons[__package__].preferences.path_to_fc_converter)
+        return cls.setting("path_to_fc_converter")
     @classmethod
     def get_path_to_filedb_reader(cls):
-        return Path(bpy.context.preferences.addons[__package__].preferences.path_to_filedb_reader)
+        return cls.setting("path_to_filedb_reader")
     @classmethod
     def get_texture_quality(cls):
-        return bpy.context.preferences.addons[__package__].preferences.texture_quality
+        return cls.setting("texture_quality")
     @classmethod
     def splines_enabled(cls):
-        return bpy.context.preferences.addons[__package__].preferences.enable_splines
+        return cls.setting("splines_enabled")
     @classmethod
     def mirror_models(cls):
-        return bpy.context.preferences.addons[__package__].preferences.mirror_models_bool
+        return cls.setting("mirror_models")
     @classmethod
     def turn_sequences_into_blender_objects(cls):
-        return bpy.context.preferences.addons[__package__].preferences.sequences_as_blender_objects
+        return cls.setting("sequences_as_blender_objects")
+    @classmethod
+    def cfg_cache_writing_enabled(cls):
+        return cls.setting("cfg_cache_writing_enabled")
+    @classmethod
+    def cfg_cache_min_uses(cls):
+        return cls.setting("cfg_cache_min_uses")
+    @classmethod
+    def cfg_cache_min_import_ms(cls):
+        return cls.setting("cfg_cache_min_import_ms")
     @classmethod
-    def cfg_cache_probability(cls):
-        return bpy.context.preferences.addons[__package__].preferences.cfg_cache_probability_float
+    def cfg_cache_budget_mb(cls):
+        return cls.setting("cfg_cache_budget_mb")
+    @classmethod
+    def cfg_cache_eviction_policy(cls):
+        return cls.setting("cfg_cache_eviction_policy")
     @classmethod
     def cfg_cache_loading_enabled(cls):
-        return bpy.context.preferences.addons[__package__].preferences.cfg_cache_loading_enabled_bool
+        return cls.setting("cfg_cache_loading_enabled")
+    @classmethod
+    def get_conversion_cache_path(cls):
+        return cls.setting("conversion_cache_path")
+    @classmethod
+    def conversion_cache_hash_enabled(cls):
+        return cls.setting("conversion_cache_hash_enabled")
+    @classmethod
+    def instance_subfiles(cls):
+        return cls.setting("instance_subfiles")
+    @classmethod
+    def get_material_library_path(cls):
+        return cls.setting("material_library_path")
+    @classmethod
+    def compact_dynamic_properties(cls):
+        return cls.setting("compact_dynamic_properties")
 
 classes = (
     IO_AnnocfgPreferences,
@@ -0,0 +1,205 @@
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import bpy
+from bpy.app.handlers import persistent
+
+
+class SceneIndex():
+    """Lookup tables for all objects of the blend file: parent -> children, anno object class -> objects and name -> object.
+
+    Object.children and scans over bpy.data.objects are O(N) in the number of objects, with 50k island props
+    that adds up quickly. The index is built on the first lookup and then kept current by the depsgraph_update_post handler,
+    which only looks at the objects that were updated (renamed, reparented, class changed).
+    When objects are added or removed, on undo/redo and after loading a file, it is rebuilt on the next lookup instead.
+    Objects are keyed by their pointer, so a rename does not lose track of the children of an object.
+    The sorted results of the lookups are cached until the index changes, the returned lists are shared and must not be modified.
+    """
+    valid = False
+    object_count = -1
+
+    # pointer -> (object, name, parent pointer, anno object class name)
+    entries: Dict[int, Tuple[bpy.types.Object, str, Optional[int], str]] = {}
+    pointer_by_name: Dict[str, int] = {}
+    children_by_pointer: Dict[int, Set[int]] = {}
+    pointers_by_class: Dict[str, Set[int]] = {}
+    # (lookup, pointer or class names) -> objects sorted by name
+    sorted_cache: Dict[tuple, List[bpy.types.Object]] = {}
+
+    @classmethod
+    def invalidate(cls):
+        cls.valid = False
+
+    @classmethod
+    def ensure(cls):
+        if cls.valid and cls.object_count == len(bpy.data.objects):
+            return
+        cls.rebuild()
+
+    @classmethod
+    def rebuild(cls):
+        cls.entries = {}
+        cls.pointer_by_name = {}
+        cls.children_by_pointer = {}
+        cls.pointers_by_class = {}
+        cls.sorted_cache = {}
+        for obj in bpy.data.objects:
+            cls.add(obj)
+        cls.object_count = len(bpy.data.objects)
+        cls.valid = True
+
+    @classmethod
+    def add(cls, obj):
+        pointer = obj.as_pointer()
+        name = obj.name
+        parent_pointer = obj.parent.as_pointer() if obj.parent is not None else None
+        class_name = obj.anno_object_class_str
+        cls.entries[pointer] = (obj, name, parent_pointer, class_name)
+        cls.pointer_by_name[name] = pointer
+        if parent_pointer is not None:
+            cls.children_by_pointer.setdefault(parent_pointer, set()).add(pointer)
+        cls.pointers_by_class.setdefault(class_name, set()).add(pointer)
+
+    @classmethod
+    def remove(cls, pointer: int):
+        _, name, parent_pointer, class_name = cls.entries.pop(pointer)
+        if cls.pointer_by_name.get(name) == pointer:
+            del cls.pointer_by_name[name]
+        if parent_pointer is not None:
+            cls.children_by_pointer[parent_pointer].discard(pointer)
+        cls.pointers_by_class[class_name].discard(pointer)
+
+    @classmethod
+    def update(cls, obj):
+        pointer = obj.as_pointer()
+        entry = cls.entries.get(pointer)
+        if entry is None:
+            cls.invalidate()
+            return
+        _, name, parent_pointer, class_name = entry
+        new_parent_pointer = obj.parent.as_pointer() if obj.parent is not None else None
+        if name == obj.name and parent_pointer == new_parent_pointer and class_name == obj.anno_object_class_str:
+            return
+        cls.remove(pointer)
+        cls.add(obj)
+        cls.sorted_cache = {}
+
+    @classmethod
+    def on_depsgraph_update(cls, depsgraph):
+        if not cls.valid:
+            return
+        if cls.object_count != len(bpy.data.objects):
+            cls.invalidate()
+            return
+        for update in depsgraph.updates:
+            if not isinstance(update.id, bpy.types.Object):
+                continue
+            cls.update(update.id.original)
+            if not cls.valid:
+                return
+
+    @classmethod
+    def sorted_objects(cls, key: tuple, pointers: Callable[[], Iterable[int]]) -> List[bpy.types.Object]:
+        """Objects sorted by name, which is the order of bpy.data.objects. Only sorted again after the index changed."""
+        objects = cls.sorted_cache.get(key)
+        if objects is None:
+            entries = cls.entries
+            objects = [entries[pointer][0] for pointer in sorted(pointers(), key = lambda pointer: entries[pointer][1])]
+            cls.sorted_cache[key] = objects
+        return objects
+
+    @classmethod
+    def get(cls, name: str) -> Optional[bpy.types.Object]:
+        cls.ensure()
+        pointer = cls.pointer_by_name.get(name)
+        if pointer is None:
+            return None
+        return cls.entries[pointer][0]
+
+    @classmethod
+    def children(cls, obj) -> List[bpy.types.Object]:
+        cls.ensure()
+        pointer = obj.as_pointer()
+        return cls.sorted_objects(("children", pointer), lambda: cls.children_by_pointer.get(pointer, ()))
+
+    @classmethod
+    def children_by_name(cls, name: str) -> List[bpy.types.Object]:
+        cls.ensure()
+        pointer = cls.pointer_by_name.get(name)
+        if pointer is None:
+            return []
+        return cls.sorted_objects(("children", pointer), lambda: cls.children_by_pointer.get(pointer, ()))
+
+    @classmethod
+    def children_of_class(cls, obj, anno_class: type) -> List[bpy.types.Object]:
+        cls.ensure()
+        class_name = anno_class.__name__
+        entries = cls.entries
+        pointer = obj.as_pointer()
+        return cls.sorted_objects(("children_of_class", pointer, class_name),
+            lambda: [child for child in cls.children_by_pointer.get(pointer, ()) if entries[child][3] == class_name])
+
+    @classmethod
+    def objects_of_class(cls, *anno_classes: type) -> List[bpy.types.Object]:
+        cls.ensure()
+        class_names = tuple(anno_class.__name__ for anno_class in anno_classes)
+        def pointers():
+            result = set()
+            for class_name in class_names:
+                result.update(cls.pointers_by_class.get(class_name, ()))
+            return result
+        return cls.sorted_objects(("objects_of_class", class_names), pointers)
+
+    @classmethod
+    def class_name(cls, obj) -> str:
+        cls.ensure()
+        entry = cls.entries.get(obj.as_pointer())
+        if entry is None:
+            return obj.anno_object_class_str
+        return entry[3]
+
+    @classmethod
+    def child_map(cls) -> "ChildMap":
+        cls.ensure()
+        return ChildMap()
+
+
+class ChildMap():
+    """Parent name -> children view of the SceneIndex, as expected by the blender_to_xml functions."""
+    def get(self, name: str, default = None):
+        children = SceneIndex.children_by_name(name)
+        if not children:
+            return default
+        return children
+
+    def __getitem__(self, name: str) -> List[bpy.types.Object]:
+        return SceneIndex.children_by_name(name)
+
+    def __contains__(self, name: str) -> bool:
+        return len(SceneIndex.children_by_name(name)) > 0
+
+
+@persistent
+def scene_index_depsgraph_update_post(scene, depsgraph):
+    SceneIndex.on_depsgraph_update(depsgraph)
+
+@persistent
+def scene_index_invalidate(*args):
+    SceneIndex.invalidate()
+
+
+def register():
+    bpy.app.handlers.depsgraph_update_post.append(scene_index_depsgraph_update_post)
+    bpy.app.handlers.load_post.append(scene_index_invalidate)
+    bpy.app.handlers.undo_post.append(scene_index_invalidate)
+    bpy.app.handlers.redo_post.append(scene_index_invalidate)
+
+def unregister():
+    for handlers, handler in [
+        (bpy.app.handlers.depsgraph_update_post, scene_index_depsgraph_update_post),
+        (bpy.app.handlers.load_post, scene_index_invalidate),
+        (bpy.app.handlers.undo_post, scene_index_invalidate),
+        (bpy.app.handlers.redo_post, scene_index_invalidate),
+    ]:
+        if handler in handlers:
+            handlers.remove(handler)
+    SceneIndex.invalidate()
@@ -1,7 +1,11 @@
 import bpy
 import xml.etree.ElementTree as ET
-from .shader_components import AbstractShaderComponent, AbstractLink
+from pathlib import Path
+from typing import List
+from .shader_components import AbstractShaderComponent, AbstractLink, FlaglessTextureLink
 from ..utils import xml_smart
+from ..material_cache import MaterialCache
+from .shader_library import ShaderLibrary
 
 class AnnoBasicShader: 
     def __init__(self):
@@ -47,7 +51,22 @@ class AnnoBasicShader:
             link.to_xml(root, blender_material)
         return root
 
+    def texture_data_paths(self, material_node : ET.Element) -> List[Path]:
+        """All .dds files to_blender_material would load for this material node."""
+        paths = []
+        for link in self.links:
+            if not isinstance(link, FlaglessTextureLink):
+                continue
+            texture_path = link.texture_data_path(material_node)
+            if texture_path is not None:
+                paths.append(texture_path)
+        return paths
+
     def to_blender_material(self, material_node : ET.Element): 
+        """Returns the blender material for this material node, an existing one if the same material has already been imported."""
+        return MaterialCache.get_or_create(self, material_node, self.create_blender_material)
+
+    def create_blender_material(self, material_node : ET.Element): 
         
         name_node = material_node.find("Name")
         name = "Unnamed Material"
@@ -75,9 +94,7 @@ class AnnoBasicShader:
         group = nodes.new(type='ShaderNodeGroup')
         group.label = self.shader_id
         group.name = self.shader_id
-        if not self.shader_id in bpy.data.node_groups:
-            self.create_anno_shader()            
-        group.node_tree = bpy.data.node_groups[self.shader_id]
+        group.node_tree = ShaderLibrary.get_node_group(self)
         print(self.shader_id)
         print(group.name)
         return group
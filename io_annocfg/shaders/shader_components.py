@@ -2,8 +2,13 @@ import xml.etree.ElementTree as ET
 import mathutils
 from ..utils import to_data_path, data_path_to_absolute_path
 import os
+import re
 from pathlib import Path
+from typing import Optional
 from ..prefs import IO_AnnocfgPreferences
+from ..conversion import convert_to_png, png_path, is_converted
+from ..conversion_cache import ConversionCache
+from ..texture_registry import TextureRegistry
 import bpy
 import subprocess
 import logging 
@@ -13,6 +18,16 @@ log = logging.getLogger("ShaderComponents")
 def texture_quality_suffix():
     return "_"+IO_AnnocfgPreferences.get_texture_quality()
 
+def strip_texture_quality(texture_path: Path) -> Path:
+    """Turns "data/.../texture_diffuse_0.png" (or _1, _2) into "data/.../texture_diffuse.png", independent of the texture quality setting."""
+    texture_path = Path(texture_path)
+    return Path(texture_path.parent, re.sub(r"_[012]$", "", texture_path.stem) + texture_path.suffix)
+
+def dds_data_path(texture_path: Path) -> Path:
+    """Turns "data/.../texture_diffuse.psd" into "data/.../texture_diffuse_0.dds" (depending on the texture quality)."""
+    texture_path = Path(texture_path)
+    return Path(texture_path.parent, texture_path.stem + texture_quality_suffix()+".dds")
+
 class AbstractLink: 
     def __init__(self, default_value = None, is_invalid = False):
         self.socket_type = ""
@@ -74,10 +89,12 @@ class FlaglessTextureLink(AbstractLink):
         
         texture_node = link[0].from_node
         filepath_full = os.path.realpath(bpy.path.abspath(texture_node.image.filepath, library=texture_node.image.library))
+        #Textures from the conversion cache are exported with the path of their .dds file
+        filepath_full = ConversionCache.source_path(filepath_full) or filepath_full
         texture_path = to_data_path(filepath_full)
         #Rename "data/.../some_diff_0.png" to "data/.../some_diff.psd"
         extension = ".psd"
-        texture_path = Path(texture_path.as_posix().replace(texture_quality_suffix()+".", ".")).with_suffix(extension)
+        texture_path = strip_texture_quality(texture_path).with_suffix(extension)
 
         tex = ET.SubElement(parent, self.texture_key)
         tex.text = str(texture_path)
@@ -106,6 +123,14 @@ class FlaglessTextureLink(AbstractLink):
         if self.has_alpha_link():
             blender_material.node_tree.links.new(shader.inputs[self.alpha_link], texture_node.outputs["Alpha"])
 
+    def texture_data_path(self, material_node : ET.Element) -> Optional[Path]:
+        """Returns the .dds file to_blender would load for this material node (or None).
+        Used to convert all textures of an import before the materials are created."""
+        texture_xmlnode = material_node.find(self.texture_key)
+        if texture_xmlnode is None or not texture_xmlnode.text:
+            return None
+        return dds_data_path(Path(texture_xmlnode.text))
+
     def get_texture(self, texture_path: Path):
         """Tries to find the texture texture_path with ending "_0.png" (quality setting can be changed) in the list of loaded textures.
         Otherwise loads it. If it is not existing but the corresponding .dds exists, converts it first.
@@ -118,43 +143,21 @@ class FlaglessTextureLink(AbstractLink):
         """
         if texture_path == Path(""):
             return None
-        texture_path = Path(texture_path)
-        texture_path = Path(texture_path.parent, texture_path.stem + texture_quality_suffix()+".dds")
-        png_file = texture_path.with_suffix(".png")
-        fullpath = data_path_to_absolute_path(texture_path)
-        png_fullpath = data_path_to_absolute_path(png_file)
-        image = bpy.data.images.get(str(png_file.name), None)
-        if image is not None:
-            image_path_full = os.path.normpath(bpy.path.abspath(image.filepath, library=image.library))
-            if str(image_path_full) == str(png_fullpath):
-                return image
-        if not png_fullpath.exists():
-            success = self.convert_to_png(fullpath)
-            if not success:
-                print("Failed to convert texture", fullpath)
-                return None
-        image = bpy.data.images.load(str(png_fullpath))
-        return image
-
-    def convert_to_png(self, fullpath: Path) -> bool:
+        return TextureRegistry.get_image(dds_data_path(texture_path))
+
+    def convert_to_png(self, fullpath: Path, output: Optional[Path] = None) -> bool:
         """Converts the .dds file to .png. Returns True if successful, False otherwise.
 
         Args:
             fullpath (str): .dds file
+            output (str): .png file, defaults to the .dds file with a .png extension
 
         Returns:
             bool: Successful
         """
-        if not IO_AnnocfgPreferences.get_path_to_texconv().exists():
-            return False
-        if not fullpath.exists():
-            return False
-        try:
-            proc_args = f"\"{IO_AnnocfgPreferences.get_path_to_texconv()}\" -ft PNG -sepalpha -y -o \"{fullpath.parent}\" \"{fullpath}\""
-            subprocess.call(proc_args)
-        except:
-            return False
-        return fullpath.with_suffix(".png").exists()
+        success = convert_to_png(fullpath, output = output)
+        ConversionCache.flush()
+        return success
       
 
 class TextureLink(FlaglessTextureLink): 
@@ -183,6 +186,12 @@ class TextureLink(FlaglessTextureLink):
         if (flag.text == "1"):
             super().to_blender(shader, material_node, blender_material)
 
+    def texture_data_path(self, material_node : ET.Element) -> Optional[Path]:
+        flag = material_node.find(self.flag_key)
+        if flag is None or flag.text != "1":
+            return None
+        return super().texture_data_path(material_node)
+
 class FlagLink(AbstractLink): 
     def __init__(self, link_key, flag_key, is_invalid = False, default_value = None):
         super().__init__(default_value, is_invalid)
@@ -0,0 +1,129 @@
+import hashlib
+from pathlib import Path
+from typing import List, Optional
+
+import bpy
+
+
+class ShaderLibrary():
+    """Provides the node groups of the anno shaders.
+
+    Building a node group node by node (create_anno_shader) is slow, so the node groups of all shaders are kept prebuilt
+    in a library .blend (LIBRARY_NAME, next to this file) and appended from there when a file needs them.
+    The library is generated by the "Build Shader Library" operator (or build_library) from the shader classes.
+    Every node group is stamped with the version of the shader code (FORMAT_VERSION and a hash of the shader sources).
+    Node groups of another version, in the library or in the current file, are replaced by the current one,
+    so two versions never exist under the same name.
+    """
+    FORMAT_VERSION = "1"
+    VERSION_PROPERTY = "anno_shader_version"
+    LIBRARY_NAME = "shader_library.blend"
+
+    version: Optional[str] = None
+    # Set once the library turned out to be missing or outdated, the node groups are then built in this session.
+    library_unusable = False
+
+    @classmethod
+    def shaders(cls) -> List:
+        from .default_shader import AnnoDefaultShader
+        from .cloth_shader import ClothShader
+        from .cutout_shader import CutoutShader
+        from .decal_shader import DecalShader
+        from .destruct_shader import DestructShader
+        from .glass_shader import GlassShader
+        from .mine_cutout_shader import MineCutoutShader
+        from .mockup_shader import MockupShader
+        from .prop_decal_shader import DecalPropShader
+        from .prop_decaldetail_shader import DecalDetailPropShader
+        from .prop_grass_shader import GrassPropShader
+        from .prop_pbr_shader import SimplePBRPropShader
+        from .prop_plant_shader import PlantPropShader
+        from .prop_terrain_shader import TerrainPropShader
+        from .water_shader import LiquidShader
+        return [
+            AnnoDefaultShader(), ClothShader(), CutoutShader(), DecalShader(), DestructShader(), GlassShader(),
+            MineCutoutShader(), MockupShader(), DecalPropShader(), DecalDetailPropShader(), GrassPropShader(),
+            SimplePBRPropShader(), PlantPropShader(), TerrainPropShader(), LiquidShader(),
+        ]
+
+    @classmethod
+    def get_version(cls) -> str:
+        if cls.version is None:
+            sources = hashlib.sha1()
+            for path in sorted(Path(__file__).parent.glob("*.py")):
+                sources.update(path.name.encode("utf-8"))
+                sources.update(path.read_bytes().replace(b"\r\n", b"\n"))
+            cls.version = f"{cls.FORMAT_VERSION}-{sources.hexdigest()[:16]}"
+        return cls.version
+
+    @classmethod
+    def library_path(cls) -> Path:
+        return Path(__file__).parent / cls.LIBRARY_NAME
+
+    @classmethod
+    def is_current(cls, node_group) -> bool:
+        return node_group.get(cls.VERSION_PROPERTY) == cls.get_version()
+
+    @classmethod
+    def get_node_group(cls, shader):
+        """Returns the node group of the shader, appends or builds it if the file does not contain the current version."""
+        existing = bpy.data.node_groups.get(shader.shader_id)
+        if existing is not None and cls.is_current(existing):
+            return existing
+        if existing is not None:
+            print(f"Replacing outdated shader node group {shader.shader_id}")
+            # Frees the name for the new node group.
+            existing.name = shader.shader_id + "_outdated"
+        node_group = cls.append(shader.shader_id)
+        if node_group is None:
+            node_group = cls.build(shader)
+        if existing is not None:
+            existing.user_remap(node_group)
+            bpy.data.node_groups.remove(existing)
+        node_group.name = shader.shader_id
+        return node_group
+
+    @classmethod
+    def append(cls, shader_id: str):
+        if cls.library_unusable:
+            return None
+        path = cls.library_path()
+        if not path.exists():
+            cls.library_unusable = True
+            return None
+        try:
+            with bpy.data.libraries.load(str(path), link = False) as (data_from, data_to):
+                data_to.node_groups = [name for name in data_from.node_groups if name == shader_id]
+        except Exception as ex:
+            print(f"Warning: Could not load shader library {path}: {ex}")
+            cls.library_unusable = True
+            return None
+        node_groups = [node_group for node_group in data_to.node_groups if node_group is not None]
+        if not node_groups:
+            return None
+        node_group = node_groups[0]
+        if not cls.is_current(node_group):
+            print(f"Shader library {path} is outdated, building the shaders instead. Use 'Build Shader Library' to update it.")
+            bpy.data.node_groups.remove(node_group)
+            cls.library_unusable = True
+            return None
+        node_group.use_fake_user = False
+        return node_group
+
+    @classmethod
+    def build(cls, shader):
+        shader.create_anno_shader()
+        node_group = bpy.data.node_groups[shader.shader_id]
+        node_group[cls.VERSION_PROPERTY] = cls.get_version()
+        return node_group
+
+    @classmethod
+    def build_library(cls, path: Optional[Path] = None) -> Path:
+        """Builds the node groups of all shaders and writes them to the library .blend."""
+        if path is None:
+            path = cls.library_path()
+        node_groups = {cls.get_node_group(shader) for shader in cls.shaders()}
+        bpy.data.libraries.write(str(path), node_groups, fake_user = True)
+        cls.library_unusable = False
+        print(f"Wrote {len(node_groups)} shader node groups (version {cls.get_version()}) to {path}")
+        return path
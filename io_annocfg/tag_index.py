@@ -0,0 +1,112 @@
+from typing import Any, Dict, Optional, Tuple
+
+from bpy.app.handlers import persistent
+
+
+class TagIndex():
+    """tag -> index of the first item with this tag, per collection of the dynamic_properties of an object/material.
+
+    Python attributes cannot be stored on the property group itself, so the index is keyed by the session_uid of the ID
+    (never reused within a session, unlike pointers) and the collection name. Nested groups (dynamic_properties of dynamic_properties)
+    move in memory whenever their parent collection grows and are small, they are searched linearly.
+    The XMLPropertyGroup functions keep the index up to date. Changes from somewhere else are detected on the next lookup:
+    a different collection length or a found item with another tag rebuild the index. Every tag change (panel, scripts)
+    counts up the generation, a miss rebuilds the index once if it was built in an older generation.
+    Cleared after loading a file and undo/redo.
+    """
+    # session_uid -> collection name -> [length, tag -> index, generation]
+    indices: Dict[int, Dict[str, list]] = {}
+    generation = 0
+
+    @classmethod
+    def owner_uid(cls, group) -> Optional[int]:
+        owner = group.id_data
+        owner_group = getattr(owner, "dynamic_properties", None)
+        if owner_group is None or owner_group.as_pointer() != group.as_pointer():
+            return None
+        return owner.session_uid
+
+    @classmethod
+    def build(cls, uid: int, collection_name: str, properties) -> list:
+        index_by_tag = {}
+        for i, item in enumerate(properties):
+            index_by_tag.setdefault(item.tag, i)
+        entry = [len(properties), index_by_tag, cls.generation]
+        cls.indices.setdefault(uid, {})[collection_name] = entry
+        return entry
+
+    @classmethod
+    def lookup(cls, group, collection_name: str, tag: str) -> int:
+        """Returns the index of the first item with this tag or -1."""
+        return cls.find(group, collection_name, tag)[0]
+
+    @classmethod
+    def find(cls, group, collection_name: str, tag: str) -> Tuple[int, Any]:
+        """Returns the index and the first item with this tag or (-1, None).
+        Indexing a collection walks it up to the index, so the item is returned to the caller instead of indexing it twice.
+        """
+        properties = getattr(group, collection_name)
+        uid = cls.owner_uid(group)
+        if uid is None:
+            for i, item in enumerate(properties):
+                if item.tag == tag:
+                    return i, item
+            return -1, None
+        entry = cls.indices.get(uid, {}).get(collection_name)
+        if entry is None or entry[0] != len(properties):
+            entry = cls.build(uid, collection_name, properties)
+        index = entry[1].get(tag, -1)
+        if index < 0 and entry[2] != cls.generation:
+            entry = cls.build(uid, collection_name, properties)
+            index = entry[1].get(tag, -1)
+        if index < 0:
+            return -1, None
+        item = properties[index]
+        if item.tag != tag:
+            entry = cls.build(uid, collection_name, properties)
+            index = entry[1].get(tag, -1)
+            if index < 0:
+                return -1, None
+            item = properties[index]
+        return index, item
+
+    @classmethod
+    def appended(cls, group, collection_name: str, tag: str):
+        """Called after an item with this tag was appended to the collection (and its tag set)."""
+        uid = cls.owner_uid(group)
+        entry = cls.indices.get(uid, {}).get(collection_name)
+        if entry is None:
+            return
+        if entry[0] != len(getattr(group, collection_name)) - 1:
+            del cls.indices[uid][collection_name]
+            return
+        entry[1].setdefault(tag, entry[0])
+        entry[0] += 1
+        # Setting the tag of the new item was the only change since the entry was current.
+        if entry[2] == cls.generation - 1:
+            entry[2] = cls.generation
+
+    @classmethod
+    def invalidate(cls, group, collection_name: Optional[str] = None):
+        """Drops the index of one collection or, without collection_name, of all collections of the group."""
+        uid = cls.owner_uid(group)
+        if uid is None:
+            return
+        if collection_name is None:
+            cls.indices.pop(uid, None)
+        else:
+            cls.indices.get(uid, {}).pop(collection_name, None)
+
+    @classmethod
+    def clear(cls):
+        cls.indices = {}
+
+
+def tag_changed(self, context):
+    """Update function of the tag properties."""
+    TagIndex.generation += 1
+
+
+@persistent
+def clear_tag_indices(*args):
+    TagIndex.clear()
@@ -0,0 +1,116 @@
+import re
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import bpy
+
+from .conversion import convert_to_png, png_path, is_converted, run_conversions
+from .conversion_cache import ConversionCache
+from .prefs import IO_AnnocfgPreferences
+from .texture_registry import TextureRegistry
+
+
+class TextureLOD():
+    """Switches the images of imported materials between the texture quality variants (_0.dds, _1.dds, _2.dds).
+
+    Large scenes can be imported with the low texture quality and then only the materials that matter
+    (selected objects, objects close to the view, a list of materials) get the high quality textures.
+    The image datablocks are kept and only pointed to the .png of the other variant, so the materials do not change.
+    The export does not depend on the variant, all of them are exported as the same .psd path.
+    """
+    QUALITY_PATTERN = re.compile(r"^(.*)_([012])$")
+
+    @classmethod
+    def source_dds(cls, image) -> Optional[Path]:
+        """The .dds file the image has been converted from."""
+        if image.source != 'FILE' or not image.filepath:
+            return None
+        png_fullpath = Path(bpy.path.abspath(image.filepath, library = image.library))
+        source = ConversionCache.source_path(png_fullpath)
+        if source is None:
+            source = png_fullpath.with_suffix(".dds")
+        if cls.QUALITY_PATTERN.match(source.stem) is None:
+            return None
+        return source
+
+    @classmethod
+    def variant(cls, dds_fullpath: Path, quality: str) -> Path:
+        match = cls.QUALITY_PATTERN.match(dds_fullpath.stem)
+        return Path(dds_fullpath.parent, f"{match.group(1)}_{quality}{dds_fullpath.suffix}")
+
+    @classmethod
+    def material_images(cls, materials: Iterable[bpy.types.Material]) -> Set[bpy.types.Image]:
+        images = set()
+        for material in materials:
+            if material is None or material.node_tree is None:
+                continue
+            for node in material.node_tree.nodes:
+                if node.type == 'TEX_IMAGE' and node.image is not None:
+                    images.add(node.image)
+        return images
+
+    @classmethod
+    def object_materials(cls, objects: Iterable[bpy.types.Object]) -> Set[bpy.types.Material]:
+        """Materials of the objects, their children and the objects of instanced collections (subfiles)."""
+        materials = set()
+        visited = set()
+        stack = list(objects)
+        while stack:
+            obj = stack.pop()
+            if obj in visited:
+                continue
+            visited.add(obj)
+            materials.update(slot.material for slot in obj.material_slots if slot.material is not None)
+            stack.extend(obj.children)
+            if obj.instance_type == 'COLLECTION' and obj.instance_collection is not None:
+                stack.extend(obj.instance_collection.all_objects)
+        return materials
+
+    @classmethod
+    def objects_near(cls, location, distance: float) -> List[bpy.types.Object]:
+        return [obj for obj in bpy.context.scene.objects if (obj.matrix_world.translation - location).length <= distance]
+
+    @classmethod
+    def set_quality(cls, images: Iterable[bpy.types.Image], quality: str) -> int:
+        """Points the images to the .png of the given quality, converts missing variants first (in parallel).
+        Images without that variant keep their current one. Returns the number of changed images."""
+        texconv_path = IO_AnnocfgPreferences.get_path_to_texconv()
+        targets: Dict[bpy.types.Image, Tuple[Path, Path]] = {}
+        for image in images:
+            source = cls.source_dds(image)
+            if source is None:
+                continue
+            target = cls.variant(source, quality)
+            if target == source or not target.exists() or TextureRegistry.is_missing(target):
+                continue
+            targets[image] = (target, png_path(target))
+
+        conversions = {dds: png for dds, png in targets.values() if not is_converted(png, [dds])}
+        if conversions and texconv_path.exists():
+            print(f"Converting {len(conversions)} textures")
+            run_conversions([lambda p = dds, o = png: convert_to_png(p, texconv_path, o) for dds, png in conversions.items()])
+            ConversionCache.flush()
+
+        changed = 0
+        for image, (dds, png) in targets.items():
+            if not png.exists():
+                TextureRegistry.add_missing(dds, "conversion failed")
+                continue
+            # Reloads the image.
+            image.filepath = str(png)
+            changed += 1
+        # The images are now found under their new paths.
+        TextureRegistry.images_indexed = False
+        return changed
+
+    @classmethod
+    def apply(cls, high_materials: Iterable[bpy.types.Material], high_quality: str, low_quality: Optional[str] = None) -> Tuple[int, int]:
+        """Switches the images of high_materials to high_quality and, if low_quality is given, all other images to low_quality.
+        Images shared with one of the high_materials stay high. Returns the number of changed (high, low) images."""
+        high_images = cls.material_images(high_materials)
+        changed_high = cls.set_quality(high_images, high_quality)
+        changed_low = 0
+        if low_quality is not None:
+            low_images = cls.material_images(bpy.data.materials) - high_images
+            changed_low = cls.set_quality(low_images, low_quality)
+        return changed_high, changed_low
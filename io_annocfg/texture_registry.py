@@ -0,0 +1,193 @@
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import bpy
+from bpy.app.handlers import persistent
+
+from .prefs import IO_AnnocfgPreferences
+from .utils import data_path_to_absolute_path
+from .conversion import convert_to_png, png_path, is_converted
+from .conversion_cache import ConversionCache
+
+
+class TextureRegistry():
+    """Resolves texture data paths to blender images, once per session.
+
+    Without it, every material that references a texture resolves the path again (rda/mod folder lookups, conversion cache hashing),
+    searches bpy.data.images and, if the .png is missing, runs texconv again, even when the .dds does not exist at all.
+    The registry remembers
+    - the resolved .dds and .png path of every data path,
+    - the loaded image of every .png path,
+    - every texture that is missing or could not be converted, with the reason. These are not tried again in this session.
+    The missing textures are listed by report() at the end of an import, the statistics are counted per import (reset_statistics).
+    Everything is forgotten when another file is loaded and after undo/redo.
+    """
+    # (data path, mod folder) -> (.dds path, .png path)
+    resolved_paths: Dict[Tuple[str, str], Tuple[Path, Path]] = {}
+    # normalized .png path -> image name, like the MaterialCache no image references are kept (they are invalid after undo)
+    images_by_path: Dict[str, str] = {}
+    images_indexed = False
+    # .dds path -> reason
+    missing: Dict[str, str] = {}
+    missing_uses: Dict[str, int] = {}
+    hits = 0
+    loads = 0
+    conversions = 0
+
+    @classmethod
+    def clear(cls):
+        cls.resolved_paths = {}
+        cls.images_by_path = {}
+        cls.images_indexed = False
+        cls.missing = {}
+        cls.missing_uses = {}
+        cls.reset_statistics()
+    
+    @classmethod
+    def reset_statistics(cls):
+        """Called when an import starts, so report() only counts that import."""
+        cls.hits = 0
+        cls.loads = 0
+        cls.conversions = 0
+        cls.missing_uses = {path: 0 for path in cls.missing}
+
+    @classmethod
+    def resolve(cls, dds_data_path: Path) -> Tuple[Path, Path]:
+        """Returns the .dds file and the .png file it is (or will be) converted to."""
+        key = (Path(dds_data_path).as_posix(), bpy.context.scene.anno_mod_folder)
+        paths = cls.resolved_paths.get(key)
+        if paths is None:
+            fullpath = data_path_to_absolute_path(dds_data_path)
+            paths = (fullpath, png_path(fullpath))
+            cls.resolved_paths[key] = paths
+        return paths
+
+    @classmethod
+    def normalized(cls, path) -> str:
+        return os.path.normpath(str(path))
+
+    @classmethod
+    def index_images(cls):
+        cls.images_by_path = {}
+        for image in bpy.data.images:
+            if image.source != 'FILE' or not image.filepath:
+                continue
+            image_path = cls.normalized(bpy.path.abspath(image.filepath, library = image.library))
+            cls.images_by_path.setdefault(image_path, image.name)
+        cls.images_indexed = True
+
+    @classmethod
+    def find_image(cls, png_fullpath: Path) -> Optional[bpy.types.Image]:
+        if not cls.images_indexed:
+            cls.index_images()
+        key = cls.normalized(png_fullpath)
+        name = cls.images_by_path.get(key)
+        if name is not None:
+            image = cls.image_at(name, key)
+            if image is not None:
+                return image
+            # Renamed, removed or pointed to another file since it was indexed.
+            cls.index_images()
+            name = cls.images_by_path.get(key)
+            return cls.image_at(name, key) if name is not None else None
+        # Loaded by something else (f.e. appended with a material), not indexed yet.
+        image = cls.image_at(png_fullpath.name, key)
+        if image is not None:
+            cls.images_by_path[key] = image.name
+        return image
+    
+    @classmethod
+    def image_at(cls, name: str, key: str) -> Optional[bpy.types.Image]:
+        """The image with this name, if it shows the file of the (normalized) path."""
+        image = bpy.data.images.get(name)
+        if image is None or image.source != 'FILE' or cls.normalized(bpy.path.abspath(image.filepath, library = image.library)) != key:
+            return None
+        return image
+
+    @classmethod
+    def add_missing(cls, fullpath: Path, reason: str):
+        key = str(fullpath)
+        if key not in cls.missing:
+            print(f"Missing texture {fullpath}: {reason}")
+            cls.missing_uses[key] = 0
+        cls.missing[key] = reason
+
+    @classmethod
+    def is_missing(cls, fullpath: Path) -> bool:
+        return str(fullpath) in cls.missing
+
+    @classmethod
+    def get_image(cls, dds_data_path: Path) -> Optional[bpy.types.Image]:
+        """Returns the image of the .dds texture (converted to .png), loads and converts it if needed. None if the texture is missing."""
+        fullpath, png_fullpath = cls.resolve(dds_data_path)
+        key = str(fullpath)
+        if key not in cls.missing:
+            image = cls.find_image(png_fullpath)
+            if image is not None:
+                cls.hits += 1
+                return image
+            image = cls.load_image(fullpath, png_fullpath)
+            if image is not None:
+                return image
+        cls.missing_uses[key] += 1
+        return None
+
+    @classmethod
+    def load_image(cls, fullpath: Path, png_fullpath: Path) -> Optional[bpy.types.Image]:
+        if not is_converted(png_fullpath, [fullpath]):
+            if not fullpath.exists():
+                cls.add_missing(fullpath, "file not found")
+                return None
+            if not IO_AnnocfgPreferences.get_path_to_texconv().exists():
+                cls.add_missing(fullpath, "texconv not found")
+                return None
+            cls.conversions += 1
+            success = convert_to_png(fullpath, output = png_fullpath)
+            ConversionCache.flush()
+            if not success:
+                cls.add_missing(fullpath, "conversion failed")
+                return None
+        try:
+            image = bpy.data.images.load(str(png_fullpath))
+        except RuntimeError as ex:
+            cls.add_missing(fullpath, f"cannot load {png_fullpath.name} ({ex})")
+            return None
+        cls.loads += 1
+        cls.images_by_path[cls.normalized(png_fullpath)] = image.name
+        return image
+
+    @classmethod
+    def missing_textures(cls) -> List[Tuple[str, str, int]]:
+        """(.dds path, reason, number of references) of all missing textures, most referenced first."""
+        return sorted([(path, reason, cls.missing_uses.get(path, 0)) for path, reason in cls.missing.items()], key = lambda entry: -entry[2])
+
+    @classmethod
+    def statistics(cls) -> str:
+        return f"Textures: {cls.loads} loaded, {cls.conversions} converted, {cls.hits} reused, {len(cls.missing)} missing"
+
+    @classmethod
+    def report(cls, limit: int = 50) -> str:
+        lines = [cls.statistics()]
+        missing = cls.missing_textures()
+        for path, reason, uses in missing[:limit]:
+            lines.append(f"\t{uses}x {path}: {reason}")
+        if len(missing) > limit:
+            lines.append(f"\t... and {len(missing) - limit} more")
+        return "\n".join(lines)
+
+
+@persistent
+def texture_registry_clear(*args):
+    TextureRegistry.clear()
+
+
+def register():
+    for handlers in [bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post]:
+        handlers.append(texture_registry_clear)
+
+def unregister():
+    for handlers in [bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post]:
+        if texture_registry_clear in handlers:
+            handlers.remove(texture_registry_clear)
+    TextureRegistry.clear()
@@ -5,7 +5,7 @@ from bpy.types import Object as BlenderObject
 import xml.etree.ElementTree as ET
 from pathlib import Path
 from typing import Tuple, List, NewType, Any, Union, Dict, Optional, TypeVar, Type
-import bmesh
+import numpy as np
 from math import radians
 from .prefs import IO_AnnocfgPreferences
 from .utils import *
@@ -92,6 +92,26 @@ class Transform:
         instance.rotation_euler = [obj.rotation_euler.x, obj.rotation_euler.y, obj.rotation_euler.z]
         return instance
     
+    @classmethod
+    def from_prop_grid_texts(cls, position: str, rotation: str, scale: str) -> Transform:
+        """Parses the Position, Rotation (x z y w) and Scale texts of a prop grid instance."""
+        location = [float(s) for s in position.replace(",", ".").split(" ")]
+        rotation = [float(s) for s in rotation.replace(",", ".").split(" ")]
+        rotation = [rotation[3], rotation[0], rotation[1], rotation[2]] #xzyw -> wxzy
+        #rotation = [rotation[1], rotation[2], rotation[3], rotation[0]] #xzyw -> wxzy or something else
+        scale    = [float(s) for s in scale.replace(",", ".").split(" ")]
+        return cls(location, rotation, scale, anno_coords = True)
+    
+    @classmethod
+    def prop_grid_texts(cls, location, rotation, scale) -> Tuple[str, str, str]:
+        """Position, Rotation (x z y w) and Scale texts (in anno coordinates) of a blender transform, for a prop grid instance."""
+        transform = cls(location, rotation, scale, anno_coords = False)
+        transform.convert_to_anno_coords()
+        location = [format_float(f) for f in transform.location]
+        rotation = [format_float(f) for f in[transform.rotation[1], transform.rotation[2], transform.rotation[3], transform.rotation[0]]] #wxzy ->xzyw
+        scale = [format_float(f) for f in transform.scale]
+        return (' '.join(location).replace(".", ","), ' '.join(rotation).replace(".", ","), ' '.join(scale).replace(".", ","))
+    
     def convert_to_blender_coords(self):
         if not self.anno_coords:
             return
@@ -120,25 +140,26 @@ class Transform:
         
         self.anno_coords
     
+    MIRRORED_PROPERTY = "anno_mirrored"
+    
     @classmethod
-    def mirror_mesh(self, obj):
+    def mirror_mesh(cls, obj):
+        """Mirrors the mesh along x. Used for import and export (mirroring twice restores the mesh),
+        the MIRRORED_PROPERTY of the mesh tells whether it is currently mirrored."""
         if not IO_AnnocfgPreferences.mirror_models():
             return
         if not obj.data or not hasattr(obj.data, "vertices"):
             return
-        for v in obj.data.vertices:
-            v.co.x *= -1.0
+        mesh = obj.data
+        co = np.empty(len(mesh.vertices) * 3, dtype = np.float32)
+        mesh.vertices.foreach_get("co", co)
+        co[0::3] *= -1.0
+        mesh.vertices.foreach_set("co", co)
         #Inverting normals for import AND Export they are wrong because of scaling on the x axis.
         #Warn people that this will break exports from .blend files made with an earlier version!!!
-        mesh = obj.data
-        bm = bmesh.new()
-        bm.from_mesh(mesh) # load bmesh
-        for f in bm.faces:
-             f.normal_flip()
-        bm.normal_update() # not sure if req'd
-        bm.to_mesh(mesh)
+        mesh.flip_normals()
         mesh.update()
-        bm.clear() #.. clear before load next
+        mesh[cls.MIRRORED_PROPERTY] = not mesh.get(cls.MIRRORED_PROPERTY, False)
     
     def apply_to(self, object):
         if self.anno_coords:
@@ -152,3 +173,145 @@ class Transform:
             object.rotation_mode = "XYZ"
             object.rotation_euler = self.rotation_euler
         object.scale = self.scale
+
+
+class TransformBatch:
+    """
+    The transforms of many instances (prop grid instances, point cloud points) as (N, 3) location/scale and (N, 4) wxyz rotation arrays.
+    Parses, converts (same axis swap and mirror rules as Transform) and writes/reads them in bulk instead of one object at a time.
+    The results are the same as those of Transform, value for value.
+    """
+    def __init__(self, location: np.ndarray, rotation: np.ndarray, scale: np.ndarray, anno_coords = True):
+        self.location = location
+        self.rotation = rotation
+        self.scale = scale
+        self.anno_coords = anno_coords
+    
+    def __len__(self) -> int:
+        return len(self.location)
+    
+    @classmethod
+    def parse_vectors(cls, texts: List[str], width: int) -> np.ndarray:
+        """Parses texts like "153,76723 0,1976307 31,871208" into an (N, width) array. Texts with a single value are repeated (uniform scale)."""
+        if not texts:
+            return np.zeros((0, width))
+        values = " ".join(texts).replace(",", ".").split(" ")
+        if len(values) != len(texts) * width:
+            rows = [[float(s) for s in text.replace(",", ".").split(" ")] for text in texts]
+            return np.array([row * width if len(row) == 1 else row for row in rows], dtype = np.float64)
+        # float() instead of numpy's string conversion, so the values are exactly the ones Transform gets.
+        return np.fromiter(map(float, values), dtype = np.float64, count = len(values)).reshape(-1, width)
+    
+    @classmethod
+    def from_texts(cls, positions: List[str], rotations: List[str], scales: List[str]) -> TransformBatch:
+        """Position, Rotation (x z y w) and Scale texts of prop grid instances (see Transform.from_prop_grid_texts), in anno coordinates."""
+        rotation = cls.parse_vectors(rotations, 4)[:, [3, 0, 1, 2]] #xzyw -> wxzy
+        return cls(cls.parse_vectors(positions, 3), rotation, cls.parse_vectors(scales, 3), anno_coords = True)
+    
+    def texts(self) -> List[Tuple[str, str, str]]:
+        """Position, Rotation (x z y w) and Scale texts (with decimal commas) of every instance, like Transform.prop_grid_texts."""
+        if not self.anno_coords:
+            self.convert_to_anno_coords()
+        vector_format = "{:.6f} {:.6f} {:.6f}"
+        quaternion_format = "{:.6f} {:.6f} {:.6f} {:.6f}"
+        locations = self.location.tolist()
+        rotations = self.rotation[:, [1, 2, 3, 0]].tolist() #wxzy ->xzyw
+        scales = self.scale.tolist()
+        return [(
+            vector_format.format(*locations[i]).replace(".", ","),
+            quaternion_format.format(*rotations[i]).replace(".", ","),
+            vector_format.format(*scales[i]).replace(".", ","),
+        ) for i in range(len(locations))]
+    
+    def convert_to_blender_coords(self, mirror: Optional[bool] = None) -> TransformBatch:
+        if not self.anno_coords:
+            return self
+        if mirror is None:
+            mirror = IO_AnnocfgPreferences.mirror_models()
+        location = self.location[:, [0, 2, 1]]
+        location[:, 1] = -location[:, 1]
+        rotation = self.rotation[:, [0, 1, 3, 2]]
+        if mirror:
+            location[:, 0] = -location[:, 0]
+            rotation[:, 3] = -rotation[:, 3]
+        self.location = location
+        self.rotation = rotation
+        self.scale = self.scale[:, [0, 2, 1]]
+        self.anno_coords = False
+        return self
+    
+    def convert_to_anno_coords(self, mirror: Optional[bool] = None) -> TransformBatch:
+        if self.anno_coords:
+            return self
+        if mirror is None:
+            mirror = IO_AnnocfgPreferences.mirror_models()
+        location = self.location[:, [0, 2, 1]]
+        location[:, 2] = -location[:, 2]
+        rotation = self.rotation[:, [0, 1, 3, 2]]
+        if mirror:
+            location[:, 0] = -location[:, 0]
+            rotation[:, 2] = -rotation[:, 2]
+        self.location = location
+        self.rotation = rotation
+        self.scale = self.scale[:, [0, 2, 1]]
+        self.anno_coords = True
+        return self
+    
+    def to_points(self, mesh):
+        """Writes the transforms (in blender coordinates) to the vertices (co) and the "rotation" and "scale" point attributes of the mesh."""
+        if self.anno_coords:
+            self.convert_to_blender_coords()
+        if len(mesh.vertices) != len(self):
+            mesh.vertices.add(len(self) - len(mesh.vertices))
+        mesh.vertices.foreach_set("co", self.location.astype(np.float32).ravel())
+        rotation_attribute = mesh.attributes.get("rotation") or mesh.attributes.new("rotation", "QUATERNION", "POINT")
+        rotation_attribute.data.foreach_set("value", self.rotation.astype(np.float32).ravel())
+        scale_attribute = mesh.attributes.get("scale") or mesh.attributes.new("scale", "FLOAT_VECTOR", "POINT")
+        scale_attribute.data.foreach_set("vector", self.scale.astype(np.float32).ravel())
+    
+    @classmethod
+    def from_points(cls, mesh) -> TransformBatch:
+        count = len(mesh.vertices)
+        location = np.empty(3 * count, dtype = np.float32)
+        rotation = np.empty(4 * count, dtype = np.float32)
+        scale = np.empty(3 * count, dtype = np.float32)
+        mesh.vertices.foreach_get("co", location)
+        mesh.attributes["rotation"].data.foreach_get("value", rotation)
+        mesh.attributes["scale"].data.foreach_get("vector", scale)
+        return cls(location.astype(np.float64).reshape(-1, 3), rotation.astype(np.float64).reshape(-1, 4), scale.astype(np.float64).reshape(-1, 3), anno_coords = False)
+    
+    @classmethod
+    def object_indices(cls, objects) -> np.ndarray:
+        """Indices of the objects in bpy.data.objects, foreach_get/foreach_set only work on the whole collection."""
+        index_by_pointer = {obj.as_pointer(): i for i, obj in enumerate(bpy.data.objects)}
+        return np.fromiter((index_by_pointer[obj.as_pointer()] for obj in objects), dtype = np.int64, count = len(objects))
+    
+    def apply_to_objects(self, objects: List[BlenderObject]):
+        """Sets location, rotation (quaternion) and scale of the objects, which are the rows of this batch."""
+        if self.anno_coords:
+            self.convert_to_blender_coords()
+        if not objects:
+            return
+        for obj in objects:
+            obj.rotation_mode = "QUATERNION"
+        indices = self.object_indices(objects)
+        all_objects = bpy.data.objects
+        for attribute, values in (("location", self.location), ("rotation_quaternion", self.rotation), ("scale", self.scale)):
+            width = values.shape[1]
+            buffer = np.empty(len(all_objects) * width, dtype = np.float32)
+            all_objects.foreach_get(attribute, buffer)
+            buffer = buffer.reshape(-1, width)
+            buffer[indices] = values
+            all_objects.foreach_set(attribute, buffer.ravel())
+    
+    @classmethod
+    def from_objects(cls, objects: List[BlenderObject]) -> TransformBatch:
+        """Location, rotation_quaternion and scale of the objects (blender coordinates)."""
+        indices = cls.object_indices(objects)
+        all_objects = bpy.data.objects
+        arrays = []
+        for attribute, width in (("location", 3), ("rotation_quaternion", 4), ("scale", 3)):
+            buffer = np.empty(len(all_objects) * width, dtype = np.float32)
+            all_objects.foreach_get(attribute, buffer)
+            arrays.append(buffer.reshape(-1, width)[indices].astype(np.float64))
+        return cls(arrays[0], arrays[1], arrays[2], anno_coords = False)
@@ -0,0 +1,134 @@
+import io
+import re
+import xml.etree.ElementTree as ET
+from pathlib import Path
+from typing import Iterable, List, Optional, TextIO, Tuple, Union
+
+# A record is either an element or a (tag, text) / (tag, [(child tag, child text), ...]) tuple.
+Record = Union[ET.Element, Tuple[str, Union[None, str, List[Tuple[str, Optional[str]]]]]]
+
+
+class StreamedElement(ET.Element):
+    """Element whose children are not part of the tree, they are produced by an iterable of records while writing.
+    Tuple records are formatted without creating any elements.
+    Only the StreamingXMLWriter writes the records, ET.tostring would write an empty element.
+    """
+    def __init__(self, tag, records: Iterable[Record] = (), attrib = {}, **extra):
+        super().__init__(tag, attrib, **extra)
+        self.records = records
+
+    @classmethod
+    def append_to(cls, parent: ET.Element, tag: str, records: Iterable[Record]) -> "StreamedElement":
+        node = cls(tag, records)
+        parent.append(node)
+        return node
+
+    @classmethod
+    def replace(cls, parent: ET.Element, node: ET.Element, records: Iterable[Record]) -> "StreamedElement":
+        """Replaces node (a child of parent) with a streamed element of the same tag and attributes."""
+        streamed_node = cls(node.tag, records, dict(node.attrib))
+        streamed_node.tail = node.tail
+        parent[list(parent).index(node)] = streamed_node
+        return streamed_node
+
+
+class StreamingXMLWriter():
+    """Writes the tree exactly like ET.indent(tree, space) followed by tree.write(path) would (us-ascii, character references),
+    but the children of StreamedElements are formatted one by one straight into the buffered file.
+    Only the skeleton (everything else) is indented and serialized as a whole, so memory is bounded by the skeleton
+    and not by the number of instances/objects.
+    """
+    SENTINEL = "\x00stream{}\x00"
+    SENTINEL_PATTERN = re.compile("\x00stream([0-9]+)\x00")
+    BUFFER_SIZE = 1024 * 1024
+
+    @classmethod
+    def write(cls, root: ET.Element, path: Union[str, Path], space: str = "\t"):
+        with open(path, "w", encoding = "us-ascii", errors = "xmlcharrefreplace", buffering = cls.BUFFER_SIZE) as f:
+            cls.write_to(root, f, space)
+
+    @classmethod
+    def tostring(cls, root: ET.Element, space: str = "\t") -> str:
+        f = io.StringIO()
+        cls.write_to(root, f, space)
+        return f.getvalue()
+
+    @classmethod
+    def write_to(cls, root: ET.Element, f: TextIO, space: str = "\t"):
+        streamed_nodes, levels = cls.find_streamed_nodes(root)
+        for i, node in enumerate(streamed_nodes):
+            node.text = cls.SENTINEL.format(i)
+        ET.indent(root, space = space)
+        skeleton = ET.tostring(root, encoding = "unicode")
+        for node in streamed_nodes:
+            node.text = None
+        parts = cls.SENTINEL_PATTERN.split(skeleton)
+        del skeleton
+
+        text = parts[0]
+        for k in range(1, len(parts), 2):
+            i = int(parts[k])
+            node = streamed_nodes[i]
+            level = levels[i]
+            following_text = parts[k + 1]
+            records = iter(node.records)
+            record = next(records, None)
+            if record is None:
+                # <Tag></Tag> -> <Tag />, like ET writes elements without text and children.
+                f.write(text[:-1] + " />")
+                text = following_text[len(f"</{node.tag}>"):]
+                continue
+            f.write(text)
+            indentation = "\n" + space * (level + 1)
+            while record is not None:
+                f.write(indentation)
+                f.write(cls.format_record(record, level + 1, space))
+                record = next(records, None)
+            f.write("\n" + space * level)
+            text = following_text
+        f.write(text)
+
+    @classmethod
+    def find_streamed_nodes(cls, root: ET.Element) -> Tuple[List[StreamedElement], List[int]]:
+        streamed_nodes = []
+        levels = []
+        stack = [(root, 0)]
+        while stack:
+            node, level = stack.pop()
+            if isinstance(node, StreamedElement):
+                streamed_nodes.append(node)
+                levels.append(level)
+                continue
+            stack.extend((child, level + 1) for child in node)
+        return streamed_nodes, levels
+
+    @classmethod
+    def escape(cls, text: str) -> str:
+        if "&" in text:
+            text = text.replace("&", "&amp;")
+        if "<" in text:
+            text = text.replace("<", "&lt;")
+        if ">" in text:
+            text = text.replace(">", "&gt;")
+        return text
+
+    @classmethod
+    def format_leaf(cls, tag: str, text: Optional[str]) -> str:
+        if not text:
+            return f"<{tag} />"
+        return f"<{tag}>{cls.escape(text)}</{tag}>"
+
+    @classmethod
+    def format_record(cls, record: Record, level: int, space: str) -> str:
+        if isinstance(record, ET.Element):
+            record.tail = None
+            ET.indent(record, space = space, level = level)
+            return ET.tostring(record, encoding = "unicode")
+        tag, content = record
+        if content is None or isinstance(content, str):
+            return cls.format_leaf(tag, content)
+        if not content:
+            return f"<{tag} />"
+        indentation = "\n" + space * (level + 1)
+        children = "".join([indentation + cls.format_leaf(child_tag, child_text) for child_tag, child_text in content])
+        return f"<{tag}>{children}\n{space * level}</{tag}>"
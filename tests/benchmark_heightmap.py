@@ -0,0 +1,165 @@
+"""Timing of the island terrain (IslandFile.create_terrain) and IfoMeshHeightmap against the former per-vertex loops,
+which are reproduced here. Also checks that both give the same vertices and faces.
+
+Needs blender, run with `blender -b -P tests/benchmark_heightmap.py` or with the bpy module: `python tests/benchmark_heightmap.py`.
+"""
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import bpy
+import numpy as np
+import io_annocfg
+from io_annocfg.anno_objects import IslandFile, IfoMeshHeightmap
+from io_annocfg.utils import get_text, format_float
+
+# Coarse heightmap of a large island and the heightmap of a large building.
+TERRAIN_SIZE = 1024
+IFO_SIZE = 256
+GRID_SIZE = 8192 * 0.03125
+MAX_HEIGHT = 8192
+
+
+def timed(name, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"{name:<45} {(time.perf_counter() - start) * 1000:9.1f} ms")
+    return result
+
+
+def smooth_heights(width, height, maximum):
+    """Random hills instead of noise, like a real heightmap."""
+    x, y = np.meshgrid(np.linspace(0, 1, width), np.linspace(0, 1, height))
+    heights = np.zeros_like(x)
+    rng = np.random.default_rng(0)
+    for _ in range(20):
+        cx, cy, radius = rng.random(3)
+        heights += np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (0.02 + radius * 0.05))
+    return (heights / heights.max() * maximum).ravel()
+
+
+def old_terrain(width, height, size, map_text):
+    """The landscape add-on grid (ant_landscape grid_gen) followed by the former loop of IslandFile.xml_to_blender."""
+    data = [int(s) for s in map_text.split(" ")]
+    verts = []
+    faces = []
+    for i in range(width):
+        x = size * (i / (width - 1) - 1 / 2)
+        for j in range(height):
+            y = size * (j / (height - 1) - 1 / 2)
+            verts.append((x, y, 0.0))
+    count = 0
+    for i in range(height * (width - 1)):
+        if count < height - 1:
+            faces.append((i + 1, i, i + height, i + height + 1))
+            count += 1
+        else:
+            count = 0
+    mesh = bpy.data.meshes.new("Landscape")
+    mesh.from_pydata(verts, [], faces)
+    obj = bpy.data.objects.new(mesh.name, mesh)
+    bpy.context.scene.collection.objects.link(obj)
+    for i, vert in enumerate(obj.data.vertices):
+        vert.co.z = data[i] / MAX_HEIGHT * 32
+        vert.co.x *= -1
+    return obj
+
+
+def new_terrain(width, height, size, map_text):
+    data = np.fromstring(map_text, dtype = np.float32, sep = " ")
+    return IslandFile.create_terrain(width, height, size, size, data / MAX_HEIGHT * 32)
+
+
+def ifo_node(width, height):
+    node = ET.fromstring(f"""<MeshHeightmap><MaxHeight>4</MaxHeight><StartPos><x>-8</x><y>-8</y></StartPos>
+        <StepSize><x>0.0625</x><y>0.0625</y></StepSize><Heightmap><Width>{width}</Width><Height>{height}</Height><Map/></Heightmap></MeshHeightmap>""")
+    map_node = node.find("Heightmap/Map")
+    for z in smooth_heights(width, height, 4.0).tolist():
+        ET.SubElement(map_node, "i").text = format_float(z)
+    return node
+
+
+def old_ifo_heightmap(node):
+    """The former IfoMeshHeightmap.add_blender_object_to_scene."""
+    startx = float(get_text(node, "StartPos/x"))
+    starty = float(get_text(node, "StartPos/y"))
+    stepx = float(get_text(node, "StepSize/x"))
+    stepy = float(get_text(node, "StepSize/y"))
+    width = int(get_text(node, "Heightmap/Width"))
+    height = int(get_text(node, "Heightmap/Height"))
+    heightdata = [float(s.text) for s in node.findall("Heightmap/Map/i")]
+    node.find("Heightmap").remove(node.find("Heightmap/Map"))
+    mesh = bpy.data.meshes.new("MeshHeightmap")
+    obj = bpy.data.objects.new(mesh.name, mesh)
+    bpy.data.collections.get("Collection").objects.link(obj)
+    verts = []
+    i = 0
+    for a in range(height):
+        for b in range(width):
+            verts.append((startx + b * stepx, starty + a * stepy, heightdata[i]))
+            i += 1
+    mesh.from_pydata(verts, [], [])
+    for i, vert in enumerate(obj.data.vertices):
+        vert.co.y *= -1
+        vert.co.x *= -1
+    return obj
+
+
+def old_ifo_export(obj):
+    map_node = ET.Element("Map")
+    for vert in obj.data.vertices:
+        ET.SubElement(map_node, "i").text = format_float(vert.co.z)
+    return [i.text for i in map_node]
+
+
+def new_ifo_export(obj):
+    """The heights as IfoMeshHeightmap.blender_to_xml reads them."""
+    verts = np.empty(len(obj.data.vertices) * 3, dtype = np.float32)
+    obj.data.attributes["position"].data.foreach_get("vector", verts)
+    return [format_float(z) for z in verts[2::3].tolist()]
+
+
+def vertices(obj):
+    co = np.empty(len(obj.data.vertices) * 3, dtype = np.float32)
+    obj.data.vertices.foreach_get("co", co)
+    return co
+
+
+def faces(obj):
+    """Vertex cycles, starting at the smallest index."""
+    result = set()
+    for polygon in obj.data.polygons:
+        cycle = list(polygon.vertices)
+        start = cycle.index(min(cycle))
+        result.add(tuple(cycle[start:] + cycle[:start]))
+    return result
+
+
+def main():
+    io_annocfg.register()
+
+    print(f"Island terrain {TERRAIN_SIZE}x{TERRAIN_SIZE}")
+    map_text = " ".join(str(int(h)) for h in smooth_heights(TERRAIN_SIZE, TERRAIN_SIZE, MAX_HEIGHT))
+    old = timed("per-vertex loop (landscape grid)", lambda: old_terrain(TERRAIN_SIZE, TERRAIN_SIZE, GRID_SIZE, map_text))
+    new = timed("create_terrain (foreach_set)", lambda: new_terrain(TERRAIN_SIZE, TERRAIN_SIZE, GRID_SIZE, map_text))
+    assert np.allclose(vertices(old), vertices(new), atol = 1e-4)
+    assert faces(old) == faces(new)
+
+    print(f"IfoMeshHeightmap {IFO_SIZE}x{IFO_SIZE}")
+    node = ifo_node(IFO_SIZE, IFO_SIZE)
+    old = timed("per-vertex loop", lambda: old_ifo_heightmap(node))
+    node = ifo_node(IFO_SIZE, IFO_SIZE)
+    new = timed("add_blender_object_to_scene (foreach_set)", lambda: IfoMeshHeightmap.add_blender_object_to_scene(node))
+    assert np.allclose(vertices(old), vertices(new), atol = 1e-5)
+    old_texts = timed("export, per-vertex loop", lambda: old_ifo_export(old))
+    new_texts = timed("export, foreach_get", lambda: new_ifo_export(new))
+    assert old_texts == new_texts
+
+    io_annocfg.unregister()
+
+
+if __name__ == "__main__":
+    main()
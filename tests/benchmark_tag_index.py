@@ -0,0 +1,89 @@
+"""Micro-benchmark of the dynamic properties of one object with 10k tags: from_node, to_node and lookups with the TagIndex
+against a linear search over the collections.
+
+Needs blender, run with `blender -b -P tests/benchmark_tag_index.py` or with the bpy module: `python tests/benchmark_tag_index.py`.
+"""
+import sys
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import bpy
+import io_annocfg
+from io_annocfg.tag_index import TagIndex
+
+COUNT = 10000
+
+
+def measure(name, function, repeat = 3):
+    best = min(timed(function) for _ in range(repeat))
+    print(f"{name:<40} {best * 1000:9.1f} ms")
+    return best
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def linear_lookup(group, collection_name, tag):
+    for i, item in enumerate(getattr(group, collection_name)):
+        if item.tag == tag:
+            return i
+    return -1
+
+
+def make_node():
+    node = ET.Element("Config")
+    for i in range(COUNT):
+        kind = i % 4
+        if kind == 0:
+            ET.SubElement(node, f"String{i}").text = f"text{i}"
+        elif kind == 1:
+            ET.SubElement(node, f"Int{i}").text = str(i)
+        elif kind == 2:
+            ET.SubElement(node, f"Float{i}").text = f"{i}.5"
+        else:
+            ET.SubElement(node, f"FileName{i}").text = f"data/graphics/file{i}.rdm"
+    return node
+
+
+def main():
+    io_annocfg.register()
+    node = make_node()
+    string_tags = [child.tag for child in node if child.tag.startswith("String")]
+    obj = bpy.data.objects.new("benchmark", None)
+    group = obj.dynamic_properties
+
+    def from_node():
+        group.reset()
+        group.from_node(node, compact = False)
+    def set_per_child():
+        group.reset()
+        for child in node:
+            group.set(child.tag, child.text)
+    measure("set x10000 (one per child)", set_per_child)
+    measure("from_node", from_node)
+    measure("to_node", lambda: group.to_node(ET.Element("Config")))
+
+    measure("get_string x2500 (linear)", lambda: [linear_lookup(group, "string_properties", tag) for tag in string_tags])
+    TagIndex.clear()
+    measure("get_string x2500 (index, incl. build)", lambda: [group.get_string(tag) for tag in string_tags], repeat = 1)
+    measure("get_string x2500 (index)", lambda: [group.get_string(tag) for tag in string_tags])
+    measure("set replace x2500 (index)", lambda: [group.set(tag, "changed", replace = True) for tag in string_tags])
+    measure("get_string miss x2500 (index)", lambda: [group.get_string(tag + "Missing") for tag in string_tags])
+
+    group.string_properties[-1].tag = "Renamed"
+    assert group.get_string("Renamed") is not None
+    group.string_properties.move(0, len(group.string_properties) - 1)
+    assert group.get_string(string_tags[0]) is not None
+    measure("get_string after rename (rebuild)", lambda: group.get_string("Renamed"), repeat = 1)
+
+    io_annocfg.unregister()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""The add-on runs inside blender. For the tests, bpy is replaced by a minimal stub and the io_annocfg modules are
+imported without io_annocfg/__init__.py (which registers the whole add-on), so only modules that do not need blender
+beyond the stub can be tested."""
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+ADDON_PATH = Path(__file__).parent.parent / "io_annocfg"
+
+
+class StubObject:
+    """Stores location, rotation_quaternion and scale as float32, like blender."""
+    def __init__(self):
+        self.location = (0.0, 0.0, 0.0)
+        self.rotation_quaternion = (1.0, 0.0, 0.0, 0.0)
+        self.scale = (1.0, 1.0, 1.0)
+        self.rotation_mode = "XYZ"
+
+    def __setattr__(self, name, value):
+        if name in ("location", "rotation_quaternion", "scale"):
+            value = np.array(value, dtype = np.float64).astype(np.float32)
+        object.__setattr__(self, name, value)
+
+    def as_pointer(self):
+        return id(self)
+
+
+class StubCollection(list):
+    """bpy_prop_collection.foreach_get/foreach_set over the items."""
+    def foreach_get(self, attribute, buffer):
+        if len(self):
+            buffer[:] = np.concatenate([np.ravel(getattr(item, attribute)) for item in self])
+
+    def foreach_set(self, attribute, buffer):
+        if not len(self):
+            return
+        width = np.size(getattr(self[0], attribute))
+        for item, value in zip(self, np.reshape(buffer, (-1, width))):
+            setattr(item, attribute, value)
+
+
+def install_bpy_stub():
+    bpy = types.ModuleType("bpy")
+    bpy_types = types.ModuleType("bpy.types")
+    bpy_props = types.ModuleType("bpy.props")
+    bpy_app = types.ModuleType("bpy.app")
+    bpy_handlers = types.ModuleType("bpy.app.handlers")
+    bpy_handlers.persistent = lambda function: function
+    bpy_app.handlers = bpy_handlers
+    bpy_types.AddonPreferences = object
+    bpy_types.Scene = object
+    bpy_types.Object = StubObject
+    for name in ["StringProperty", "EnumProperty", "BoolProperty", "FloatProperty", "IntProperty"]:
+        setattr(bpy_props, name, lambda **kwargs: None)
+    bpy.types = bpy_types
+    bpy.props = bpy_props
+    bpy.app = bpy_app
+    bpy.data = types.SimpleNamespace(objects = StubCollection())
+    sys.modules.update({"bpy": bpy, "bpy.types": bpy_types, "bpy.props": bpy_props, "bpy.app": bpy_app, "bpy.app.handlers": bpy_handlers})
+
+    package = types.ModuleType("io_annocfg")
+    package.__path__ = [str(ADDON_PATH)]
+    sys.modules["io_annocfg"] = package
+
+
+install_bpy_stub()
@@ -0,0 +1,101 @@
+"""TagIndex must find the same item as a linear search, also after changes it was not told about."""
+import pytest
+
+from io_annocfg.tag_index import TagIndex, tag_changed
+
+
+class StubItem:
+    """Tag property with update = tag_changed."""
+    def __init__(self, tag):
+        self.__dict__["tag"] = tag
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name == "tag":
+            tag_changed(self, None)
+
+
+class StubGroup:
+    def __init__(self, id_data = None):
+        self.string_properties = []
+        self.id_data = id_data
+
+    def as_pointer(self):
+        return id(self)
+
+
+class StubID:
+    next_uid = 1
+
+    def __init__(self):
+        self.session_uid = StubID.next_uid
+        StubID.next_uid += 1
+        self.dynamic_properties = StubGroup(self)
+
+
+@pytest.fixture
+def group():
+    TagIndex.clear()
+    group = StubID().dynamic_properties
+    group.string_properties.extend(StubItem(f"Tag{i}") for i in range(10))
+    return group
+
+
+def test_lookup(group):
+    assert TagIndex.lookup(group, "string_properties", "Tag3") == 3
+    assert TagIndex.lookup(group, "string_properties", "Missing") == -1
+    index, item = TagIndex.find(group, "string_properties", "Tag7")
+    assert index == 7 and item is group.string_properties[7]
+
+
+def test_duplicate_tags_find_first(group):
+    group.string_properties[5].tag = "Tag2"
+    assert TagIndex.lookup(group, "string_properties", "Tag2") == 2
+
+
+def test_rename(group):
+    assert TagIndex.lookup(group, "string_properties", "Tag3") == 3
+    group.string_properties[3].tag = "Renamed"
+    assert TagIndex.lookup(group, "string_properties", "Renamed") == 3
+    assert TagIndex.lookup(group, "string_properties", "Tag3") == -1
+
+
+def test_reorder(group):
+    assert TagIndex.lookup(group, "string_properties", "Tag0") == 0
+    properties = group.string_properties
+    properties.append(properties.pop(0))
+    assert TagIndex.lookup(group, "string_properties", "Tag0") == 9
+    assert TagIndex.lookup(group, "string_properties", "Tag1") == 0
+
+
+def test_appended(group):
+    assert TagIndex.lookup(group, "string_properties", "New") == -1
+    group.string_properties.append(StubItem("New"))
+    TagIndex.appended(group, "string_properties", "New")
+    entry = TagIndex.indices[group.id_data.session_uid]["string_properties"]
+    assert entry[2] == TagIndex.generation
+    assert TagIndex.lookup(group, "string_properties", "New") == 10
+
+
+def test_miss_does_not_rebuild_without_changes(group, monkeypatch):
+    assert TagIndex.lookup(group, "string_properties", "Missing") == -1
+    builds = []
+    monkeypatch.setattr(TagIndex, "build", classmethod(lambda cls, *args: builds.append(args)))
+    assert TagIndex.lookup(group, "string_properties", "Missing") == -1
+    assert builds == []
+
+
+def test_nested_group_is_searched_linearly(group):
+    nested = StubGroup(group.id_data)
+    nested.string_properties.append(StubItem("Nested"))
+    assert TagIndex.lookup(nested, "string_properties", "Nested") == 0
+    assert group.id_data.session_uid not in TagIndex.indices
+
+
+def test_invalidate(group):
+    TagIndex.lookup(group, "string_properties", "Tag0")
+    TagIndex.invalidate(group, "string_properties")
+    assert "string_properties" not in TagIndex.indices[group.id_data.session_uid]
+    TagIndex.lookup(group, "string_properties", "Tag0")
+    TagIndex.invalidate(group)
+    assert group.id_data.session_uid not in TagIndex.indices
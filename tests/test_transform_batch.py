@@ -0,0 +1,124 @@
+"""TransformBatch must give exactly the same results as converting every instance with Transform."""
+from contextlib import contextmanager
+
+import pytest
+
+np = pytest.importorskip("numpy")
+hypothesis = pytest.importorskip("hypothesis")
+from hypothesis import given, settings, strategies as st
+
+import bpy
+from io_annocfg.prefs import IO_AnnocfgPreferences
+from io_annocfg.transform import Transform, TransformBatch
+from conftest import StubCollection, StubObject
+
+# float32 values, the precision blender stores transforms with, and the special cases.
+values = st.floats(-1e6, 1e6, allow_nan = False, width = 32) | st.sampled_from([0.0, -0.0, 1.0, -1.0])
+# Anno writes the values with different precisions.
+formats = st.sampled_from([repr, "{:.7g}".format, "{:.6f}".format, "{:.9g}".format])
+
+def anno_text(vector, value_format) -> str:
+    return " ".join(value_format(value) for value in vector).replace(".", ",")
+
+# (Position, Rotation, Scale) texts of an instance
+instance = st.tuples(
+    st.lists(values, min_size = 3, max_size = 3),
+    st.lists(values, min_size = 4, max_size = 4),
+    st.lists(values, min_size = 3, max_size = 3),
+    formats,
+).map(lambda row: (anno_text(row[0], row[3]), anno_text(row[1], row[3]), anno_text(row[2], row[3])))
+instances = st.lists(instance, max_size = 20)
+mirror_settings = pytest.mark.parametrize("mirror", [False, True], ids = ["no_mirror", "mirror"])
+
+
+@contextmanager
+def mirror_models(mirror: bool):
+    """The scalar Transform reads the setting from the preferences."""
+    original = IO_AnnocfgPreferences.__dict__["mirror_models"]
+    IO_AnnocfgPreferences.mirror_models = classmethod(lambda cls: mirror)
+    try:
+        yield
+    finally:
+        IO_AnnocfgPreferences.mirror_models = original
+
+def columns(texts):
+    return [text[0] for text in texts], [text[1] for text in texts], [text[2] for text in texts]
+
+def as_bytes(vector) -> bytes:
+    return np.array(vector, dtype = np.float64).tobytes()
+
+
+@mirror_settings
+@settings(max_examples = 200, deadline = None)
+@given(texts = instances)
+def test_to_blender_coords(mirror, texts):
+    with mirror_models(mirror):
+        batch = TransformBatch.from_texts(*columns(texts)).convert_to_blender_coords(mirror)
+        for i, (position, rotation, scale) in enumerate(texts):
+            transform = Transform.from_prop_grid_texts(position, rotation, scale)
+            transform.convert_to_blender_coords()
+            assert as_bytes(transform.location) == batch.location[i].tobytes()
+            assert as_bytes(transform.rotation) == batch.rotation[i].tobytes()
+            assert as_bytes(transform.scale) == batch.scale[i].tobytes()
+
+
+@mirror_settings
+@settings(max_examples = 200, deadline = None)
+@given(texts = instances)
+def test_to_anno_coords(mirror, texts):
+    with mirror_models(mirror):
+        blender_batch = TransformBatch.from_texts(*columns(texts)).convert_to_blender_coords(mirror)
+        batch = TransformBatch(blender_batch.location, blender_batch.rotation, blender_batch.scale, anno_coords = False).convert_to_anno_coords(mirror)
+        for i in range(len(texts)):
+            transform = Transform(blender_batch.location[i].tolist(), blender_batch.rotation[i].tolist(), blender_batch.scale[i].tolist(), anno_coords = False)
+            transform.convert_to_anno_coords()
+            assert as_bytes(transform.location) == batch.location[i].tobytes()
+            assert as_bytes(transform.rotation) == batch.rotation[i].tobytes()
+            assert as_bytes(transform.scale) == batch.scale[i].tobytes()
+
+
+@mirror_settings
+@settings(max_examples = 200, deadline = None)
+@given(texts = instances)
+def test_texts(mirror, texts):
+    with mirror_models(mirror):
+        blender_batch = TransformBatch.from_texts(*columns(texts)).convert_to_blender_coords(mirror)
+        batch = TransformBatch(blender_batch.location, blender_batch.rotation, blender_batch.scale, anno_coords = False)
+        expected = [Transform.prop_grid_texts(blender_batch.location[i].tolist(), blender_batch.rotation[i].tolist(), blender_batch.scale[i].tolist()) for i in range(len(texts))]
+        assert batch.convert_to_anno_coords(mirror).texts() == expected
+
+
+@mirror_settings
+@settings(max_examples = 50, deadline = None)
+@given(texts = instances)
+def test_objects_round_trip(mirror, texts):
+    with mirror_models(mirror):
+        # Objects that are not part of the batch must not change.
+        bpy_objects = bpy.data.objects = StubCollection()
+        bpy_objects[:] = [StubObject() for _ in range(len(texts) + 2)]
+        targets = list(reversed(bpy_objects[1:len(texts) + 1]))
+        scalar_objects = [StubObject() for _ in texts]
+        for obj, (position, rotation, scale) in zip(scalar_objects, texts):
+            Transform.from_prop_grid_texts(position, rotation, scale).apply_to(obj)
+
+        TransformBatch.from_texts(*columns(texts)).apply_to_objects(targets)
+        for scalar_obj, obj in zip(scalar_objects, targets):
+            assert obj.rotation_mode == "QUATERNION"
+            for attribute in ("location", "rotation_quaternion", "scale"):
+                assert getattr(scalar_obj, attribute).tobytes() == getattr(obj, attribute).tobytes()
+        for untouched in (bpy_objects[0], bpy_objects[-1]):
+            assert untouched.rotation_mode == "XYZ"
+
+        expected = [Transform.prop_grid_texts(obj.location.tolist(), obj.rotation_quaternion.tolist(), obj.scale.tolist()) for obj in scalar_objects]
+        assert TransformBatch.from_objects(targets).texts() == expected
+
+
+def test_uniform_scale():
+    batch = TransformBatch.from_texts(["0,0 0,0 0,0", "0,0 0,0 0,0"], ["0,0 0,0 0,0 1,0"] * 2, ["1,5", "1,0 2,0 3,0"])
+    assert batch.scale.tolist() == [[1.5, 1.5, 1.5], [1.0, 2.0, 3.0]]
+
+
+def test_empty():
+    batch = TransformBatch.from_texts([], [], []).convert_to_blender_coords(True)
+    assert len(batch) == 0
+    assert batch.convert_to_anno_coords(True).texts() == []